@@ -0,0 +1,153 @@
+"""
+JWT authentication that resolves users from a cache.
+
+Users are kept in a bounded, per-process TTL/LRU cache. Each entry is stamped
+with a per-user version counter held in the shared Django cache
+(``JWT_AUTH_CACHE_ALIAS``); ``api.signals`` bumps the counter when the user
+is saved or deleted, so every process drops its stale entry on the next
+request. Checking the counter costs one cache round trip instead of a query.
+
+Like ``JWTAuthentication``, access tokens are not checked against the
+blacklist: it only holds refresh tokens, access tokens stay valid until they
+expire.
+
+Caching blacklist answers is out of scope: only refresh tokens are looked up
+in the blacklist, by simplejwt's ``TokenRefreshSerializer`` once per refresh
+(with ``BLACKLIST_AFTER_ROTATION``, along with the rotation writes), which
+is once per access token lifetime rather than once per request, and
+blacklisting a token invalidates nothing here.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def user_version_key(user_id):
+    return f'auth:user:{user_id}:version'
+
+
+def get_auth_cache():
+    """Cache holding the version counters"""
+    return caches[settings.JWT_AUTH_CACHE_ALIAS]
+
+
+def get_versions(keys):
+    """
+    Returns the current value of each version counter.
+
+    Missing counters start from the current time in milliseconds, so that a
+    counter lost to eviction never comes back to a value cached entries carry.
+    """
+    cache = get_auth_cache()
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+
+    if missing:
+        now = int(time.time() * 1000)
+        for key in missing:
+            cache.add(key, now, timeout=None)
+        versions.update(cache.get_many(missing))
+
+    return versions
+
+
+def bump_version(key):
+    """Invalidates every entry stamped with the counter"""
+    cache = get_auth_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The counter was evicted; the next read starts a fresh one
+        pass
+
+
+class TTLCache:
+    """Thread-safe mapping with a maximum size (least recently used go first) and entry lifetime"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """The value stored for ``key`` with this ``version``, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, entry_version, expires = entry
+            if entry_version != version or expires < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (value, version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = TTLCache(settings.JWT_USER_CACHE_SIZE, settings.JWT_USER_CACHE_TTL)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication`` that loads users from ``user_cache``; same checks,
+    no queries once the cache is warm.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        key = user_version_key(user_id)
+        user = self.load_user(user_id, get_versions([key])[key])
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+    def load_user(self, user_id, version):
+        """The user with this id, from the cache when its version still matches"""
+        user = user_cache.get(user_id, version)
+
+        if user is None:
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            user_cache.set(user_id, version, user)
+
+        # Requests must not share (and mutate) the cached instance
+        return copy.copy(user)
+
+
+def clear_caches():
+    """Empty the per-process caches of this process"""
+    user_cache.clear()
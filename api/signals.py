@@ -0,0 +1,15 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.authentication import bump_version, user_version_key
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the cached user (e.g. after deactivation or a password change) once the change is committed"""
+    transaction.on_commit(partial(bump_version, user_version_key(instance.pk)))
@@ -0,0 +1,309 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from api.authentication import TTLCache, clear_caches as clear_auth_caches
+from api.v1.serializers import ProductSerializer, ValuesSerializer
+from app.catalog import get_catalog_cache
+from app.models import Order, OrderProduct, Product, Payment
+from app.testing import QueryBudgetMixin, force_jwt_login
+
+
+class CachedJWTAuthenticationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        clear_auth_caches()
+        self.token = AccessToken.for_user(self.user)
+
+    def get(self, token=None):
+        return self.client.get(reverse('orders'), HTTP_AUTHORIZATION=f'Bearer {token or self.token}')
+
+    def auth_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.get()
+        return response.status_code, [query['sql'] for query in context.captured_queries if 'app_order' not in query['sql']]
+
+    def test_warm_requests_do_not_query_users(self):
+        status, queries = self.auth_queries()
+        self.assertEqual(status, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.auth_queries(), (200, []))
+
+    def test_deactivation_is_seen_on_the_next_request(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.user.pk).update(is_active=False)
+            User.objects.get(pk=self.user.pk).save()
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_blacklisting_refresh_tokens_keeps_cached_users(self):
+        self.get()
+        # As on logout or refresh token rotation
+        with self.captureOnCommitCallbacks(execute=True):
+            RefreshToken.for_user(self.user).blacklist()
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+        self.assertEqual(self.auth_queries(), (200, []))
+
+    def test_user_cache_is_bounded(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        for key in range(3):
+            cache.set(key, 1, key)
+        self.assertIsNone(cache.get(0, 1))
+        self.assertEqual(cache.get(2, 1), 2)
+        self.assertIsNone(cache.get(2, 2))
+
+
+class OrdersCreateAPITests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', price=Decimal('1.25') * (i + 1), currency=Product.Currency.UZS)
+            for i in range(200)
+        ])
+
+    def setUp(self):
+        super().setUp()
+        clear_auth_caches()
+
+    def post(self, data, authenticated=True):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'} if authenticated else {}
+        return self.client.post(reverse('orders'), data, content_type='application/json', **headers)
+
+    def lines(self, count, quantity=2):
+        return [{'product': product.id, 'quantity': quantity} for product in self.products[:count]]
+
+    def test_creates_order_with_totals_from_the_database(self):
+        response = self.post({'lines': self.lines(3)})
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['total_amount'], '15.00')
+        self.assertEqual(data['total_tiyins'], 1500)
+        order = Order.objects.get(pk=data['id'])
+        self.assertEqual(order.user, self.user)
+        self.assertEqual(order.orderproduct_set.count(), 3)
+        self.assertEqual(order.total_amount, Decimal('15.00'))
+
+    def test_creates_many_orders_at_once(self):
+        response = self.post({'orders': [{'lines': self.lines(1)}, {'lines': self.lines(2, quantity=1)}]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([order['total_amount'] for order in response.json()], ['2.50', '3.75'])
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 2)
+
+    def test_query_count_does_not_depend_on_lines(self):
+        # Warm the authentication caches
+        self.post({'lines': self.lines(1)})
+        with CaptureQueriesContext(connection) as few:
+            self.assertQueryBudget(self.post({'lines': self.lines(2)}))
+        with CaptureQueriesContext(connection) as many:
+            self.assertQueryBudget(self.post({'lines': self.lines(150)}))
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(OrderProduct.objects.count(), 153)
+
+    def test_unknown_products_create_nothing(self):
+        response = self.post({'lines': self.lines(2) + [{'product': 999999, 'quantity': 1}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'product': ['Unknown products: 999999']})
+        self.assertFalse(Order.objects.exists())
+
+    def test_rejects_invalid_lines(self):
+        self.assertEqual(self.post({'lines': []}).status_code, 400)
+        self.assertEqual(self.post({'lines': [{'product': self.products[0].id, 'quantity': 0}]}).status_code, 400)
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.post({'lines': self.lines(1)}, authenticated=False).status_code, 401)
+
+
+class OrderHistoryAPITests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+        cls.other = User.objects.create_user('other')
+        product = Product.objects.create(name='Apple', price=Decimal('2.00'), currency=Product.Currency.UZS)
+        cls.orders = []
+        for index in range(6):
+            order = Order.objects.create(user=cls.user, status='PAID' if index % 2 else 'PENDING')
+            for __ in range(index + 1):
+                OrderProduct.objects.create(order=order, product=product, quantity=1)
+            Payment.create_for_order(order)
+            cls.orders.append(order)
+        Order.objects.filter(pk=cls.orders[0].pk).update(created_at=timezone.now() - timedelta(days=30))
+        Order.objects.create(user=cls.other)
+
+    def setUp(self):
+        super().setUp()
+        clear_auth_caches()
+
+    def get(self, url, **params):
+        return self.client.get(url, params, HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_lists_own_orders_newest_first(self):
+        response = self.get(reverse('orders'))
+        self.assertQueryBudget(response)
+        results = response.json()['results']
+        self.assertEqual([order['id'] for order in results], [order.id for order in reversed(self.orders)])
+        self.assertEqual(len(results[0]['lines']), 6)
+        self.assertEqual(results[0]['lines'][0]['product']['name'], 'Apple')
+        self.assertEqual(results[0]['payments'][0]['status'], 'PENDING')
+
+    def test_pages_cost_a_constant_number_of_queries(self):
+        # Warm the authentication caches
+        self.get(reverse('orders'))
+        with CaptureQueriesContext(connection) as small:
+            first = self.get(reverse('orders'), page_size=1)
+        with CaptureQueriesContext(connection) as large:
+            self.get(reverse('orders'), page_size=5)
+        self.assertEqual(len(small), len(large))
+
+        ids, url = [], reverse('orders') + '?page_size=2'
+        while url:
+            data = self.get(url).json()
+            ids += [order['id'] for order in data['results']]
+            url = data['next']
+        self.assertEqual(ids, [order.id for order in reversed(self.orders)])
+        self.assertEqual(first.json()['results'][0]['id'], self.orders[-1].id)
+
+    def test_filters_by_status_and_date_range(self):
+        paid = self.get(reverse('orders'), status='PAID').json()['results']
+        self.assertEqual({order['status'] for order in paid}, {'PAID'})
+        self.assertEqual(len(paid), 3)
+
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        recent = self.get(reverse('orders'), created_at_after=since).json()['results']
+        self.assertNotIn(self.orders[0].id, [order['id'] for order in recent])
+        self.assertEqual(len(recent), 5)
+
+    def test_detail(self):
+        order = self.orders[2]
+        response = self.get(reverse('order_detail', args=[order.id]))
+        self.assertQueryBudget(response)
+        self.assertEqual(response.json()['total_amount'], '6.00')
+        self.assertEqual(len(response.json()['lines']), 3)
+
+    def test_other_users_orders_are_hidden(self):
+        order = Order.objects.get(user=self.other)
+        self.assertEqual(self.get(reverse('order_detail', args=[order.id])).status_code, 404)
+
+
+class ProductsListAPITests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        Product.objects.bulk_create([
+            Product(name=f'Product {i}', price=Decimal('1.00') + i, currency=Product.Currency.UZS)
+            for i in range(25)
+        ])
+
+    def setUp(self):
+        super().setUp()
+        get_catalog_cache().clear()
+        clear_auth_caches()
+        force_jwt_login(self.client, self.user)
+
+    def test_cursor_pagination_walks_whole_catalog(self):
+        names, url = [], '/api/v1/products/?page_size=10'
+        while url:
+            data = self.client.get(url).json()
+            names += [item['name'] for item in data['results']]
+            url = data['next']
+        self.assertEqual(names, [f'Product {i}' for i in range(25)])
+
+    def test_deep_pages_cost_the_same_as_the_first(self):
+        first = self.client.get('/api/v1/products/?page_size=5')
+        next_url = first.json()['next']
+        for __ in range(3):
+            next_url = self.client.get(next_url).json()['next']
+        get_catalog_cache().clear()
+        with CaptureQueriesContext(connection) as first_page:
+            self.client.get('/api/v1/products/?page_size=5')
+        get_catalog_cache().clear()
+        with CaptureQueriesContext(connection) as deep_page:
+            self.client.get(next_url)
+        self.assertEqual(len(first_page), len(deep_page))
+
+    def test_ndjson_stream(self):
+        response = self.client.get('/api/v1/products/?stream=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 25)
+        self.assertEqual(json.loads(lines[0])['name'], 'Product 0')
+        self.assertEqual(json.loads(lines[0])['price'], '1.00')
+
+    def test_values_serializer_renders_identical_json(self):
+        Product.objects.bulk_create([
+            Product(name='Ünïcode "quoted"', price=Decimal('12345678.9'), currency=Product.Currency.UZS),
+            Product(name='', price=Decimal('0'), currency=Product.Currency.UZS),
+        ])
+        Product.objects.filter(name='').update(created_at=timezone.now().replace(microsecond=0))
+        queryset = Product.objects.order_by('pk')
+        values = ValuesSerializer(ProductSerializer)
+
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(values.serialize(values.values(queryset))),
+            renderer.render(ProductSerializer(queryset, many=True).data),
+        )
+
+    def test_page_matches_model_serializer(self):
+        data = self.client.get('/api/v1/products/?page_size=5').json()
+        self.assertEqual(data['results'], ProductSerializer(Product.objects.order_by('created_at', 'id')[:5], many=True).data)
+
+    def test_sparse_fieldset(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/products/?page_size=10&fields=id,name,price')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['results'][0], {
+            'id': Product.objects.get(name='Product 0').pk, 'name': 'Product 0', 'price': '1.00'
+        })
+        self.assertNotIn('updated_at', queries.captured_queries[-1]['sql'])
+
+        # The cursor still walks the whole catalog
+        names, url = [], data['next']
+        while url:
+            data = self.client.get(url).json()
+            names += [item['name'] for item in data['results']]
+            url = data['next']
+        self.assertEqual(names, [f'Product {i}' for i in range(10, 25)])
+
+    def test_sparse_fieldset_stream(self):
+        response = self.client.get('/api/v1/products/?stream=ndjson&fields=name')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(json.loads(lines[0]), {'name': 'Product 0'})
+
+    def test_sparse_fieldset_rejects_unknown_fields(self):
+        response = self.client.get('/api/v1/products/?fields=name,secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'fields': ['Unknown fields: secret.']})
+        self.assertEqual(self.client.get('/api/v1/products/?fields=,').status_code, 400)
+
+    def test_product_serializer_fields_argument(self):
+        product = Product.objects.first()
+        self.assertEqual(list(ProductSerializer(product, fields={'name', 'id'}).data), ['id', 'name'])
+
+    def test_benchmark_serializers_command(self):
+        out = StringIO()
+        call_command('benchmark_serializers', sizes='50', stdout=out)
+        self.assertIn('50 products:', out.getvalue())
+        self.assertIn('identical bytes', out.getvalue())
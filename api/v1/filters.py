@@ -0,0 +1,15 @@
+import django_filters
+
+from app.models import Order
+
+
+class OrderFilter(django_filters.FilterSet):
+    """
+    Filters the order history by ``?status=`` and by creation time with
+    ``?created_at_after=`` / ``?created_at_before=`` (ISO 8601).
+    """
+    created_at = django_filters.IsoDateTimeFromToRangeFilter()
+
+    class Meta:
+        model = Order
+        fields = ['status', 'created_at']
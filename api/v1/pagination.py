@@ -0,0 +1,91 @@
+from base64 import b64decode, b64encode
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination, _positive_int
+from rest_framework.utils.urls import replace_query_param
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the catalog on ``(created_at, id)``.
+
+    Backed by the ``product_created_at_id_idx`` index, so every page is an
+    index range scan and deep pages cost the same as the first one.
+    """
+    ordering = ('created_at', 'id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Keyset pagination of a user's order history, newest first.
+
+    Backed by the ``order_user_created_at_id_idx`` index, or by
+    ``order_user_status_created_idx`` when filtering by status.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class ProductSalesRollupKeysetPagination(BasePagination):
+    """
+    Keyset pagination of the product sales rollups of a report on
+    ``(bucket, id)``, forward only.
+
+    ``CursorPagination`` positions its cursor on the first ordering field
+    only, with an OFFSET for the rows sharing its value: every product of a
+    bucket shares the bucket, so it would page through a bucket by offset.
+    Here the cursor carries both values and every page is a range scan of
+    ``product_sales_rollup_page_idx``.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 500
+    page_size_query_param = 'page_size'
+    max_page_size = 5000
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        after = self.decode_cursor(request)
+        if after is not None:
+            bucket, pk = after
+            queryset = queryset.filter(Q(bucket__gt=bucket) | Q(bucket=bucket, pk__gt=pk))
+
+        rows = list(queryset.order_by('bucket', 'pk')[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            bucket, pk = b64decode(encoded.encode('ascii')).decode('ascii').split(',')
+            return datetime.fromisoformat(bucket), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        encoded = b64encode(f'{last.bucket.isoformat()},{last.pk}'.encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
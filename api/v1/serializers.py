@@ -1,9 +1,229 @@
-from rest_framework import serializers
+import decimal
+import functools
+from datetime import timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
 from app import models
+from reports.models import OrderRollup, ProductSalesRollup
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    ``ModelSerializer`` taking a ``fields`` argument that restricts its
+    output to a subset of the declared fields.
+    """
 
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
 
-class ProductSerializer(serializers.ModelSerializer):
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class ProductSerializer(DynamicFieldsModelSerializer):
 
     class Meta:
         model = models.Product
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+def compile_converter(field):
+    """
+    Returns a function producing ``field.to_representation(value)`` for the
+    non-null values of a ``.values()`` row, specialised for the common field
+    types so that no per-value DRF machinery runs.
+    """
+    if isinstance(field, serializers.DecimalField):
+        coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+        if coerce_to_string and field.decimal_places is not None and not (field.localize or field.normalize_output):
+            exponent = decimal.Decimal('.1') ** field.decimal_places
+            context = decimal.getcontext().copy()
+            if field.max_digits is not None:
+                context.prec = field.max_digits
+            rounding = field.rounding
+            return lambda value: '{:f}'.format(value.quantize(exponent, rounding=rounding, context=context))
+
+    elif isinstance(field, serializers.DateTimeField):
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if output_format is not None and output_format.lower() == ISO_8601 and field_timezone is not None:
+            def convert_datetime(value):
+                if value.utcoffset() is None:
+                    return field.to_representation(value)
+                value = value.astimezone(field_timezone).isoformat()
+                return value[:-6] + 'Z' if value.endswith('+00:00') else value
+            return convert_datetime
+
+    elif isinstance(field, serializers.ChoiceField):
+        lookup = field.choice_strings_to_values.get
+        return lambda value: lookup(str(value), value)
+
+    elif isinstance(field, serializers.CharField):
+        return str
+
+    elif isinstance(field, serializers.IntegerField):
+        return int
+
+    return field.to_representation
+
+
+class ValuesSerializer:
+    """
+    Read-only mode of a ``ModelSerializer`` working from ``.values()`` rows.
+
+    No model instances are built and each field is converted by a function
+    compiled once per call (see ``compile_converter``); the output is the
+    same, key order included, so rendered JSON is byte-identical. Only
+    fields whose source is a plain model attribute are supported.
+
+    ``fields`` restricts the output like it does for
+    ``DynamicFieldsModelSerializer``, and the columns read along with it.
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        serializer = serializer_class() if fields is None else serializer_class(fields=fields)
+        self.fields = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if field.source == '*' or '.' in field.source:
+                raise ImproperlyConfigured(f"{serializer_class.__name__}.{name} cannot be read from .values() rows")
+            self.fields.append((name, field.source, field))
+
+        self.sources = [source for __, source, __ in self.fields]
+
+    def values(self, queryset, extra=()):
+        """
+        The queryset as rows holding exactly the columns the serializer reads,
+        plus the ``extra`` ones (e.g. needed by the paginator).
+        """
+        return queryset.values(*dict.fromkeys([*self.sources, *extra]))
+
+    def serialize(self, rows):
+        """
+        Args:
+            rows: Rows of ``values()``.
+        Returns:
+            list: One dict per row, as ``serializer_class(many=True).data`` would return.
+        """
+        converters = [(name, source, compile_converter(field)) for name, source, field in self.fields]
+        return [
+            {
+                name: None if (value := row[source]) is None else convert(value)
+                for name, source, convert in converters
+            }
+            for row in rows
+        ]
+
+
+@functools.cache
+def values_serializer(serializer_class, fields=None):
+    """
+    The ``ValuesSerializer`` of a serializer class, built once per set of
+    ``fields`` (a frozenset, or None for all of them).
+    """
+    return ValuesSerializer(serializer_class, fields)
+
+
+class ProductSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=100)
+    currency = serializers.ChoiceField(choices=models.Product.Currency.choices, required=False)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class OrderLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class OrderCreateSerializer(serializers.Serializer):
+    lines = OrderLineSerializer(many=True, allow_empty=False, max_length=10000)
+
+
+class OrderBulkCreateSerializer(serializers.Serializer):
+    orders = OrderCreateSerializer(many=True, allow_empty=False, max_length=100)
+
+
+class OrderSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = models.Order
+        fields = ('id', 'status', 'total_amount', 'total_tiyins', 'created_at')
+
+
+class OrderProductSerializer(serializers.ModelSerializer):
+    product = ProductSerializer()
+
+    class Meta:
+        model = models.OrderProduct
+        fields = ('id', 'product', 'quantity')
+
+
+class OrderPaymentSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = models.Payment
+        fields = ('payment_id', 'provider', 'amount', 'status', 'created_at')
+
+
+class OrderDetailSerializer(OrderSerializer):
+    lines = OrderProductSerializer(source='orderproduct_set', many=True)
+    payments = OrderPaymentSerializer(many=True)
+
+    class Meta(OrderSerializer.Meta):
+        fields = OrderSerializer.Meta.fields + ('updated_at', 'lines', 'payments')
+
+
+class ReportParamsSerializer(serializers.Serializer):
+    """
+    ``?granularity=day|hour`` buckets between ``?since=`` and ``?until=``,
+    by default those of the last 30 days or 48 hours.
+    """
+    SPANS = {'day': timedelta(days=30), 'hour': timedelta(hours=48)}
+    MAX_SPANS = {'day': timedelta(days=366), 'hour': timedelta(days=31)}
+
+    granularity = serializers.ChoiceField(choices=['day', 'hour'], default='day')
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        granularity = attrs['granularity']
+        attrs.setdefault('until', timezone.now())
+        attrs.setdefault('since', attrs['until'] - self.SPANS[granularity])
+
+        if attrs['since'] >= attrs['until']:
+            raise serializers.ValidationError({'since': ["Must be before until."]})
+        max_span = self.MAX_SPANS[granularity]
+        if attrs['until'] - attrs['since'] > max_span:
+            raise serializers.ValidationError({'since': [f"At most {max_span.days} days of {granularity} buckets."]})
+        return attrs
+
+
+class OrderRollupSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = OrderRollup
+        fields = ('bucket', 'status', 'order_count', 'revenue')
+
+
+class ProductSalesRollupSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ProductSalesRollup
+        fields = ('bucket', 'product', 'order_status', 'order_count', 'quantity', 'revenue')
+
+
+class PaymentSummarySerializer(serializers.Serializer):
+    bucket = serializers.DateTimeField()
+    payment_count = serializers.IntegerField()
+    pending_count = serializers.IntegerField()
+    succeeded_count = serializers.IntegerField()
+    succeeded_amount = serializers.DecimalField(max_digits=16, decimal_places=2)
+    success_rate = serializers.FloatField(allow_null=True)
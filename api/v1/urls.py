@@ -1,7 +1,11 @@
 from django.urls import path, include
-from api.v1.views import ProductsListAPIView
+from api.v1.views import OrderDetailAPIView, OrdersAPIView, ProductSearchAPIView, ProductsListAPIView, ReportsAPIView
 
 urlpatterns = [
-    path('products/', ProductsListAPIView.as_view()),
+    path('products/', ProductsListAPIView.as_view(), name='products'),
+    path('products/search/', ProductSearchAPIView.as_view(), name='product_search'),
+    path('orders/', OrdersAPIView.as_view(), name='orders'),
+    path('orders/<int:pk>/', OrderDetailAPIView.as_view(), name='order_detail'),
+    path('reports/', ReportsAPIView.as_view(), name='reports'),
     path('payments/', include('payments.urls')),
 ]
\ No newline at end of file
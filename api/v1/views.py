@@ -1,7 +1,275 @@
-from rest_framework import generics
-from app.models import Product
-from .serializers import ProductSerializer
+"""
+Views of the v1 API.
 
-class ProductsListAPIView(generics.ListAPIView):
+They are DRF views, authenticated by DRF (``CachedJWTAuthentication``) and
+guarded by their ``permission_classes``. Their routes are stateless (see
+``STATELESS_ROUTE_PREFIXES``), so ``LoginRequiredMiddleware`` never sees
+them and none of them is marked ``login_not_required``.
+"""
+import json
+import time
+from datetime import datetime, timezone
+from itertools import islice
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import generics, serializers, status
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from app.catalog import catalog_cache_key, catalog_digest, get_catalog_cache, get_catalog_version
+from app.models import Order, Product
+from app.routers import read_from_replica
+from app.search import search_products
+from app.services import UnknownProductsError, create_orders
+from reports.models import Granularity, OrderRollup, PaymentRollup, ProductSalesRollup
+from reports.rollups import payment_summaries
+from .filters import OrderFilter
+from .pagination import OrderCursorPagination, ProductCursorPagination, ProductSalesRollupKeysetPagination
+from .serializers import (
+    OrderBulkCreateSerializer, OrderCreateSerializer, OrderDetailSerializer, OrderRollupSerializer, OrderSerializer,
+    PaymentSummarySerializer, ProductSalesRollupSerializer, ProductSearchSerializer, ProductSerializer,
+    ReportParamsSerializer, values_serializer
+)
+
+
+def catalog_state(request):
+    """Catalog version of the request, looked up once per request"""
+    request = getattr(request, '_request', request)
+    if not hasattr(request, 'catalog_state'):
+        request.catalog_state = get_catalog_version()
+    return request.catalog_state
+
+
+def catalog_request_digest(request):
+    return catalog_digest(request.build_absolute_uri(), request.META.get('HTTP_ACCEPT', ''))
+
+
+def catalog_etag(request, *args, **kwargs):
+    version, __ = catalog_state(request)
+    return f'{version}-{catalog_request_digest(request)}'
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    __, last_modified = catalog_state(request)
+    return datetime.fromtimestamp(last_modified, tz=timezone.utc)
+
+
+class ReplicaReadsMixin:
+    """Serves the safe requests of an API view from a read replica, see ``app.routers``"""
+
+    def initial(self, request, *args, **kwargs):
+        # Authentication and permission checks read from default
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and self.can_read_from_replica(request):
+            read_from_replica(request.user)
+
+    def can_read_from_replica(self, request):
+        return True
+
+
+@method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified), name='get')
+class ProductsListAPIView(ReplicaReadsMixin, generics.ListAPIView):
+    """
+    Cursor-paginated product catalog.
+
+    Responses are cached per catalog version and carry a strong ``ETag``, so
+    conditional requests are answered with 304 without touching the database.
+    Pass ``?stream=ndjson`` to receive the whole catalog as newline-delimited
+    JSON, read from the database in chunks so memory use stays flat.
+
+    Products are read as ``.values()`` rows and serialized by the read-only
+    ``ValuesSerializer`` of ``ProductSerializer``, with the same output.
+    ``?fields=id,name,price`` restricts both the columns read and the fields
+    returned. Products are read from a replica when there are replicas.
+    """
+    serializer_class = ProductSerializer
+    queryset = Product.objects.all()
+    pagination_class = ProductCursorPagination
+    stream_chunk_size = 2000
+
+    def list(self, request, *args, **kwargs):
+        self.requested_fields = self.get_requested_fields()
+
+        if request.query_params.get('stream') == 'ndjson':
+            return self.stream(request)
+
+        cache = get_catalog_cache()
+        version, __ = catalog_state(request)
+        key = catalog_cache_key(version, catalog_request_digest(request))
+        data = cache.get(key)
+
+        if data is None:
+            data = self.serialize_page()
+            cache.set(key, data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+
+        return Response(data)
+
+    def can_read_from_replica(self, request):
+        # What is read is cached under the current catalog version: not from
+        # a replica that may not have the change behind it yet
+        __, last_modified = catalog_state(request)
+        return time.time() - last_modified > settings.REPLICA_PIN_SECONDS
+
+    def get_requested_fields(self):
+        """The fields named by ``?fields=``, or None when all were requested"""
+        param = self.request.query_params.get('fields')
+        if not param:
+            return None
+
+        fields = frozenset(name.strip() for name in param.split(',') if name.strip())
+        if not fields:
+            raise serializers.ValidationError({'fields': ["No fields given."]})
+
+        unknown = fields - {name for name, __, __ in values_serializer(self.get_serializer_class()).fields}
+        if unknown:
+            raise serializers.ValidationError({'fields': [f"Unknown fields: {', '.join(sorted(unknown))}."]})
+        return fields
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', getattr(self, 'requested_fields', None))
+        return super().get_serializer(*args, **kwargs)
+
+    def get_values_serializer(self):
+        return values_serializer(self.get_serializer_class(), getattr(self, 'requested_fields', None))
+
+    def serialize_page(self):
+        """The paginated response data of the current page"""
+        serializer = self.get_values_serializer()
+        # The paginator reads its ordering columns from the rows
+        ordering = [field.lstrip('-') for field in self.pagination_class.ordering]
+        page = self.paginate_queryset(serializer.values(self.filter_queryset(self.get_queryset()), ordering))
+        return self.get_paginated_response(serializer.serialize(page)).data
+
+    def stream(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).order_by(*self.pagination_class.ordering)
+        queryset = self.get_values_serializer().values(queryset)
+        # The stream is read after the request, outside of its routing
+        queryset = queryset.using(queryset.db)
+        response = StreamingHttpResponse(self.iter_ndjson(queryset), content_type='application/x-ndjson')
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def iter_ndjson(self, queryset):
+        """Yield one chunk of NDJSON lines per database chunk"""
+        serializer = self.get_values_serializer()
+        rows = queryset.iterator(chunk_size=self.stream_chunk_size)
+        while chunk := list(islice(rows, self.stream_chunk_size)):
+            yield ''.join(
+                json.dumps(item, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')) + '\n'
+                for item in serializer.serialize(chunk)
+            )
+
+
+class ProductSearchAPIView(generics.GenericAPIView):
+    """
+    Prefix and token search on product names, e.g. ``?q=gre app``, filtered
+    by ``currency``, ``min_price`` and ``max_price``.
+
+    Served from the in-memory index of ``app.search``; the ``X-Search-Source``
+    header tells whether the database answered instead.
+    """
     serializer_class = ProductSerializer
-    queryset = Product.objects.all()
\ No newline at end of file
+
+    def get(self, request, *args, **kwargs):
+        params = ProductSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = dict(params.validated_data)
+
+        products, source = search_products(filters.pop('q'), **filters)
+
+        response = Response({'results': self.get_serializer(products, many=True).data})
+        response['X-Search-Source'] = source
+        return response
+
+
+class UserOrdersMixin(ReplicaReadsMixin):
+    """
+    Orders of the authenticated user, with their lines, products and payments,
+    read from a replica unless the user just wrote
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = OrderDetailSerializer
+
+    def get_queryset(self):
+        return Order.objects.filter(user=self.request.user).with_details()
+
+
+class OrdersAPIView(UserOrdersMixin, generics.ListCreateAPIView):
+    """
+    Order history of the authenticated user, newest first and cursor-paginated,
+    filterable with ``OrderFilter``. Every page costs the same few queries.
+
+    POST creates an order from ``{"lines": [{"product": id, "quantity": n}, ...]}``,
+    or several at once from ``{"orders": [{"lines": [...]}, ...]}``.
+    Everything is created in one transaction with bulk inserts; the response
+    carries the totals computed by the database.
+    """
+    pagination_class = OrderCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
+
+    def create(self, request, *args, **kwargs):
+        bulk = 'orders' in request.data
+        serializer = (OrderBulkCreateSerializer if bulk else OrderCreateSerializer)(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        orders = serializer.validated_data['orders'] if bulk else [serializer.validated_data]
+        try:
+            created = create_orders(request.user, [
+                [(line['product'], line['quantity']) for line in order['lines']]
+                for order in orders
+            ])
+        except UnknownProductsError as e:
+            raise serializers.ValidationError({'product': [str(e)]})
+
+        data = OrderSerializer(created, many=True).data
+        return Response(data if bulk else data[0], status=status.HTTP_201_CREATED)
+
+
+class OrderDetailAPIView(UserOrdersMixin, generics.RetrieveAPIView):
+    """An order of the authenticated user with its lines, products and payments"""
+
+
+class ReportsAPIView(ReplicaReadsMixin, generics.GenericAPIView):
+    """
+    Sales reports for staff, served from the rollups kept by
+    ``update_rollups`` (see ``reports.rollups``) rather than aggregated over
+    the live tables: orders and revenue per status, product sales per order
+    status, and payments with their success rate. Parameters are described
+    by ``ReportParamsSerializer``; the rollups are as fresh as the last run
+    of the command.
+
+    Product sales grow with the catalog and are paginated (``next``); every
+    page carries the orders and payments of the period.
+    """
+    permission_classes = [IsAdminUser]
+    pagination_class = ProductSalesRollupKeysetPagination
+
+    def get(self, request, *args, **kwargs):
+        params = ReportParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        granularity, since, until = (params.validated_data[name] for name in ('granularity', 'since', 'until'))
+
+        buckets = {
+            'granularity': Granularity[granularity.upper()],
+            'bucket__gte': since,
+            'bucket__lt': until,
+        }
+        orders = OrderRollup.objects.filter(**buckets).order_by('bucket', 'status')
+        products = self.paginate_queryset(ProductSalesRollup.objects.filter(**buckets))
+        payments = PaymentRollup.objects.filter(**buckets).order_by('bucket', 'status')
+
+        return Response({
+            'granularity': granularity,
+            'since': since,
+            'until': until,
+            'orders': OrderRollupSerializer(orders, many=True).data,
+            'products': ProductSalesRollupSerializer(products, many=True).data,
+            'next': self.paginator.get_next_link(),
+            'payments': PaymentSummarySerializer(payment_summaries(payments), many=True).data,
+        })
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        from app import signals  # noqa: F401
+        from app.checks import check_payme_secret_key, check_shared_caches
+        checks.register(check_shared_caches, checks.Tags.caches, deploy=True)
+        checks.register(check_payme_secret_key, checks.Tags.security, deploy=True)
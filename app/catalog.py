@@ -0,0 +1,65 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+VERSION_KEY = 'catalog:version'
+MODIFIED_KEY = 'catalog:modified'
+
+
+def get_catalog_cache():
+    """Cache holding the catalog version counter and the cached catalog responses"""
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def get_catalog_version():
+    """
+    Returns the current catalog version and the time it was last modified.
+
+    Returns:
+        tuple: ``(version, last_modified)`` where ``last_modified`` is a UNIX timestamp.
+    """
+    cache = get_catalog_cache()
+    state = cache.get_many([VERSION_KEY, MODIFIED_KEY])
+
+    if len(state) < 2:
+        # Start a cold counter from the current time in milliseconds, so that it
+        # never reuses a version (and ETag) handed out before a cache flush
+        now = time.time()
+        cache.add(VERSION_KEY, int(now * 1000), timeout=None)
+        cache.add(MODIFIED_KEY, now, timeout=None)
+        state = cache.get_many([VERSION_KEY, MODIFIED_KEY])
+
+    return state[VERSION_KEY], state[MODIFIED_KEY]
+
+
+def bump_catalog_version():
+    """
+    Invalidate every cached catalog response by moving to a new version.
+
+    Returns:
+        int: The new version, or None when the counter had been evicted.
+    """
+    cache = get_catalog_cache()
+    now = time.time()
+
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        # The counter was evicted; the next read starts a fresh one
+        cache.delete(MODIFIED_KEY)
+        return None
+
+    cache.set(MODIFIED_KEY, now, timeout=None)
+    return version
+
+
+def catalog_digest(*parts):
+    """Stable digest of the request parts a catalog response depends on"""
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def catalog_cache_key(version, digest):
+    """Cache key of a catalog response for the given version and request digest"""
+    return f'catalog:response:{version}:{digest}'
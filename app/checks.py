@@ -0,0 +1,38 @@
+"""
+Deployment checks, run by ``manage.py check --deploy``.
+"""
+from django.conf import settings
+from django.core import checks
+
+LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+# Settings naming cache aliases whose contents every worker process must
+# see, e.g. version counters that invalidate entries cached by the others or
+# the replica pins of users whose next request another process may serve
+SHARED_CACHE_SETTINGS = ('CATALOG_CACHE_ALIAS', 'JWT_AUTH_CACHE_ALIAS', 'REPLICA_PIN_CACHE_ALIAS')
+
+
+def check_shared_caches(app_configs, **kwargs):
+    """Caches shared by worker processes must not be per-process"""
+    errors = []
+    for name in SHARED_CACHE_SETTINGS:
+        alias = getattr(settings, name)
+        backend = settings.CACHES.get(alias, {}).get('BACKEND')
+        if backend in LOCAL_CACHE_BACKENDS:
+            errors.append(checks.Error(
+                f"{name} uses the cache '{alias}', which is local to each process ({backend}).",
+                hint="Use a cache shared by the worker processes, e.g. Redis (see config/settings/prod.py).",
+                id='app.E001',
+            ))
+    return errors
+
+
+def check_payme_secret_key(app_configs, **kwargs):
+    """Payme callbacks are all refused without the key that authenticates them"""
+    if getattr(settings, 'PAYME_SECRET_KEY', None):
+        return []
+    return [checks.Error(
+        "PAYME_SECRET_KEY is not set: every Payme callback will be refused.",
+        hint="Set the SECRET_KEY environment variable to the key of the Payme merchant cabinet.",
+        id='app.E002',
+    )]
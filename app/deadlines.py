@@ -0,0 +1,58 @@
+"""
+Time budgets of the work done on behalf of a request.
+
+``DeadlineMiddleware`` opens a deadline for every request; outgoing calls
+(see ``payments.payme_client``) size their timeouts from the time left, so a
+stalled dependency cannot hold a worker past the request budget. Deadlines
+live in a context variable and follow the request into ``sync_to_async``
+threads and event loop tasks; nested deadlines can only shorten the budget.
+"""
+import contextlib
+import contextvars
+import time
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised by ``check`` when no time is left"""
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """
+    Runs the block with at most ``seconds`` left, or with the time left of
+    the enclosing deadline when that is shorter. None leaves the budget as is.
+    """
+    current = _deadline.get()
+    if seconds is not None:
+        expires = time.monotonic() + seconds
+        if current is None or expires < current:
+            current = expires
+
+    token = _deadline.set(current)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left before the current deadline, or None without one"""
+    expires = _deadline.get()
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+def check():
+    """
+    Returns the seconds left (None without a deadline).
+
+    Raises:
+        DeadlineExceeded: When the deadline has passed.
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Deadline exceeded")
+    return left
@@ -0,0 +1,73 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.v1.serializers import ProductSerializer, ValuesSerializer
+from app.models import Product
+
+
+def benchmark_products(size):
+    """
+    ``size`` unsaved products with varied prices and timestamps, and the same
+    products as the rows ``.values()`` would return.
+    """
+    started = timezone.now()
+    products = [
+        Product(
+            pk=index + 1,
+            name=f'Benchmark product {index}',
+            price=Decimal(index % 100000) / 100,
+            currency=Product.Currency.UZS,
+            created_at=started + timedelta(microseconds=index * 1013),
+            updated_at=started + timedelta(seconds=index),
+        )
+        for index in range(size)
+    ]
+    fields = [field.attname for field in Product._meta.concrete_fields]
+    rows = [{field: getattr(product, field) for field in fields} for product in products]
+    return products, rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare serializing and rendering the product catalog with ProductSerializer "
+        "and with its ValuesSerializer, and check both produce the same JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help="Comma separated numbers of products to serialize.")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError("--sizes must be a comma separated list of integers")
+
+        renderer = JSONRenderer()
+        values = ValuesSerializer(ProductSerializer)
+
+        for size in sizes:
+            products, rows = benchmark_products(size)
+
+            started = time.perf_counter()
+            model_json = renderer.render(ProductSerializer(products, many=True).data)
+            model_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            values_json = renderer.render(values.serialize(rows))
+            values_time = time.perf_counter() - started
+
+            if model_json != values_json:
+                raise CommandError(f"ValuesSerializer output differs from ProductSerializer for {size} products")
+
+            self.stdout.write(
+                f"{size} products: ModelSerializer {model_time * 1000:.0f}ms, "
+                f"ValuesSerializer {values_time * 1000:.0f}ms, "
+                f"{model_time / values_time if values_time else 0:.1f}x faster, "
+                f"{len(values_json)} identical bytes"
+            )
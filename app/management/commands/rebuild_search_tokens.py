@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.search import rebuild_product_tokens
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the product name tokens the search fallback queries, e.g. after products were "
+        "imported with bulk_create or renamed with update(), which skip the Product signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help="Number of products re-tokenized per transaction.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild_product_tokens(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed the names of {count} products in {time.perf_counter() - started:.2f}s"
+        ))
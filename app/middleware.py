@@ -0,0 +1,202 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware, LoginRequiredMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+
+from app.deadlines import deadline
+from app.queries import QueryBudgetExceeded, QueryRecorder, query_stats
+from app.routers import pin, routing
+
+logger = logging.getLogger('app.queries')
+
+
+class QueryBudgetMiddleware:
+    """
+    Records the queries of every request and checks them against the view's
+    budget in ``QUERY_BUDGETS`` (keyed by URL name).
+
+    With DEBUG on, the numbers are sent back as ``X-DB-*`` response headers;
+    with ``QUERY_STATS_LOG_INTERVAL`` set, they are logged as per-view
+    histograms. Queries run while a streaming response is consumed are not
+    counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        return self.process(request, response, recorder)
+
+    async def __acall__(self, request):
+        with QueryRecorder() as recorder:
+            response = await self.get_response(request)
+        return self.process(request, response, recorder)
+
+    def process(self, request, response, recorder):
+        view = request.resolver_match.view_name if request.resolver_match else None
+        response.query_recorder = recorder
+
+        if settings.DEBUG:
+            response['X-DB-Queries'] = str(recorder.count)
+            response['X-DB-Time'] = f"{recorder.time * 1000:.1f}ms"
+            response['X-DB-Duplicate-Queries'] = str(recorder.duplicates)
+
+        if settings.QUERY_STATS_LOG_INTERVAL:
+            query_stats.add(view or 'unresolved', recorder, settings.QUERY_STATS_LOG_INTERVAL)
+
+        budget = settings.QUERY_BUDGETS.get(view)
+        if budget is not None and recorder.count > budget:
+            message = f"View {view} ran {recorder.count} queries, over its budget of {budget}"
+            duplicated = recorder.duplicated_statements()
+            if duplicated:
+                message += "; repeated: " + "; ".join(f"{count}x {sql}" for count, sql in duplicated)
+
+            if settings.QUERY_BUDGET_RAISE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
+
+
+class DeadlineMiddleware:
+    """
+    Gives every request a budget of ``REQUEST_DEADLINE`` seconds (see
+    ``app.deadlines``); outgoing calls made while handling it time out when
+    the budget is spent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with deadline(settings.REQUEST_DEADLINE):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with deadline(settings.REQUEST_DEADLINE):
+            return await self.get_response(request)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Tracks the database routing of every request (see ``app.routers``) and
+    pins users who wrote to the primary for ``REPLICA_PIN_SECONDS``, so
+    that their next reads see their writes.
+
+    Placed after the session middleware, whose session saves do not count as
+    writes. Queries run while a streaming response is consumed are not
+    routed.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with routing() as state:
+            response = self.get_response(request)
+        self.process(request, state)
+        return response
+
+    async def __acall__(self, request):
+        with routing() as state:
+            response = await self.get_response(request)
+        # The user may still have to be loaded
+        await sync_to_async(self.process)(request, state)
+        return response
+
+    def process(self, request, state):
+        # Set by the authentication middleware, or by DRF once it authenticated the request
+        user = getattr(request, 'user', None)
+        if state.wrote and user is not None and user.is_authenticated:
+            pin(user)
+
+
+def is_stateless_route(request):
+    """
+    Whether the request goes to a stateless API route (see
+    ``STATELESS_ROUTE_PREFIXES``), which needs no session, CSRF or messages.
+    """
+    stateless = getattr(request, '_stateless_route', None)
+    if stateless is None:
+        path = request.path_info
+        stateless = request._stateless_route = (
+            path.startswith(settings.STATELESS_ROUTE_PREFIXES)
+            and not path.startswith(settings.STATEFUL_ROUTE_PREFIXES)
+        )
+    return stateless
+
+
+def skip_on_stateless_routes(middleware_class):
+    """
+    Subclasses a ``MiddlewareMixin`` middleware so that it only runs for
+    routes that are not stateless, and passes stateless API requests
+    straight through.
+    """
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if is_stateless_route(request):
+            return self.get_response(request)
+        return middleware_class.__call__(self, request)
+
+    async def __acall__(self, request):
+        if is_stateless_route(request):
+            return await self.get_response(request)
+        return await middleware_class.__acall__(self, request)
+
+    def skippable(hook):
+        def run_hook(self, request, *args):
+            if is_stateless_route(request):
+                return None
+            return hook(self, request, *args)
+        return run_hook
+
+    attrs = {
+        '__call__': __call__,
+        '__acall__': __acall__,
+        '__module__': __name__,
+        'wrapped_middleware': middleware_class,
+    }
+    # The handler calls these hooks itself, outside of __call__
+    for hook in ('process_view', 'process_exception', 'process_template_response'):
+        if hasattr(middleware_class, hook):
+            attrs[hook] = skippable(getattr(middleware_class, hook))
+
+    return type(f'RouteAware{middleware_class.__name__}', (middleware_class,), attrs)
+
+
+RouteAwareSessionMiddleware = skip_on_stateless_routes(SessionMiddleware)
+RouteAwareCsrfViewMiddleware = skip_on_stateless_routes(CsrfViewMiddleware)
+RouteAwareAuthenticationMiddleware = skip_on_stateless_routes(AuthenticationMiddleware)
+RouteAwareMessageMiddleware = skip_on_stateless_routes(MessageMiddleware)
+RouteAwareXFrameOptionsMiddleware = skip_on_stateless_routes(XFrameOptionsMiddleware)
+RouteAwareLoginRequiredMiddleware = skip_on_stateless_routes(LoginRequiredMiddleware)
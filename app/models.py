@@ -1,6 +1,66 @@
 import uuid
-from django.db import models
+from decimal import Decimal
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Now, Round
 from django.contrib.auth.models import User
+from django.dispatch import Signal
+from django.utils import timezone
+
+TOTAL_AMOUNT_FIELD = models.DecimalField(decimal_places=2, max_digits=14)
+
+# Sent after a ``StatusMachine.transition`` was applied, with the instance
+# and the ``previous`` status (the row is updated without ``post_save``)
+status_transitioned = Signal()
+
+
+class InvalidTransition(ValueError):
+    """Raised for a status change the state machine of the model does not allow"""
+
+
+class StatusMachine:
+    """
+    Explicit state machine over the ``status`` field of a model.
+
+    ``TRANSITIONS`` maps every status to the statuses it may move to. A
+    transition is a single ``UPDATE ... WHERE status = <expected>`` writing
+    the status, ``updated_at`` and the given fields only: a concurrent change
+    of the row makes it a no-op instead of being overwritten, and nothing is
+    written when the status stays the same.
+    """
+    TRANSITIONS = {}
+
+    def transition(self, status, expected=None, **fields):
+        """
+        Moves the row from the ``expected`` status to ``status``.
+
+        Args:
+            status (str): The new status.
+            expected (str): Status the row must have, by default the one of the instance.
+            **fields: Other fields to write along with the status.
+        Returns:
+            bool: Whether the transition was applied; the instance is only updated when it was.
+        Raises:
+            InvalidTransition: When the state machine does not allow the change.
+        """
+        expected = expected or self.status
+        if status == expected:
+            return False
+        if status not in self.TRANSITIONS.get(expected, ()):
+            raise InvalidTransition(f"{type(self).__name__} cannot go from {expected} to {status}")
+
+        now = timezone.now()
+        applied = type(self)._default_manager.filter(pk=self.pk, status=expected).update(
+            status=status, updated_at=now, **fields
+        )
+        if not applied:
+            return False
+
+        self.status, self.updated_at = status, now
+        for name, value in fields.items():
+            setattr(self, name, value)
+        status_transitioned.send(sender=type(self), instance=self, previous=expected)
+        return True
 
 class Product(models.Model):
 
@@ -14,10 +74,104 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the catalog, see api.v1.pagination
+            models.Index(fields=['created_at', 'id'], name='product_created_at_id_idx'),
+            # Currency and price range filters of the search fallback, see app.search
+            models.Index(fields=['currency', 'price'], name='product_currency_price_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
-class Order(models.Model):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded price and name so that signals can detect changes
+        instance._loaded_price = instance.__dict__.get('price')
+        instance._loaded_name = instance.__dict__.get('name')
+        return instance
+
+    def price_changed(self):
+        """Whether the price differs from the one loaded from the database"""
+        loaded_price = getattr(self, '_loaded_price', None)
+        return loaded_price is None or loaded_price != self.price
+
+    def name_changed(self):
+        """Whether the name differs from the one loaded from the database"""
+        loaded_name = getattr(self, '_loaded_name', None)
+        return loaded_name is None or loaded_name != self.name
+
+
+class ProductSearchToken(models.Model):
+    """
+    A token of a product name (see ``app.search.tokenize``): the database side
+    of the product search index, kept in sync by the ``Product`` signals.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_tokens')
+    # Prefix searches are range scans of this index (on PostgreSQL, of its
+    # varchar_pattern_ops twin Django creates for LIKE)
+    token = models.CharField(max_length=100, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'token'], name='unique_product_search_token'),
+        ]
+
+    def __str__(self):
+        return self.token
+
+def order_lines_total(order_ref):
+    """Subquery summing ``price * quantity`` over the lines of the referenced order"""
+    lines_total = (
+        OrderProduct.objects
+        .filter(order=order_ref)
+        .values('order')
+        .annotate(total=Sum(F('price') * F('quantity'), output_field=TOTAL_AMOUNT_FIELD))
+        .values('total')
+    )
+    return Coalesce(Subquery(lines_total), Value(Decimal('0')), output_field=TOTAL_AMOUNT_FIELD)
+
+class OrderQuerySet(models.QuerySet):
+
+    def with_total_amount(self):
+        """Annotate each order with ``lines_total_amount`` computed in the same query"""
+        return self.annotate(lines_total_amount=order_lines_total(OuterRef('pk')))
+
+    def recalculate_totals(self):
+        """Recompute the stored totals of every order in the queryset with a single UPDATE"""
+        total = order_lines_total(OuterRef('pk'))
+        return self.update(
+            total_amount=total,
+            total_tiyins=Cast(Round(total * 100), models.BigIntegerField()),
+            updated_at=Now(),
+        )
+
+    def with_pending_payment(self):
+        """Prefetch the pending payments of each order into ``pending_payments``"""
+        return self.prefetch_related(
+            models.Prefetch(
+                'payments',
+                queryset=Payment.objects.filter(status=Payment.PaymentStatus.PENDING),
+                to_attr='pending_payments'
+            )
+        )
+
+    def for_checkout(self):
+        """Load orders with their lines, products and pending payments in a fixed number of queries"""
+        return self.with_pending_payment().prefetch_related(
+            models.Prefetch('orderproduct_set', queryset=OrderProduct.objects.select_related('product'))
+        )
+
+    def with_details(self):
+        """Load orders with their lines, products and payments in a fixed number of queries"""
+        return self.prefetch_related(
+            models.Prefetch('orderproduct_set', queryset=OrderProduct.objects.select_related('product').order_by('id')),
+            models.Prefetch('payments', queryset=Payment.objects.order_by('created_at', 'id')),
+        )
+
+class Order(StatusMachine, models.Model):
 
     class OrderStatus(models.TextChoices):
         PENDING = 'PENDING', 'Pending'
@@ -27,42 +181,125 @@ class Order(models.Model):
         CANCELED = 'CANCELED', 'Canceled'
         COMPLETED = 'COMPLETED', 'Completed'
 
+    TRANSITIONS = {
+        OrderStatus.PENDING: {OrderStatus.PAID, OrderStatus.FAILED, OrderStatus.CANCELED},
+        OrderStatus.PAID: {OrderStatus.SHIPPED, OrderStatus.CANCELED},
+        OrderStatus.SHIPPED: {OrderStatus.COMPLETED},
+    }
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     items = models.ManyToManyField(Product, through='OrderProduct')
     status = models.CharField(choices=OrderStatus.choices, default=OrderStatus.PENDING, max_length=10)
 
+    # Denormalized totals, kept up to date by the signals in app/signals.py
+    total_amount = models.DecimalField(decimal_places=2, max_digits=14, default=Decimal('0'))
+    total_tiyins = models.BigIntegerField(default=0)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Order history of a user, filtered by status and/or date range and
+            # keyset-paginated on creation time, see api.v1.pagination
+            models.Index(fields=['user', 'status', 'created_at'], name='order_user_status_created_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_at_id_idx'),
+            # Status and date filters of the admin changelist
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+            # Changes picked up by the rollups, see reports.rollups
+            models.Index(fields=['updated_at'], name='order_updated_at_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.id}"
 
+    def recalculate_totals(self):
+        """Recompute the stored totals from the order lines and refresh them on this instance"""
+        Order.objects.filter(pk=self.pk).recalculate_totals()
+        self.refresh_from_db(fields=['total_amount', 'total_tiyins', 'updated_at'])
+
+    def get_pending_payment(self):
+        """Return the pending payment of the order, if any"""
+        if hasattr(self, 'pending_payments'):
+            return self.pending_payments[0] if self.pending_payments else None
+        return self.payments.filter(status=Payment.PaymentStatus.PENDING).first()
+
     def get_total_amount(self):
-        """Calculate the total amount of the order"""
-        total = sum(
-            item.product.price * item.quantity
-            for item in self.orderproduct_set.all()
-        )
-        return total
+        """Total amount of the order, as stored on the order row"""
+        return self.total_amount
 
     def get_total_amount_in_tiyins(self):
-        """Convert total amount to tiyins for Payme (100 tiyins = 1 UZS)"""
-        total = self.get_total_amount()
-
-        return int(total * 100)
+        """Total amount in tiyins for Payme (100 tiyins = 1 UZS)"""
+        return self.total_tiyins
 
 class OrderProduct(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField()
+    # Unit price of the line: the price of the product when it was added,
+    # following it while the order is PENDING (see app.signals) and frozen
+    # once the order is paid, canceled or shipped
+    price = models.DecimalField(decimal_places=2, max_digits=10)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Changes picked up by the rollups, see reports.rollups
+            models.Index(fields=['updated_at'], name='orderproduct_updated_at_idx'),
+        ]
+
     def __str__(self):
-        return f"Order #{self.order.id} - Product: {self.product.name}"
+        return f"Order #{self.order_id} - Product: {self.product.name}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded order so that moving a line updates both orders
+        instance._loaded_order_id = instance.__dict__.get('order_id')
+        instance._loaded_product_id = instance.__dict__.get('product_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Priced when added, or when pointed at another product
+        if self.price is None or self.product_id != getattr(self, '_loaded_product_id', self.product_id):
+            self.price = self.product.price
+        super().save(*args, **kwargs)
+        self._loaded_product_id = self.product_id
+
+class PaymentQuerySet(models.QuerySet):
+
+    def with_order(self):
+        """Join the order so that ownership checks and status updates cost no extra queries"""
+        return self.select_related('order')
+
+    def get_or_create_pending(self, order, **defaults):
+        """
+        Returns ``(payment, created)`` for the pending payment of an order.
 
-class Payment(models.Model):
+        Race-free thanks to the ``unique_pending_payment_per_order`` constraint:
+        a single ``INSERT ... ON CONFLICT DO NOTHING`` creates the payment
+        unless the order already has one, then the pending payment is fetched
+        (locked when the queryset is ``select_for_update``). No savepoint is
+        needed, and concurrent requests all get the row of the winner.
+        ``defaults`` are only used when the payment is created.
+        """
+        payment = self._build_pending(order, defaults)
+        self.bulk_create([payment], ignore_conflicts=True)
+        pending = self.get(order=order, status=Payment.PaymentStatus.PENDING)
+        return pending, pending.payment_id == payment.payment_id
+
+    def _build_pending(self, order, defaults):
+        payment = Payment.build_for_order(order)
+        for field, value in defaults.items():
+            setattr(payment, field, value)
+        return payment
+
+class Payment(StatusMachine, models.Model):
     class PaymentStatus(models.TextChoices):
         PENDING = 'PENDING', 'Pending'
         PAID = 'PAID', 'Paid'
@@ -70,6 +307,20 @@ class Payment(models.Model):
         CANCELED = 'CANCELED', 'Canceled'
         REFUNDED = 'REFUNDED', 'Refunded'
 
+    TRANSITIONS = {
+        # Payme may report a pending payment as already refunded
+        PaymentStatus.PENDING: {
+            PaymentStatus.PAID, PaymentStatus.FAILED, PaymentStatus.CANCELED, PaymentStatus.REFUNDED
+        },
+        PaymentStatus.PAID: {PaymentStatus.REFUNDED},
+    }
+
+    # Order transition that goes with a payment transition: (expected, new) order status
+    ORDER_TRANSITIONS = {
+        PaymentStatus.PAID: (Order.OrderStatus.PENDING, Order.OrderStatus.PAID),
+        PaymentStatus.REFUNDED: (Order.OrderStatus.PAID, Order.OrderStatus.CANCELED),
+    }
+
     class PaymentProvider(models.TextChoices):
         PAYME = 'PAYME', 'Payme'
 
@@ -78,25 +329,85 @@ class Payment(models.Model):
     provider = models.CharField(max_length=10, choices=PaymentProvider.choices, default=PaymentProvider.PAYME)
     amount = models.DecimalField(decimal_places=2, max_digits=10)
     status = models.CharField(max_length=10, choices=PaymentStatus.choices, default=PaymentStatus.PENDING)
-    provider_transaction_id = models.CharField(max_length=255, blank=True, null=True)
-    provider_transaction_time = models.BigIntegerField(blank=True, null=True)
+    provider_transaction_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    provider_transaction_time = models.BigIntegerField(blank=True, null=True, db_index=True)
     provider_payment_data = models.JSONField(blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PaymentQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['order'],
+                condition=models.Q(status='PENDING'),
+                name='unique_pending_payment_per_order'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['order', 'status'], name='payment_order_status_idx'),
+            # Status and date filters of the admin changelist
+            models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+            models.Index(fields=['created_at'], name='payment_created_at_idx'),
+            # Changes picked up by the rollups, see reports.rollups
+            models.Index(fields=['updated_at'], name='payment_updated_at_idx'),
+        ]
+
     def __str__(self):
-        return f"Payment #{self.payment_id} for Order #{self.order.id}"
+        return f"Payment #{self.payment_id} for Order #{self.order_id}"
 
     @classmethod
-    def create_for_order(cls, order):
-        """Create a new payment for an order"""
-        payment = cls(
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded status so that status changes can be published
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def status_changed(self):
+        """Whether the status differs from the one loaded from the database"""
+        return getattr(self, '_loaded_status', None) != self.status
+
+    def transition(self, status, expected=None, **fields):
+        """
+        ``StatusMachine.transition`` that also applies the matching order
+        transition (see ``ORDER_TRANSITIONS``), in the same database transaction.
+        """
+        # Join the caller's transaction without a savepoint
+        with transaction.atomic(savepoint=False):
+            applied = super().transition(status, expected, **fields)
+
+            if applied and status in self.ORDER_TRANSITIONS:
+                order_expected, order_status = self.ORDER_TRANSITIONS[status]
+                order = self.order if Payment.order.is_cached(self) else Order(pk=self.order_id, status=order_expected)
+                order.transition(order_status, expected=order_expected)
+
+        return applied
+
+    @classmethod
+    def status_for_provider_state(cls, state):
+        """Payment status matching a Payme transaction state, or None while it is still pending"""
+        return {
+            2: cls.PaymentStatus.PAID,
+            -1: cls.PaymentStatus.CANCELED,
+            -2: cls.PaymentStatus.REFUNDED,
+        }.get(state)
+
+    @classmethod
+    def build_for_order(cls, order):
+        """Build an unsaved pending payment for an order"""
+        return cls(
             order=order,
             payment_id=str(uuid.uuid4()),
-            amount=order.get_total_amount(),
+            amount=order.total_amount,
             status=cls.PaymentStatus.PENDING
         )
+
+    @classmethod
+    def create_for_order(cls, order):
+        """Create a new payment for an order"""
+        payment = cls.build_for_order(order)
         payment.save()
         return payment
 
@@ -0,0 +1,148 @@
+"""
+Per-request SQL instrumentation.
+
+Every database connection gets ``record_query`` as an execute wrapper (see
+``app.signals``). While a ``QueryRecorder`` is active in the current context
+it sees every query, including the ones async views run in worker threads,
+because the context is carried over by ``sync_to_async``.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_recorder = contextvars.ContextVar('query_recorder', default=None)
+
+# Upper bounds of the histogram buckets
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+DB_TIME_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 1000)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a view runs more queries than its budget allows"""
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper reporting the query to the active recorder"""
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.add(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(connection, **kwargs):
+    """``connection_created`` receiver adding ``record_query`` to the connection"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class QueryRecorder:
+    """
+    Counts the queries run while it is active, their total time and the
+    statements that ran more than once (the usual shape of an N+1).
+    Recorders nest: queries are reported to the enclosing recorders too.
+
+    Usage::
+
+        with QueryRecorder() as recorder:
+            ...
+        recorder.count, recorder.duplicates
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = {}
+        self._lock = threading.Lock()
+        self._token = None
+        self._parent = None
+
+    def __enter__(self):
+        self._parent = _recorder.get()
+        self._token = _recorder.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _recorder.reset(self._token)
+
+    def add(self, sql, duration):
+        with self._lock:
+            self.count += 1
+            self.time += duration
+            self.statements[sql] = self.statements.get(sql, 0) + 1
+
+        if self._parent is not None:
+            self._parent.add(sql, duration)
+
+    @property
+    def duplicates(self):
+        """Number of queries repeating a statement already run"""
+        return sum(count - 1 for count in self.statements.values())
+
+    def duplicated_statements(self, limit=3):
+        """The most repeated statements, as ``(count, sql)`` pairs"""
+        repeated = [(count, sql) for sql, count in self.statements.items() if count > 1]
+        return sorted(repeated, reverse=True)[:limit]
+
+
+class Histogram:
+    """Counts of observations per fixed bucket"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+    def format(self):
+        labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+        return " ".join(f"{label}:{count}" for label, count in zip(labels, self.counts) if count)
+
+
+class QueryStats:
+    """
+    Aggregates the recorded queries per view and logs them as histograms
+    every ``interval`` seconds.
+    """
+
+    def __init__(self):
+        self.views = {}
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, view, recorder, interval):
+        with self._lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = {
+                    'requests': 0,
+                    'duplicates': 0,
+                    'queries': Histogram(QUERY_COUNT_BUCKETS),
+                    'db_ms': Histogram(DB_TIME_BUCKETS),
+                }
+            stats['requests'] += 1
+            stats['duplicates'] += recorder.duplicates
+            stats['queries'].add(recorder.count)
+            stats['db_ms'].add(recorder.time * 1000)
+
+            if time.monotonic() - self.started < interval:
+                return
+            views, self.views, self.started = self.views, {}, time.monotonic()
+
+        for view, stats in sorted(views.items()):
+            logger.info(
+                "view=%s requests=%d duplicate_queries=%d queries[%s] db_ms[%s]",
+                view, stats['requests'], stats['duplicates'], stats['queries'].format(), stats['db_ms'].format()
+            )
+
+
+query_stats = QueryStats()
@@ -0,0 +1,107 @@
+"""
+Read replica routing.
+
+Views opt in with ``read_from_replica`` (``ReplicaReadsMixin`` for API views,
+``ReplicaReadsAdmin`` for admin changelists): the reads they make for the
+rest of the request go to one of ``DATABASE_REPLICAS``. Everything else,
+writes and the payment flow in particular, stays on ``default``.
+
+Reads stay on ``default`` for the rest of a request once it has written.
+Users who wrote are pinned to ``default`` for ``REPLICA_PIN_SECONDS`` after
+the request (see ``ReplicaRoutingMiddleware``), so that they read their own
+writes while the replicas catch up. Pins are kept in
+``REPLICA_PIN_CACHE_ALIAS``, which must be shared by the worker processes
+(Redis in prod, enforced by ``check --deploy``): in a per-process cache the
+next request of the user, served by another process, would miss the pin.
+"""
+import contextlib
+import contextvars
+import random
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+_routing = contextvars.ContextVar('replica_routing', default=None)
+
+PIN_KEY = 'replica-pin:{}'
+
+
+@dataclass
+class Routing:
+    """Routing of the current request: the replica its reads go to, and whether it wrote"""
+    replica: str | None = None
+    wrote: bool = False
+
+
+@contextlib.contextmanager
+def routing():
+    """
+    Tracks the routing of the work done in the block, reading from
+    ``default`` until ``read_from_replica`` is called.
+
+    The routing object is shared by the threads and tasks the block hands
+    work to, so their writes count as well.
+    """
+    state = Routing()
+    token = _routing.set(state)
+    try:
+        yield state
+    finally:
+        _routing.reset(token)
+
+
+def get_pin_cache():
+    return caches[settings.REPLICA_PIN_CACHE_ALIAS]
+
+
+def pin(user):
+    """Sends the reads of the user to ``default`` for ``REPLICA_PIN_SECONDS``"""
+    get_pin_cache().set(PIN_KEY.format(user.pk), True, timeout=settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return bool(get_pin_cache().get(PIN_KEY.format(user.pk)))
+
+
+def read_from_replica(user=None):
+    """
+    Sends the remaining reads of the current request to a replica, unless
+    the request or, recently, the user wrote.
+
+    Returns:
+        str | None: The alias of the replica, or None when reads stay on ``default``.
+    """
+    state = _routing.get()
+    if state is None or state.wrote or not settings.DATABASE_REPLICAS:
+        return None
+    if user is not None and user.is_authenticated and is_pinned(user):
+        return None
+
+    state.replica = random.choice(settings.DATABASE_REPLICAS)
+    return state.replica
+
+
+class ReplicaRouter:
+    """Routes the reads of views that opted in to a replica, see ``read_from_replica``"""
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is not None and state.replica and not state.wrote:
+            return state.replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+        # Also for instances read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as default
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,272 @@
+"""
+In-process product search.
+
+``product_search_index`` keeps an inverted index of product name tokens in
+memory. It is built when a worker process starts (see ``config/wsgi.py``),
+kept up to date by the ``Product`` signals and tagged with the catalog
+version it reflects: when another process changes the catalog, the version
+moves on, searches fall back to the database and the index is rebuilt in
+the background.
+
+Meanwhile searches are served by the database from ``ProductSearchToken``,
+the same tokens stored in an indexed table: every query token is an index
+range scan, however large the catalog.
+"""
+import bisect
+import logging
+import re
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models.functions import Lower
+
+from app.catalog import get_catalog_version
+from app.models import Product, ProductSearchToken
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Lowercase word tokens of a text"""
+    return TOKEN_RE.findall(text.lower())
+
+
+def index_product_tokens(product):
+    """Replaces the ``ProductSearchToken`` rows of a saved product with the tokens of its name"""
+    tokens = set(tokenize(product.name))
+    ProductSearchToken.objects.filter(product=product).exclude(token__in=tokens).delete()
+    ProductSearchToken.objects.bulk_create(
+        [ProductSearchToken(product=product, token=token) for token in tokens],
+        ignore_conflicts=True
+    )
+
+
+def rebuild_product_tokens(batch_size=2000):
+    """
+    Rebuilds the ``ProductSearchToken`` table from the whole catalog, e.g.
+    after products were created or renamed with ``bulk_create`` or
+    ``update``, which send no signals.
+
+    Returns:
+        int: Number of products indexed.
+    """
+    count, last_pk = 0, 0
+    # One short transaction per batch: searches keep being served meanwhile
+    while products := list(Product.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'name')[:batch_size]):
+        with transaction.atomic():
+            ProductSearchToken.objects.filter(product__in=products).delete()
+            ProductSearchToken.objects.bulk_create([
+                ProductSearchToken(product=product, token=token)
+                for product in products
+                for token in set(tokenize(product.name))
+            ])
+        count += len(products)
+        last_pk = products[-1].pk
+    return count
+
+
+def matches_filters(product, currency=None, min_price=None, max_price=None):
+    return (
+        (currency is None or product.currency == currency)
+        and (min_price is None or product.price >= min_price)
+        and (max_price is None or product.price <= max_price)
+    )
+
+
+class ProductSearchIndex:
+    """
+    Inverted index of product names supporting token prefix search.
+
+    Every query token must be a prefix of a token of the product name, so
+    ``"gre app"`` finds "Green apple". Results are ordered by name, then id,
+    the same as ``search_products_in_db``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._building = False
+        self._reset()
+
+    def _reset(self):
+        self.version = None
+        self.products = {}
+        self.postings = {}
+        self.tokens = []
+
+    def reset(self):
+        """Drop the index; builds in progress are discarded"""
+        with self._lock:
+            self._generation += 1
+            self._reset()
+
+    def is_fresh(self, version=None):
+        """Whether the index reflects the current catalog version"""
+        if version is None:
+            version, __ = get_catalog_version()
+        return self.version is not None and self.version == version
+
+    def build(self):
+        """Loads the whole catalog into a new index and swaps it in"""
+        with self._lock:
+            generation = self._generation
+
+        # Read the version first: changes committed while loading move it on,
+        # so the new index is then considered stale rather than wrongly fresh
+        version, __ = get_catalog_version()
+        products, postings = {}, {}
+        for product in Product.objects.order_by('pk').iterator(chunk_size=2000):
+            products[product.pk] = product
+            for token in set(tokenize(product.name)):
+                postings.setdefault(token, set()).add(product.pk)
+
+        with self._lock:
+            if generation != self._generation:
+                return
+            self.products, self.postings, self.tokens = products, postings, sorted(postings)
+            self.version = version
+
+        logger.info("Product search index built: %d products, %d tokens", len(products), len(postings))
+
+    def warm(self):
+        """Builds the index in a background thread, unless a build is running"""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        threading.Thread(target=self._build_in_background, name='product-search-index', daemon=True).start()
+
+    def _build_in_background(self):
+        close_old_connections()
+        try:
+            self.build()
+        except Exception:
+            logger.exception("Building the product search index failed")
+        finally:
+            connection.close()
+            with self._lock:
+                self._building = False
+
+    def apply(self, pk, product, version):
+        """
+        Applies a committed change of one product (``product`` is None when it
+        was deleted). ``version`` is the catalog version the change moved to;
+        the index stays fresh only if no other change happened in between.
+        """
+        with self._lock:
+            if self.version is None:
+                return
+
+            self._remove(pk)
+            if product is not None:
+                self._add(product)
+
+            if version is not None and version == self.version + 1:
+                self.version = version
+            else:
+                self.version = -1
+
+    def _add(self, product):
+        self.products[product.pk] = product
+        for token in set(tokenize(product.name)):
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = set()
+                bisect.insort(self.tokens, token)
+            postings.add(product.pk)
+
+    def _remove(self, pk):
+        product = self.products.pop(pk, None)
+        if product is None:
+            return
+        for token in set(tokenize(product.name)):
+            postings = self.postings[token]
+            postings.discard(pk)
+            if not postings:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+
+    def _prefix_matches(self, prefix):
+        """Ids of the products having a token that starts with ``prefix``"""
+        matches = set()
+        index = bisect.bisect_left(self.tokens, prefix)
+        while index < len(self.tokens) and self.tokens[index].startswith(prefix):
+            matches |= self.postings[self.tokens[index]]
+            index += 1
+        return matches
+
+    def search(self, query, limit=20, **filters):
+        """
+        Searches product names.
+
+        Args:
+            query (str): Search text, every token of which must match.
+            limit (int): Maximum number of products returned.
+            **filters: ``currency``, ``min_price`` and ``max_price``.
+        Returns:
+            list: Matching products.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        with self._lock:
+            # Match the rarest token first and stop as soon as nothing is left
+            candidates = None
+            for matches in sorted((self._prefix_matches(token) for token in set(tokens)), key=len):
+                candidates = matches if candidates is None else candidates & matches
+                if not candidates:
+                    return []
+            products = [self.products[pk] for pk in candidates]
+
+        products = [product for product in products if matches_filters(product, **filters)]
+        products.sort(key=lambda product: (product.name.lower(), product.pk))
+        return products[:limit]
+
+
+def search_products_in_db(query, limit=20, currency=None, min_price=None, max_price=None):
+    """
+    Database equivalent of ``ProductSearchIndex.search``, used while the index
+    is cold or stale: every query token is a prefix lookup in the indexed
+    ``ProductSearchToken`` table. The currency and price filters use
+    ``product_currency_price_idx``.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    queryset = Product.objects.all()
+    for token in set(tokens):
+        queryset = queryset.filter(
+            pk__in=ProductSearchToken.objects.filter(token__startswith=token).values('product_id')
+        )
+    if currency is not None:
+        queryset = queryset.filter(currency=currency)
+    if min_price is not None:
+        queryset = queryset.filter(price__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(price__lte=max_price)
+
+    return list(queryset.order_by(Lower('name'), 'pk')[:limit])
+
+
+def search_products(query, limit=20, **filters):
+    """
+    Searches the in-memory index, or the database when the index is not fresh.
+
+    Returns:
+        tuple: ``(products, source)`` where source is ``'index'`` or ``'database'``.
+    """
+    if product_search_index.is_fresh():
+        return product_search_index.search(query, limit, **filters), 'index'
+
+    if settings.PRODUCT_SEARCH_BACKGROUND_BUILD:
+        product_search_index.warm()
+    return search_products_in_db(query, limit, **filters), 'database'
+
+
+product_search_index = ProductSearchIndex()
@@ -0,0 +1,52 @@
+from django.db import transaction
+
+from app.models import Order, OrderProduct, Product
+
+
+class UnknownProductsError(Exception):
+    """Raised when order lines reference products that do not exist"""
+
+    def __init__(self, product_ids):
+        super().__init__(f"Unknown products: {', '.join(map(str, product_ids))}")
+        self.product_ids = product_ids
+
+
+def create_orders(user, orders, batch_size=2000):
+    """
+    Creates orders with their lines in one transaction.
+
+    All product ids are checked with a single query, orders and lines are
+    inserted with ``bulk_create`` and the totals are computed by one UPDATE,
+    so the number of queries does not grow with the number of lines (beyond
+    one INSERT per ``batch_size`` lines).
+
+    Args:
+        user: Owner of the orders.
+        orders (list): One list of ``(product_id, quantity)`` pairs per order.
+        batch_size (int): Maximum number of lines inserted per query.
+    Returns:
+        list: The created orders, with their totals loaded from the database.
+    Raises:
+        UnknownProductsError: When a product id does not exist; nothing is created.
+    """
+    product_ids = {product_id for lines in orders for product_id, __ in lines}
+
+    with transaction.atomic():
+        prices = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'price'))
+        if prices.keys() != product_ids:
+            raise UnknownProductsError(sorted(product_ids - prices.keys()))
+
+        created = Order.objects.bulk_create([Order(user=user) for __ in orders])
+        OrderProduct.objects.bulk_create(
+            (
+                OrderProduct(order=order, product_id=product_id, quantity=quantity, price=prices[product_id])
+                for order, lines in zip(created, orders)
+                for product_id, quantity in lines
+            ),
+            batch_size=batch_size
+        )
+
+        order_ids = [order.pk for order in created]
+        Order.objects.filter(pk__in=order_ids).recalculate_totals()
+
+    return list(Order.objects.filter(pk__in=order_ids).order_by('pk'))
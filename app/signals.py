@@ -0,0 +1,68 @@
+import copy
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.functions import Now
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from app.catalog import bump_catalog_version
+from app.models import Order, OrderProduct, Product
+from app.queries import install_query_recorder
+from app.search import index_product_tokens, product_search_index
+
+connection_created.connect(install_query_recorder, dispatch_uid='install_query_recorder')
+
+
+@receiver(post_save, sender=OrderProduct)
+@receiver(post_delete, sender=OrderProduct)
+def update_order_totals(sender, instance, **kwargs):
+    """Recompute the stored totals of the order(s) the line belongs to"""
+    order_ids = {instance.order_id, getattr(instance, '_loaded_order_id', None)} - {None}
+    Order.objects.filter(pk__in=order_ids).recalculate_totals()
+    instance._loaded_order_id = instance.order_id
+
+
+@receiver(post_save, sender=Product)
+def update_order_totals_on_price_change(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Reprice the lines of the pending orders containing the product when its
+    price changes, and recompute their totals. Orders past PENDING keep the
+    line prices and amount they were paid (or canceled) at, which their
+    payments and the sales rollups carry too.
+    """
+    if update_fields is not None and 'price' not in update_fields:
+        return
+
+    if not created and instance.price_changed():
+        lines = OrderProduct.objects.filter(product=instance, order__status=Order.OrderStatus.PENDING)
+        order_ids = list(lines.values_list('order_id', flat=True).distinct())
+        lines.update(price=instance.price, updated_at=Now())
+        Order.objects.filter(pk__in=order_ids, status=Order.OrderStatus.PENDING).recalculate_totals()
+
+    instance._loaded_price = instance.price
+
+
+@receiver(post_save, sender=Product)
+def update_search_tokens(sender, instance, created, update_fields=None, **kwargs):
+    """Keep the ``ProductSearchToken`` rows of the product in step with its name"""
+    if update_fields is not None and 'name' not in update_fields:
+        return
+
+    if created or instance.name_changed():
+        index_product_tokens(instance)
+
+    instance._loaded_name = instance.name
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog(sender, instance, signal, **kwargs):
+    """Move the catalog to a new version and update the search index once the change is committed"""
+    pk = instance.pk
+    product = None if signal is post_delete else copy.copy(instance)
+
+    def catalog_changed():
+        product_search_index.apply(pk, product, bump_catalog_version())
+
+    transaction.on_commit(catalog_changed)
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+def force_jwt_login(client, user):
+    """Make every request of the test client carry an access token of ``user``"""
+    client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(user)}'
+
+
+class QueryBudgetMixin:
+    """
+    Test case mixin enforcing ``QUERY_BUDGETS``: any request made through the
+    test client that runs more queries than its view's budget fails the test.
+    """
+
+    def setUp(self):
+        budget = override_settings(QUERY_BUDGET_RAISE=True)
+        budget.enable()
+        self.addCleanup(budget.disable)
+        super().setUp()
+
+    def assertQueryBudget(self, response, budget=None):
+        """
+        Asserts the request behind ``response`` stayed within ``budget``,
+        by default the budget of its view.
+        """
+        view = response.resolver_match.view_name
+        if budget is None:
+            budget = settings.QUERY_BUDGETS[view]
+
+        recorder = response.query_recorder
+        self.assertLessEqual(
+            recorder.count, budget,
+            f"{view} ran {recorder.count} queries, over the budget of {budget}: {recorder.duplicated_statements()}"
+        )
+        return recorder
@@ -1,3 +1,538 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from api.authentication import clear_caches as clear_auth_caches
+from app.admin import EstimatedCountPaginator
+from app.catalog import bump_catalog_version, get_catalog_cache
+from app.checks import check_shared_caches
+from app.models import InvalidTransition, Order, OrderProduct, Product, ProductSearchToken, Payment
+from app.queries import QueryBudgetExceeded, QueryRecorder, query_stats
+from app.routers import get_pin_cache, is_pinned, read_from_replica, routing
+from app.search import product_search_index
+from app.testing import QueryBudgetMixin, force_jwt_login
+from payments.models import OutboxJob
+from payments.outbox import enqueue
+
+
+class OrderTotalsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        cls.apple = Product.objects.create(name='Apple', price=Decimal('12.34'), currency=Product.Currency.UZS)
+        cls.pear = Product.objects.create(name='Pear', price=Decimal('5.00'), currency=Product.Currency.UZS)
+
+    def setUp(self):
+        self.order = Order.objects.create(user=self.user)
+
+    def test_new_order_has_zero_total(self):
+        self.assertEqual(self.order.total_amount, Decimal('0'))
+        self.assertEqual(self.order.total_tiyins, 0)
+
+    def test_totals_follow_line_changes(self):
+        line = OrderProduct.objects.create(order=self.order, product=self.apple, quantity=3)
+        OrderProduct.objects.create(order=self.order, product=self.pear, quantity=2)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('47.02'))
+        self.assertEqual(self.order.total_tiyins, 4702)
+
+        line.quantity = 1
+        line.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('22.34'))
+
+        line.delete()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('10.00'))
+        self.assertEqual(self.order.total_tiyins, 1000)
+
+    def test_line_save_costs_one_update(self):
+        line = OrderProduct(order=self.order, product=self.apple, quantity=1)
+        # INSERT of the line + UPDATE of the order totals
+        with self.assertNumQueries(2):
+            line.save()
+
+    def test_totals_follow_price_change(self):
+        OrderProduct.objects.create(order=self.order, product=self.pear, quantity=4)
+        paid = Order.objects.create(user=self.user)
+        OrderProduct.objects.create(order=paid, product=self.pear, quantity=4)
+        Order.objects.filter(pk=paid.pk).update(status=Order.OrderStatus.PAID)
+
+        pear = Product.objects.get(pk=self.pear.pk)
+        pear.price = Decimal('2.50')
+        pear.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('10.00'))
+        # Paid orders keep the amount they were paid at
+        paid.refresh_from_db()
+        self.assertEqual(paid.total_amount, Decimal('20.00'))
+
+        # Saving without touching the price does not recompute the totals
+        with self.assertNumQueries(1):
+            pear.save()
+
+    def test_reading_total_costs_no_queries(self):
+        OrderProduct.objects.create(order=self.order, product=self.apple, quantity=2)
+        order = Order.objects.get(pk=self.order.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(order.get_total_amount(), Decimal('24.68'))
+            self.assertEqual(order.get_total_amount_in_tiyins(), 2468)
+
+    def test_with_total_amount_annotates_in_one_query(self):
+        other = Order.objects.create(user=self.user)
+        OrderProduct.objects.create(order=self.order, product=self.apple, quantity=1)
+        OrderProduct.objects.create(order=other, product=self.pear, quantity=3)
+        with self.assertNumQueries(1):
+            totals = {
+                order.pk: order.lines_total_amount
+                for order in Order.objects.with_total_amount()
+            }
+        self.assertEqual(totals, {self.order.pk: Decimal('12.34'), other.pk: Decimal('15.00')})
+
+    def test_payment_uses_stored_total(self):
+        OrderProduct.objects.create(order=self.order, product=self.apple, quantity=1)
+        self.order.refresh_from_db()
+        payment = Payment.create_for_order(self.order)
+        self.assertEqual(payment.amount, Decimal('12.34'))
+
+
+class StatusTransitionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+
+    def setUp(self):
+        self.order = Order.objects.create(user=self.user)
+        self.payment = Payment.create_for_order(self.order)
+
+    def test_transition_is_one_conditional_update_per_row(self):
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(self.payment.transition(Payment.PaymentStatus.PAID, provider_payment_data={'state': 2}))
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(all(query['sql'].startswith('UPDATE') for query in queries.captured_queries))
+        self.assertIn("\"status\" = 'PENDING'", queries.captured_queries[0]['sql'])
+        self.assertNotIn('"amount"', queries.captured_queries[0]['sql'])
+        # The status stream is notified once committed
+        self.assertEqual(len(callbacks), 1)
+
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.provider_payment_data), ('PAID', {'state': 2}))
+        self.assertEqual(self.order.status, Order.OrderStatus.PAID)
+
+    def test_stale_transition_is_not_applied(self):
+        stale = Payment.objects.get(pk=self.payment.pk)
+        self.assertTrue(self.payment.transition(Payment.PaymentStatus.PAID))
+        self.assertFalse(stale.transition(Payment.PaymentStatus.CANCELED))
+        self.assertEqual(stale.status, Payment.PaymentStatus.PENDING)
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, Payment.PaymentStatus.PAID)
+
+    def test_unchanged_status_writes_nothing(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(self.payment.transition(Payment.PaymentStatus.PENDING))
+
+    def test_order_follows_only_from_the_expected_status(self):
+        self.order.transition(Order.OrderStatus.CANCELED)
+        self.assertTrue(self.payment.transition(Payment.PaymentStatus.PAID))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.CANCELED)
+
+    def test_invalid_transition(self):
+        with self.assertRaises(InvalidTransition):
+            self.order.transition(Order.OrderStatus.COMPLETED)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', price=Decimal('2.00'), currency=Product.Currency.UZS)
+            for i in range(5)
+        ])
+
+    def setUp(self):
+        super().setUp()
+        get_catalog_cache().clear()
+        clear_auth_caches()
+
+    def test_debug_responses_carry_query_headers(self):
+        force_jwt_login(self.client, self.user)
+        with override_settings(DEBUG=True):
+            response = self.client.get(reverse('products'))
+        self.assertEqual(response['X-DB-Queries'], str(response.query_recorder.count))
+        self.assertTrue(response['X-DB-Time'].endswith('ms'))
+        self.assertEqual(response['X-DB-Duplicate-Queries'], '0')
+
+    def test_headers_are_not_sent_without_debug(self):
+        force_jwt_login(self.client, self.user)
+        with override_settings(DEBUG=False):
+            response = self.client.get(reverse('products'))
+        self.assertNotIn('X-DB-Queries', response)
+
+    def test_token_views_stay_within_budget(self):
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'buyer', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryBudget(response)
+        tokens = response.json()
+        self.assertQueryBudget(self.client.post(reverse('token_refresh'), {'refresh': tokens['refresh']}))
+        self.assertQueryBudget(self.client.post(reverse('token_verify'), {'token': tokens['access']}))
+
+    def test_recorder_reports_repeated_statements(self):
+        with QueryRecorder() as recorder:
+            for product in self.products:
+                Product.objects.get(pk=product.pk)
+        self.assertEqual(recorder.count, 5)
+        self.assertEqual(recorder.duplicates, 4)
+        self.assertEqual(recorder.duplicated_statements()[0][0], 5)
+
+    def test_going_over_budget_fails(self):
+        force_jwt_login(self.client, self.user)
+        with override_settings(QUERY_BUDGETS={'products': 1}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'View products ran 2 queries, over its budget of 1'):
+                self.client.get(reverse('products'))
+
+    def test_going_over_budget_is_logged_outside_tests(self):
+        force_jwt_login(self.client, self.user)
+        with override_settings(QUERY_BUDGETS={'products': 1}, QUERY_BUDGET_RAISE=False):
+            with self.assertLogs('app.queries', 'WARNING'):
+                self.assertEqual(self.client.get(reverse('products')).status_code, 200)
+
+    def test_histograms_are_logged(self):
+        force_jwt_login(self.client, self.user)
+        query_stats.views.clear()
+        with override_settings(QUERY_STATS_LOG_INTERVAL=3600):
+            self.client.get(reverse('products'))
+            query_stats.started -= 3600
+            get_catalog_cache().clear()
+            with self.assertLogs('app.queries', 'INFO') as logs:
+                self.client.get(reverse('products'))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('view=products requests=2 duplicate_queries=0 queries[<=2:2] db_ms[', logs.output[0])
+
+
+class RouteAwareMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+        cls.order = Order.objects.create(user=cls.user)
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        clear_auth_caches()
+
+    def test_api_routes_skip_session_and_csrf(self):
+        # A browser that is logged in sends its session cookie along
+        self.client.force_login(self.user)
+        force_jwt_login(self.client, self.user)
+        self.client.get(reverse('products'))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('products'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(context.captured_queries, [])
+        self.assertNotIn('X-Frame-Options', response)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+    def test_api_routes_answer_401_instead_of_redirecting(self):
+        for url in (reverse('products'), reverse('orders'), reverse('order_detail', args=[self.order.id]),
+                    reverse('reports')):
+            self.assertEqual(self.client.get(url).status_code, 401)
+
+    def test_html_views_keep_the_full_stack(self):
+        response = self.client.get(reverse('checkout', args=[self.order.id]))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('X-Frame-Options', response)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('payment_status_stream', args=['unknown']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_benchmark_command(self):
+        stdout = StringIO()
+        # The first request through the full stack goes over the budget of the catalog
+        with self.assertLogs('app.queries', 'WARNING'):
+            call_command('benchmark_middleware', '--requests=5', '--warmup=1', stdout=stdout)
+        output = stdout.getvalue()
+        self.assertIn('full: mean=', output)
+        self.assertIn('queries/request=0.00', output)
+        self.assertIn('Route-aware stack saves', output)
+        self.assertFalse(User.objects.filter(username='benchmark-middleware').exists())
+
+
+@override_settings(PRODUCT_SEARCH_BACKGROUND_BUILD=False)
+class ProductSearchTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+        for name, price in [('Green apple', '3.00'), ('Red apple', '2.50'), ('Apple juice', '8.00'),
+                            ('Greek yogurt', '6.00'), ('Pear', '4.00')]:
+            Product.objects.create(name=name, price=Decimal(price), currency=Product.Currency.UZS)
+
+    def setUp(self):
+        super().setUp()
+        get_catalog_cache().clear()
+        clear_auth_caches()
+        product_search_index.reset()
+        self.addCleanup(product_search_index.reset)
+        force_jwt_login(self.client, self.user)
+
+    def search(self, **params):
+        response = self.client.get(reverse('product_search'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryBudget(response)
+        return [product['name'] for product in response.json()['results']], response['X-Search-Source']
+
+    def test_cold_index_falls_back_to_the_database(self):
+        self.assertEqual(self.search(q='apple'), (['Apple juice', 'Green apple', 'Red apple'], 'database'))
+
+    def test_index_and_database_agree(self):
+        # Tokens following punctuation rather than a space
+        for name in ('Dried-apple (sliced)', 'Kiwi/apple mix'):
+            Product.objects.create(name=name, price=Decimal('5.00'), currency=Product.Currency.UZS)
+        queries = [
+            {'q': 'apple'}, {'q': 'gre'}, {'q': 'gre app'}, {'q': 'APP', 'max_price': '3.00'},
+            {'q': 'a', 'min_price': '4', 'limit': 2}, {'q': 'kiwi'}, {'q': 'apple', 'currency': 'UZS'},
+            {'q': 'sli'}, {'q': 'apple mi'}, {'q': 'ple'},
+        ]
+        expected = [self.search(**query)[0] for query in queries]
+        product_search_index.build()
+        self.assertEqual([self.search(**query) for query in queries], [(names, 'index') for names in expected])
+        self.assertEqual(expected[2], ['Green apple'])
+        self.assertEqual(expected[0], ['Apple juice', 'Dried-apple (sliced)', 'Green apple', 'Kiwi/apple mix', 'Red apple'])
+        self.assertEqual(expected[7:], [['Dried-apple (sliced)'], ['Kiwi/apple mix'], []])
+
+    def test_index_follows_committed_changes(self):
+        product_search_index.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Golden apple', price=Decimal('5.00'), currency=Product.Currency.UZS)
+        with self.captureOnCommitCallbacks(execute=True):
+            pear = Product.objects.get(name='Pear')
+            pear.name = 'Apple pear'
+            pear.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(name='Red apple').delete()
+
+        self.assertEqual(self.search(q='apple'), (['Apple juice', 'Apple pear', 'Golden apple', 'Green apple'], 'index'))
+        self.assertEqual(self.search(q='pear'), (['Apple pear'], 'index'))
+        self.assertNotIn('red', product_search_index.tokens)
+
+    def test_database_fallback_looks_up_the_token_table(self):
+        pear = Product.objects.get(name='Pear')
+        pear.name = 'Apple pear'
+        pear.save()
+        self.assertEqual(set(pear.search_tokens.values_list('token', flat=True)), {'apple', 'pear'})
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.search(q='pea app'), (['Apple pear'], 'database'))
+        self.assertIn('app_productsearchtoken', context.captured_queries[-1]['sql'])
+
+        # Products created without signals are found once their tokens are rebuilt
+        Product.objects.bulk_create([Product(name='Blood orange', price=Decimal('1.00'), currency=Product.Currency.UZS)])
+        self.assertEqual(self.search(q='orange'), ([], 'database'))
+        call_command('rebuild_search_tokens', batch_size=2, stdout=StringIO())
+        self.assertEqual(self.search(q='orange'), (['Blood orange'], 'database'))
+        self.assertEqual(ProductSearchToken.objects.count(), 12)
+
+    def test_changes_from_other_processes_make_the_index_stale(self):
+        product_search_index.build()
+        bump_catalog_version()
+        self.assertEqual(self.search(q='pear'), (['Pear'], 'database'))
+
+    def test_requires_a_query(self):
+        self.assertEqual(self.client.get(reverse('product_search')).status_code, 400)
+
+
+class CatalogCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        cls.product = Product.objects.create(name='Apple', price=Decimal('1.00'), currency=Product.Currency.UZS)
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        clear_auth_caches()
+        force_jwt_login(self.client, self.user)
+
+    def catalog_queries(self, **headers):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/v1/products/', headers=headers)
+        return response, [q['sql'] for q in context.captured_queries if 'app_product' in q['sql']]
+
+    def test_conditional_get_skips_database(self):
+        response, queries = self.catalog_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(queries)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', response)
+
+        not_modified, queries = self.catalog_queries(if_none_match=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(queries, [])
+
+    def test_repeated_reads_are_served_from_cache(self):
+        first, __ = self.catalog_queries()
+        second, queries = self.catalog_queries()
+        self.assertEqual(queries, [])
+        self.assertEqual(first.json(), second.json())
+
+    def test_product_change_invalidates_cache(self):
+        etag = self.catalog_queries()[0]['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Green apple'
+            self.product.save()
+
+        response, queries = self.catalog_queries(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['name'], 'Green apple')
+
+    def test_deploy_check_refuses_local_cache(self):
+        self.assertEqual([error.id for error in check_shared_caches(None)], ['app.E001'] * 3)
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379/0'
+        }}):
+            self.assertEqual(check_shared_caches(None), [])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+        cls.admin = User.objects.create_superuser('admin')
+        cls.product = Product.objects.create(name='Primary', price=Decimal('1.00'), currency=Product.Currency.UZS)
+        # The replica lags behind: it has neither the product nor the orders
+        User.objects.using('replica').bulk_create([User(pk=cls.user.pk, username='buyer')])
+        Product.objects.using('replica').bulk_create([
+            Product(name='Replica', price=Decimal('1.00'), currency=Product.Currency.UZS)
+        ])
+        Order.objects.bulk_create([Order(user=cls.user)])
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        clear_auth_caches()
+        force_jwt_login(self.client, self.user)
+
+    def product_names(self):
+        return [product['name'] for product in self.client.get('/api/v1/products/').json()['results']]
+
+    @override_settings(REPLICA_PIN_SECONDS=0)
+    def test_catalog_is_read_from_replica(self):
+        self.assertEqual(self.product_names(), ['Replica'])
+        lines = b''.join(self.client.get('/api/v1/products/?stream=ndjson').streaming_content).splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['Replica'])
+
+        with override_settings(DATABASE_REPLICAS=[]):
+            get_catalog_cache().clear()
+            self.assertEqual(self.product_names(), ['Primary'])
+
+    def test_recent_catalog_change_is_read_from_default(self):
+        bump_catalog_version()
+        self.assertEqual(self.product_names(), ['Primary'])
+
+    def test_user_reads_own_writes_after_writing(self):
+        self.assertEqual(self.client.get(reverse('orders')).json()['results'], [])
+
+        response = self.client.post(reverse('orders'), {'lines': [{'product': self.product.pk, 'quantity': 1}]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(is_pinned(self.user))
+        self.assertEqual(len(self.client.get(reverse('orders')).json()['results']), 2)
+        self.assertEqual(self.client.get(reverse('order_detail', args=[response.json()['id']])).status_code, 200)
+
+        # Once the pin expired
+        get_pin_cache().clear()
+        self.assertEqual(self.client.get(reverse('orders')).json()['results'], [])
+
+    def test_reads_after_a_write_stay_on_default(self):
+        with routing():
+            self.assertEqual(read_from_replica(), 'replica')
+            self.assertEqual(Product.objects.get().name, 'Replica')
+            Product.objects.filter(pk=self.product.pk).update(name='Changed')
+            self.assertEqual(Product.objects.get().name, 'Changed')
+            self.assertIsNone(read_from_replica())
+
+        # Outside of a request
+        self.assertIsNone(read_from_replica())
+        self.assertEqual(Product.objects.get().name, 'Changed')
+
+    def test_admin_changelist_is_read_from_replica(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin:app_product_changelist'))
+        self.assertContains(response, 'Replica')
+        self.assertNotContains(response, 'Primary')
+        self.assertFalse(is_pinned(self.admin))
+
+
+class AdminChangelistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin')
+        cls.user = User.objects.create_user('buyer')
+        cls.product = Product.objects.create(name='Apple', price=Decimal('2.00'), currency=Product.Currency.UZS)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_orders(self, count):
+        for __ in range(count):
+            order = Order.objects.create(user=self.user)
+            OrderProduct.objects.create(order=order, product=self.product, quantity=1)
+            enqueue(Payment.create_for_order(order), OutboxJob.Operation.CREATE_TRANSACTION)
+
+    def changelist_queries(self, name, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(f'admin:{name}_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in context.captured_queries]
+
+    def test_changelists_cost_a_constant_number_of_queries(self):
+        names = ['app_order', 'app_orderproduct', 'app_payment', 'payments_outboxjob']
+        self.add_orders(2)
+        few = {name: len(self.changelist_queries(name)) for name in names}
+        self.add_orders(8)
+        self.assertEqual({name: len(self.changelist_queries(name)) for name in names}, few)
+
+    def test_changelists_never_count_the_whole_table(self):
+        self.add_orders(3)
+        queries = self.changelist_queries('app_payment', status__exact='PENDING')
+        counts = [sql for sql in queries if 'COUNT(' in sql.upper()]
+        self.assertTrue(counts)
+        for sql in counts:
+            self.assertIn('LIMIT', sql.upper())
+
+    def test_filtered_counts_stop_at_the_limit(self):
+        self.add_orders(5)
+        paginator = EstimatedCountPaginator(Payment.objects.filter(status='PENDING').order_by('pk'), 2)
+        paginator.count_limit = 3
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
+        self.assertEqual(EstimatedCountPaginator(Payment.objects.order_by('pk'), 2).count, 5)
+
+    def test_payment_filters_and_search(self):
+        self.add_orders(2)
+        payment = Payment.objects.first()
+        Payment.objects.filter(pk=payment.pk).update(status=Payment.PaymentStatus.PAID)
+
+        response = self.client.get(reverse('admin:app_payment_changelist'), {'status__exact': 'PAID'})
+        self.assertEqual(list(response.context['cl'].result_list), [payment])
+        response = self.client.get(reverse('admin:app_payment_changelist'), {'q': payment.payment_id})
+        self.assertEqual(list(response.context['cl'].result_list), [payment])
+
+        self.assertEqual(self.client.get(reverse('admin:app_payment_change', args=[payment.pk])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('admin:app_order_change', args=[payment.order_id])).status_code, 200)
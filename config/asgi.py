@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Build the in-memory product search index as soon as the worker starts
+from app.search import product_search_index  # noqa: E402
+
+product_search_index.warm()
@@ -18,22 +18,38 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
+    'django_filters',
     'api',
     'app',
     'payments',
+    'reports',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'app.middleware.DeadlineMiddleware',
+    'app.middleware.QueryBudgetMiddleware',
+    # The route-aware middlewares are the Django ones, skipped for the
+    # stateless API routes below (JWT-authenticated by DRF)
+    'app.middleware.RouteAwareSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.contrib.auth.middleware.LoginRequiredMiddleware'
+    'app.middleware.RouteAwareCsrfViewMiddleware',
+    'app.middleware.RouteAwareAuthenticationMiddleware',
+    'app.middleware.RouteAwareMessageMiddleware',
+    'app.middleware.RouteAwareXFrameOptionsMiddleware',
+    'app.middleware.RouteAwareLoginRequiredMiddleware',
+    'app.middleware.ReplicaRoutingMiddleware',
 ]
 
+# Seconds a request may spend, outgoing calls included (app.deadlines)
+REQUEST_DEADLINE = 15
+
+# Routes served without session, CSRF, messages, clickjacking and login
+# middleware; the payment pages below /api/ use the session and keep them
+STATELESS_ROUTE_PREFIXES = ('/api/',)
+STATEFUL_ROUTE_PREFIXES = ('/api/v1/payments/',)
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -58,9 +74,44 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    # Stand-in for a read replica: a copy of db.sqlite3, enabled with
+    # DB_REPLICAS=replica (nothing copies the writes over)
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+    },
+}
+
+# Read replicas (app.routers): aliases of DATABASES the reads of the catalog,
+# order history and admin changelists go to. Users who wrote read from
+# default for REPLICA_PIN_SECONDS, longer than the replication lag. The pins
+# live in REPLICA_PIN_CACHE_ALIAS, which must be shared by the worker
+# processes (see CACHES)
+DATABASE_ROUTERS = ['app.routers.ReplicaRouter']
+DATABASE_REPLICAS = [alias for alias in os.getenv("DB_REPLICAS", "").split(",") if alias]
+REPLICA_PIN_CACHE_ALIAS = 'default'
+REPLICA_PIN_SECONDS = 10
+
+# Local memory is per process: enough for a single development or test
+# process only. With several worker processes the catalog version counter
+# must be shared, or the other workers serve stale pages (and 304s) until
+# CATALOG_CACHE_TIMEOUT, and so must the JWT user version counters, or they
+# keep authenticating deactivated users until JWT_USER_CACHE_TTL. prod.py
+# uses Redis, and `check --deploy` refuses a local cache (app.checks)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# Rebuild the in-memory product search index in a background thread when it
+# is cold or stale (searches use the database meanwhile)
+PRODUCT_SEARCH_BACKGROUND_BUILD = True
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -92,9 +143,85 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
+    ),
+
+    # Stateless API routes skip LoginRequiredMiddleware, see STATELESS_ROUTE_PREFIXES
+    'DEFAULT_PERMISSION_CLASSES': (
+        'rest_framework.permissions.IsAuthenticated',
     )
 
 }
 
-BASE_URL = os.getenv("BASE_URL")
\ No newline at end of file
+# JWT authentication cache (api.authentication): per-process users,
+# invalidated through per-user version counters in a cache shared by the
+# worker processes (see CACHES), so that deactivations and password changes
+# are seen by all of them
+JWT_AUTH_CACHE_ALIAS = 'default'
+JWT_USER_CACHE_SIZE = 10000
+JWT_USER_CACHE_TTL = 5 * 60
+
+BASE_URL = os.getenv("BASE_URL")
+
+# Login Payme uses to authenticate merchant API callbacks
+PAYME_MERCHANT_LOGIN = 'Paycom'
+
+# Payment status stream: how long a connection is held open, and how often
+# the status is re-read to catch changes published by other processes
+PAYMENT_STREAM_TIMEOUT = 30
+PAYMENT_STREAM_POLL_INTERVAL = 5
+
+# Payme HTTP transport, shared by every request of a worker process
+PAYME_POOL_SIZE = int(os.getenv("PAYME_POOL_SIZE", 10))
+PAYME_ASYNC_MAX_CONNECTIONS = int(os.getenv("PAYME_ASYNC_MAX_CONNECTIONS", 100))
+PAYME_KEEP_ALIVE = True
+PAYME_CONNECT_TIMEOUT = 3.05
+PAYME_READ_TIMEOUT = 10
+
+# Payme failure handling: consecutive failures that open the circuit of an
+# RPC method, seconds before it lets a trial call through, and seconds
+# before a read-only call is sent again if Payme has not answered (unset
+# disables hedging)
+PAYME_BREAKER_FAILURE_THRESHOLD = 5
+PAYME_BREAKER_RESET_TIMEOUT = 30
+PAYME_HEDGE_DELAY = float(os.getenv("PAYME_HEDGE_DELAY", 0)) or None
+
+# Outbox of Payme calls (payments.outbox): jobs claimed per batch by
+# run_outbox_worker, seconds a claim lasts, and retries with backoff
+PAYME_OUTBOX_BATCH_SIZE = 50
+PAYME_OUTBOX_POLL_INTERVAL = 1
+PAYME_OUTBOX_LEASE = 60
+PAYME_OUTBOX_MAX_ATTEMPTS = 8
+PAYME_OUTBOX_RETRY_BASE_DELAY = 2
+PAYME_OUTBOX_RETRY_MAX_DELAY = 5 * 60
+# Seconds done jobs are kept, and between the deletions of older ones
+PAYME_OUTBOX_RETENTION = 7 * 24 * 60 * 60
+PAYME_OUTBOX_PURGE_INTERVAL = 60 * 60
+# Seconds between the CheckTransaction calls made for the status polls of a payment
+PAYME_STATUS_CHECK_INTERVAL = 10
+
+# Sales rollups (reports.rollups): seconds before the watermark the scan for
+# changed rows starts, for rows committed late by long transactions, and
+# seconds the lease of an update lasts without a day being rebuilt
+ROLLUP_WATERMARK_OVERLAP = 5 * 60
+ROLLUP_LEASE = 10 * 60
+
+# Per-request query instrumentation (app.middleware.QueryBudgetMiddleware).
+# Budgets are keyed by URL name; going over one logs a warning, or raises
+# when QUERY_BUDGET_RAISE is on (as it is in the test suite)
+QUERY_BUDGETS = {
+    'products': 3,
+    'product_search': 3,
+    'orders': 8,
+    'order_detail': 4,
+    'checkout': 9,
+    'init_payme': 8,
+    'payment_status': 6,
+    'reports': 4,
+    'token_obtain_pair': 3,
+    'token_refresh': 2,
+    'token_verify': 0,
+}
+QUERY_BUDGET_RAISE = False
+# Seconds between per-view query histograms in the logs, 0 disables them
+QUERY_STATS_LOG_INTERVAL = 0
\ No newline at end of file
@@ -59,4 +59,6 @@ SIMPLE_JWT = {
 # Payme settings
 PAYME_MERCHANT_ID = os.getenv("MERCHANT_ID")
 PAYME_SECRET_KEY = os.getenv("SECRET_KEY")
-PAYME_CHECKOUT_URL = 'https://test.paycom.uz'
\ No newline at end of file
+PAYME_CHECKOUT_URL = 'https://test.paycom.uz'
+# JSON-RPC endpoint of the Payme API, e.g. the local `run_fake_payme` server
+PAYME_API_URL = os.getenv("PAYME_API_URL", PAYME_CHECKOUT_URL)
\ No newline at end of file
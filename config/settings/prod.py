@@ -23,6 +23,26 @@ DATABASES = {
     }
 }
 
+# Read replicas, e.g. DB_REPLICA_HOSTS=10.0.0.2,10.0.0.3 (same credentials)
+for index, host in enumerate(filter(None, os.getenv("DB_REPLICA_HOSTS", "").split(",")), start=1):
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        # Tests run against default only
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# Shared by every worker process, see CACHES in base.py
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"),
+    }
+}
+
+QUERY_STATS_LOG_INTERVAL = 60
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -48,4 +68,6 @@ SIMPLE_JWT = {
 # Payme settings
 PAYME_MERCHANT_ID = os.getenv("MERCHANT_ID")
 PAYME_SECRET_KEY = os.getenv("SECRET_KEY")
-PAYME_CHECKOUT_URL = 'https://checkout.paycom.uz'
\ No newline at end of file
+PAYME_CHECKOUT_URL = 'https://checkout.paycom.uz'
+# JSON-RPC endpoint of the Payme API, e.g. the local `run_fake_payme` server
+PAYME_API_URL = os.getenv("PAYME_API_URL", PAYME_CHECKOUT_URL)
\ No newline at end of file
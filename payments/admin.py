@@ -1,3 +1,13 @@
 from django.contrib import admin
 
-# Register your models here.
+from app.admin import LargeTableAdmin
+from .models import OutboxJob
+
+
+@admin.register(OutboxJob)
+class OutboxJobAdmin(LargeTableAdmin):
+    # Filters backed by outbox_state_run_at_idx
+    list_display = ['id', 'payment', 'operation', 'state', 'attempts', 'run_at', 'last_error']
+    list_filter = ['state', 'operation']
+    list_select_related = ['payment']
+    raw_id_fields = ['payment']
@@ -0,0 +1,236 @@
+"""
+Local stand-in for the Payme JSON-RPC API.
+
+Implements the methods ``PaymeClient`` calls, keeps transactions in
+memory and can inject latency, RPC errors and HTTP failures. Used by the
+test suite, by the ``run_fake_payme`` command during development and by
+the ``loadtest_checkout`` harness.
+"""
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Transaction states, as defined by Payme
+STATE_CREATED = 1
+STATE_PERFORMED = 2
+STATE_CANCELED = -1
+STATE_CANCELED_AFTER_PERFORM = -2
+
+TRANSACTION_NOT_FOUND = -31003
+CANNOT_PERFORM = -31008
+INTERNAL_ERROR = -32400
+
+
+class FakePaymeError(Exception):
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class FakePayme:
+    """
+    In-memory Payme behaviour.
+
+    Args:
+        latency (float): Seconds every call takes.
+        jitter (float): Extra random latency, up to this many seconds.
+        error_rate (float): Share of calls answered with a JSON-RPC error.
+        http_error_rate (float): Share of calls answered with HTTP 502.
+        check_state (int): State CheckTransaction reports for created
+            transactions, e.g. 2 to simulate customers completing payment.
+
+    ``delays`` can be filled with the latencies of the next calls, e.g. to
+    stall a single call.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, http_error_rate=0.0, check_state=STATE_CREATED):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.check_state = check_state
+        self.delays = []
+        self.transactions = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def add_transaction(self, transaction_id, state=STATE_CREATED, **fields):
+        """Seed a transaction, as if it had been created through the API"""
+        with self._lock:
+            self.transactions[transaction_id] = {
+                "transaction": transaction_id,
+                "state": state,
+                "create_time": int(time.time() * 1000),
+                "perform_time": 0,
+                "cancel_time": 0,
+                "reason": None,
+                **fields,
+            }
+
+    def delay(self):
+        """Time to wait before answering a call"""
+        with self._lock:
+            if self.delays:
+                return self.delays.pop(0)
+        return self.latency + random.uniform(0, self.jitter)
+
+    def fail_http(self):
+        return random.random() < self.http_error_rate
+
+    def dispatch(self, method, params):
+        """
+        Runs one RPC method.
+
+        Returns:
+            dict: The result of the method.
+        Raises:
+            FakePaymeError: For unknown methods, unknown transactions and injected errors.
+        """
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if random.random() < self.error_rate:
+            raise FakePaymeError(INTERNAL_ERROR, "Injected error")
+
+        handler = {
+            "CheckPerformTransaction": self.check_perform_transaction,
+            "CreateTransaction": self.create_transaction,
+            "PerformTransaction": self.perform_transaction,
+            "CancelTransaction": self.cancel_transaction,
+            "CheckTransaction": self.check_transaction,
+        }.get(method)
+
+        if handler is None:
+            raise FakePaymeError(-32601, "Method not found")
+
+        with self._lock:
+            return handler(params)
+
+    def get_transaction(self, params):
+        transaction = self.transactions.get(params.get("id"))
+        if transaction is None:
+            raise FakePaymeError(TRANSACTION_NOT_FOUND, "Transaction not found")
+        return transaction
+
+    def check_perform_transaction(self, params):
+        return {"allow": True}
+
+    def create_transaction(self, params):
+        transaction_id = uuid.uuid4().hex
+        self.transactions[transaction_id] = {
+            "transaction": transaction_id,
+            "state": STATE_CREATED,
+            "create_time": params.get("time") or int(time.time() * 1000),
+            "perform_time": 0,
+            "cancel_time": 0,
+            "reason": None,
+        }
+        transaction = self.transactions[transaction_id]
+        return {key: transaction[key] for key in ("create_time", "transaction", "state")}
+
+    def perform_transaction(self, params):
+        transaction = self.get_transaction(params)
+        if transaction["state"] == STATE_CREATED:
+            transaction.update(state=STATE_PERFORMED, perform_time=int(time.time() * 1000))
+        elif transaction["state"] != STATE_PERFORMED:
+            raise FakePaymeError(CANNOT_PERFORM, "Transaction cannot be performed")
+        return {key: transaction[key] for key in ("transaction", "perform_time", "state")}
+
+    def cancel_transaction(self, params):
+        transaction = self.get_transaction(params)
+        if transaction["state"] > 0:
+            state = STATE_CANCELED if transaction["state"] == STATE_CREATED else STATE_CANCELED_AFTER_PERFORM
+            transaction.update(state=state, cancel_time=int(time.time() * 1000), reason=params.get("reason"))
+        return {key: transaction[key] for key in ("transaction", "cancel_time", "state")}
+
+    def check_transaction(self, params):
+        transaction = self.get_transaction(params)
+        if transaction["state"] == STATE_CREATED and self.check_state != STATE_CREATED:
+            # Simulate the customer finishing (or abandoning) the payment
+            time_field = "perform_time" if self.check_state == STATE_PERFORMED else "cancel_time"
+            transaction.update(state=self.check_state, **{time_field: int(time.time() * 1000)})
+        return dict(transaction)
+
+
+class FakePaymeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        fake = self.server.fake
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(fake.delay())
+
+        if fake.fail_http():
+            return self.respond(502, {"error": "Injected HTTP failure"})
+
+        try:
+            response = {"result": fake.dispatch(payload.get("method"), payload.get("params") or {})}
+        except FakePaymeError as e:
+            response = {"error": {"code": e.code, "message": {"en": e.message}}}
+
+        self.respond(200, {"jsonrpc": "2.0", "id": payload.get("id"), **response})
+
+    def respond(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakePaymeServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering like Payme.
+
+    Usage::
+
+        with FakePaymeServer(FakePayme(latency=0.05)) as server:
+            settings.PAYME_API_URL = server.url
+    """
+    daemon_threads = True
+    # Accept bursts of concurrent connections without resets
+    request_queue_size = 1024
+
+    def __init__(self, fake=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), FakePaymeHandler)
+        self.fake = fake or FakePayme()
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        """Serve in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # Clients that timed out or hedged their call hang up before the answer
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
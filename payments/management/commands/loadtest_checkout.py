@@ -0,0 +1,211 @@
+import asyncio
+import contextlib
+import time
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import reverse
+
+from app.models import Order, OrderProduct, Payment, Product
+from payments.fake_payme import FakePayme, FakePaymeServer
+from payments.metrics import format_latencies, summarize_latencies
+from payments.outbox import OutboxWorker
+from payments.payme_client import AsyncPaymeClient
+
+LOADTEST_USERNAME_PREFIX = 'loadtest-'
+STEPS = ('checkout', 'init_payme', 'payment_status')
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the checkout -> init_payme_payment -> payment_status flow against a fake Payme "
+        "server at a target concurrency and report latency percentiles and throughput. The "
+        "Payme calls are made by an outbox worker running alongside."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help="Number of customers going through checkout at the same time.")
+        parser.add_argument('--flows', type=int, default=200,
+                            help="Total number of checkout flows to run.")
+        parser.add_argument('--lines', type=int, default=5,
+                            help="Number of products in every order.")
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help="Seconds every fake Payme call takes.")
+        parser.add_argument('--jitter', type=float, default=0.0,
+                            help="Extra random fake Payme latency, up to this many seconds.")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Share of fake Payme calls answered with a JSON-RPC error.")
+        parser.add_argument('--http-error-rate', type=float, default=0.0,
+                            help="Share of fake Payme calls answered with HTTP 502.")
+        parser.add_argument('--check-state', type=int, default=2, choices=[1, 2, -1, -2],
+                            help="State CheckTransaction reports for created transactions.")
+        parser.add_argument('--payme-url', default=None,
+                            help="Use an already running server (e.g. run_fake_payme) instead of an in-process one.")
+        parser.add_argument('--status-timeout', type=float, default=30,
+                            help="Seconds a flow waits for its payment to leave PENDING.")
+        parser.add_argument('--poll-interval', type=float, default=0.05,
+                            help="Seconds between payment_status requests, and outbox checks of the worker.")
+        parser.add_argument('--keep-data', action='store_true',
+                            help="Keep the load test user, products and orders afterwards.")
+
+    def handle(self, *args, **options):
+        user, products, orders = self.create_data(options['flows'], options['lines'])
+
+        try:
+            with self.payme_server(options) as url, override_settings(PAYME_API_URL=url):
+                started = time.perf_counter()
+                results = asyncio.run(self.run(user, orders, options))
+                elapsed = time.perf_counter() - started
+        finally:
+            if not options['keep_data']:
+                self.delete_data(user, products, orders)
+
+        self.report(results, elapsed)
+
+    @contextlib.contextmanager
+    def payme_server(self, options):
+        """Yields the URL of the Payme API to test against"""
+        if options['payme_url']:
+            yield options['payme_url']
+            return
+
+        fake = FakePayme(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            http_error_rate=options['http_error_rate'],
+            check_state=options['check_state'],
+        )
+        with FakePaymeServer(fake) as server:
+            yield server.url
+
+        self.stdout.write("Fake Payme calls: " + ", ".join(f"{method}={count}" for method, count in fake.calls.items()))
+
+    def create_data(self, flows, lines):
+        """Creates a throwaway customer with one order of ``lines`` new products per flow"""
+        user = User.objects.create_user(LOADTEST_USERNAME_PREFIX + uuid.uuid4().hex[:12])
+
+        products = Product.objects.bulk_create(
+            Product(name=f'Load test product {index}', price=Decimal('1000.00'), currency=Product.Currency.UZS)
+            for index in range(lines)
+        )
+        orders = Order.objects.bulk_create(Order(user=user) for __ in range(flows))
+        OrderProduct.objects.bulk_create(
+            OrderProduct(order=order, product=product, quantity=1, price=product.price)
+            for order in orders
+            for product in products
+        )
+        Order.objects.filter(pk__in=[order.pk for order in orders]).recalculate_totals()
+
+        return user, products, orders
+
+    def delete_data(self, user, products, orders):
+        """Deletes what ``create_data`` created, and nothing else"""
+        Order.objects.filter(pk__in=[order.pk for order in orders], user=user).delete()
+        Product.objects.filter(pk__in=[product.pk for product in products]).delete()
+        user.delete()
+
+    async def run(self, user, orders, options):
+        """Runs one flow per order, ``concurrency`` at a time, with an outbox worker"""
+        concurrency = options['concurrency']
+        semaphore = asyncio.Semaphore(concurrency)
+
+        # Outside INTERNAL_IPS, so that debug tooling stays out of the measurements
+        host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+        clients = []
+        for __ in range(concurrency):
+            client = AsyncClient(HTTP_HOST=host, REMOTE_ADDR='192.0.2.1')
+            await client.aforce_login(user)
+            clients.append(client)
+
+        async def flow(index, order):
+            async with semaphore:
+                return await self.flow(clients[index % concurrency], order, options)
+
+        stop = asyncio.Event()
+        worker = asyncio.create_task(OutboxWorker(batch_size=concurrency).run(options['poll_interval'], stop))
+        try:
+            return await asyncio.gather(*(flow(index, order) for index, order in enumerate(orders)))
+        finally:
+            stop.set()
+            await worker
+            await AsyncPaymeClient.shared().aclose()
+
+    async def flow(self, client, order, options):
+        """
+        Goes through checkout for one order. The payment_status step polls
+        until the payment leaves PENDING; it fails when that takes longer
+        than ``--status-timeout``.
+
+        Returns:
+            dict: Latency of every step that ran, and the step that failed, if any.
+        """
+        result = {'latencies': {}, 'failed': None, 'status': None}
+
+        async def step(name, url):
+            started = time.perf_counter()
+            response = await client.get(url)
+            result['latencies'][name] = time.perf_counter() - started
+            if response.status_code != 200 or (
+                response['Content-Type'].startswith('application/json') and not response.json().get('success')
+            ):
+                result['failed'] = name
+            return response
+
+        await step('checkout', reverse('checkout', args=[order.id]))
+        if not result['failed']:
+            response = await step('init_payme', reverse('init_payme', args=[order.id]))
+        if not result['failed']:
+            url = reverse('payment_status', args=[response.json()['payment_id']])
+            started = time.perf_counter()
+            deadline = started + options['status_timeout']
+
+            while True:
+                response = await step('payment_status', url)
+                if result['failed']:
+                    break
+
+                result['status'] = response.json()['status']
+                if result['status'] != Payment.PaymentStatus.PENDING:
+                    break
+                if time.perf_counter() >= deadline:
+                    result['failed'] = 'payment_status'
+                    break
+                await asyncio.sleep(options['poll_interval'])
+
+            result['latencies']['payment_status'] = time.perf_counter() - started
+
+        return result
+
+    def report(self, results, elapsed):
+        completed = [result for result in results if not result['failed']]
+        failed = {}
+        for result in results:
+            if result['failed']:
+                failed[result['failed']] = failed.get(result['failed'], 0) + 1
+
+        statuses = {}
+        for result in completed:
+            statuses[result['status']] = statuses.get(result['status'], 0) + 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ran {len(results)} checkout flows in {elapsed:.2f}s "
+            f"({len(completed) / elapsed if elapsed else 0:.1f} completed/s), "
+            f"{len(results) - len(completed)} failed"
+            + (f" ({', '.join(f'{step}={count}' for step, count in failed.items())})" if failed else "")
+        ))
+        self.stdout.write("Final statuses: " + (", ".join(
+            f"{status}={count}" for status, count in sorted(statuses.items())
+        ) or "none"))
+
+        for name in STEPS:
+            latencies = [result['latencies'][name] for result in results if name in result['latencies']]
+            self.stdout.write(f"{name}: {format_latencies(summarize_latencies(latencies))}")
+
+        flows = [sum(result['latencies'].values()) for result in completed]
+        self.stdout.write(f"flow: {format_latencies(summarize_latencies(flows))}")
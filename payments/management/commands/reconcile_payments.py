@@ -0,0 +1,139 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from app.models import Order, Payment
+from payments.metrics import format_latencies, summarize_latencies
+from payments.notifications import payment_status_hub
+from payments.payme_client import PaymeClient
+
+
+class Command(BaseCommand):
+    help = "Check stale pending payments against Payme and apply their final status in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=15,
+                            help="Only reconcile payments created more than this many minutes ago.")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Number of payments loaded and updated at a time.")
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help="Number of CheckTransaction calls in flight.")
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Stop after checking this many payments.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Check the payments without writing any change.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['older_than'])
+        queryset = (
+            Payment.objects
+            .filter(status=Payment.PaymentStatus.PENDING, provider_transaction_id__isnull=False, created_at__lt=cutoff)
+            .only('id', 'order_id', 'payment_id', 'status', 'provider_transaction_id', 'provider_payment_data')
+        )
+
+        client = PaymeClient.shared()
+        latencies, updated, errors, checked = [], {}, 0, 0
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            for chunk in self.iter_chunks(queryset, options['chunk_size'], options['limit']):
+                results = list(executor.map(lambda payment: self.check(client, payment), chunk))
+
+                for payment, result, latency in results:
+                    latencies.append(latency)
+                    if isinstance(result, Exception):
+                        errors += 1
+                        self.stderr.write(f"Payment {payment.payment_id}: {result}")
+
+                for status, count in self.apply(results, options['dry_run']).items():
+                    updated[status] = updated.get(status, 0) + count
+
+                checked += len(chunk)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"Checked {checked} payments ({checked / elapsed:.1f}/s)")
+
+        elapsed = time.perf_counter() - started
+        prefix = "[dry run] " if options['dry_run'] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Checked {checked} payments in {elapsed:.2f}s "
+            f"({checked / elapsed if elapsed else 0:.1f}/s), {errors} errors, "
+            f"updated: {', '.join(f'{status}={count}' for status, count in sorted(updated.items())) or 'none'}"
+        ))
+        self.stdout.write(f"CheckTransaction latency: {format_latencies(summarize_latencies(latencies))}")
+
+    def iter_chunks(self, queryset, chunk_size, limit=None):
+        """Yield the payments in primary key order, one keyset-paginated chunk at a time"""
+        last_id, remaining = 0, limit
+
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = list(queryset.filter(id__gt=last_id).order_by('id')[:size])
+            if not chunk:
+                return
+
+            yield chunk
+
+            last_id = chunk[-1].id
+            if remaining is not None:
+                remaining -= len(chunk)
+
+    def check(self, client, payment):
+        """Call CheckTransaction, returning the result or the raised exception"""
+        started = time.perf_counter()
+        try:
+            result = client.check_transaction(payment)
+        except Exception as e:
+            result = e
+        return payment, result, time.perf_counter() - started
+
+    def apply(self, results, dry_run):
+        """
+        Applies the Payme states of a chunk with bulk updates.
+
+        Returns:
+            dict: Number of payments moved to each status.
+        """
+        changed = []
+        for payment, result, __ in results:
+            if isinstance(result, Exception):
+                continue
+            status = Payment.status_for_provider_state(result.get('state'))
+            if status is not None:
+                payment.status = status
+                payment.provider_payment_data = result
+                changed.append(payment)
+
+        if not dry_run and changed:
+            now = timezone.now()
+
+            with transaction.atomic():
+                # Lock the payments that are still pending, concurrent updates win
+                pending = set(
+                    Payment.objects
+                    .select_for_update()
+                    .filter(pk__in=[payment.pk for payment in changed], status=Payment.PaymentStatus.PENDING)
+                    .values_list('pk', flat=True)
+                )
+                changed = [payment for payment in changed if payment.pk in pending]
+
+                for payment in changed:
+                    payment.updated_at = now
+                    # bulk_update sends no post_save, notify the status streams directly
+                    transaction.on_commit(partial(payment_status_hub.publish, payment.payment_id, payment.status))
+                Payment.objects.bulk_update(changed, ['status', 'provider_payment_data', 'updated_at'], batch_size=500)
+
+                paid_orders = [payment.order_id for payment in changed if payment.status == Payment.PaymentStatus.PAID]
+                Order.objects.filter(
+                    pk__in=paid_orders,
+                    status=Order.OrderStatus.PENDING
+                ).update(status=Order.OrderStatus.PAID, updated_at=now)
+
+        updated = {}
+        for payment in changed:
+            updated[payment.status] = updated.get(payment.status, 0) + 1
+        return updated
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from payments.fake_payme import FakePayme, FakePaymeServer
+
+
+class Command(BaseCommand):
+    help = "Run a local fake Payme JSON-RPC server (point PAYME_API_URL at it)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help="Seconds every call takes.")
+        parser.add_argument('--jitter', type=float, default=0.0,
+                            help="Extra random latency, up to this many seconds.")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Share of calls answered with a JSON-RPC error.")
+        parser.add_argument('--http-error-rate', type=float, default=0.0,
+                            help="Share of calls answered with HTTP 502.")
+        parser.add_argument('--check-state', type=int, default=2, choices=[1, 2, -1, -2],
+                            help="State CheckTransaction reports for created transactions.")
+
+    def handle(self, *args, **options):
+        fake = FakePayme(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            http_error_rate=options['http_error_rate'],
+            check_state=options['check_state'],
+        )
+        server = FakePaymeServer(fake, host=options['host'], port=options['port'])
+        self.stdout.write(f"Fake Payme listening on {server.url}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,44 @@
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from payments.outbox import OutboxWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Make the Payme calls recorded in the outbox: claim due jobs in batches, run every "
+        "batch concurrently and retry failed calls with backoff."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Number of jobs claimed and run at a time (default: PAYME_OUTBOX_BATCH_SIZE).")
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Seconds between checks for new jobs while idle (default: PAYME_OUTBOX_POLL_INTERVAL).")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once no job is due instead of waiting for new ones.")
+
+    def handle(self, *args, **options):
+        worker = OutboxWorker(batch_size=options['batch_size'])
+        # Database access runs on this thread, the Payme calls on the event loop
+        async_to_sync(self.run)(worker, options)
+
+    async def run(self, worker, options):
+        try:
+            if not options['once']:
+                self.stdout.write("Running outbox jobs, press CTRL-C to stop")
+                await worker.run(options['poll_interval'])
+                return
+
+            states = await worker.run_pending()
+        finally:
+            if worker.client is not None:
+                await worker.client.aclose()
+
+        counts = {}
+        for state in states:
+            counts[state] = counts.get(state, 0) + 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Ran {len(states)} outbox jobs: "
+            + (", ".join(f"{state}={count}" for state, count in sorted(counts.items())) or "none")
+        ))
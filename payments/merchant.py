@@ -0,0 +1,372 @@
+"""
+Payme merchant API: the JSON-RPC callbacks Payme sends to the shop.
+
+Every method runs a bounded number of indexed queries: transactions are
+looked up by ``provider_transaction_id`` and orders by primary key, and
+rows are locked with ``SELECT ... FOR UPDATE`` while their state changes.
+"""
+import base64
+import binascii
+import hmac
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from app.models import Order, Payment
+
+logger = logging.getLogger(__name__)
+
+# Transaction states, as defined by Payme
+STATE_CREATED = 1
+STATE_PERFORMED = 2
+STATE_CANCELED = -1
+STATE_CANCELED_AFTER_PERFORM = -2
+
+# Cancellation reason used when a transaction expires
+REASON_TIMEOUT = 4
+
+# Payme cancels transactions that are not performed within 12 hours
+TRANSACTION_TIMEOUT_MS = 12 * 60 * 60 * 1000
+
+STATUS_STATES = {
+    Payment.PaymentStatus.PENDING: STATE_CREATED,
+    Payment.PaymentStatus.PAID: STATE_PERFORMED,
+    Payment.PaymentStatus.FAILED: STATE_CANCELED,
+    Payment.PaymentStatus.CANCELED: STATE_CANCELED,
+    Payment.PaymentStatus.REFUNDED: STATE_CANCELED_AFTER_PERFORM,
+}
+
+
+class MerchantError(Exception):
+    """Error reported to Payme in the JSON-RPC ``error`` member"""
+
+    PARSE_ERROR = -32700
+    INVALID_REQUEST = -32600
+    METHOD_NOT_FOUND = -32601
+    INVALID_HTTP_METHOD = -32300
+    SYSTEM_ERROR = -32400
+    INSUFFICIENT_PRIVILEGE = -32504
+    INVALID_AMOUNT = -31001
+    TRANSACTION_NOT_FOUND = -31003
+    CANNOT_CANCEL = -31007
+    CANNOT_PERFORM = -31008
+    ORDER_NOT_FOUND = -31050
+    ORDER_UNAVAILABLE = -31051
+
+    def __init__(self, code, message, data=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+    def as_dict(self):
+        return {
+            "code": self.code,
+            "message": {"en": self.message, "ru": self.message, "uz": self.message},
+            "data": self.data,
+        }
+
+
+def now_ms():
+    """Current time in milliseconds, the unit used by Payme"""
+    return int(time.time() * 1000)
+
+
+def check_authorization(header):
+    """
+    Validates the Basic credentials Payme sends with every callback.
+
+    Args:
+        header (str): Value of the 'Authorization' header.
+    Raises:
+        MerchantError: When the credentials are missing or wrong, or no
+            ``PAYME_SECRET_KEY`` is configured.
+    """
+    scheme, __, encoded = (header or "").partition(" ")
+    try:
+        credentials = base64.b64decode(encoded, validate=True).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError):
+        credentials = ""
+
+    # Without a key every callback is refused, rather than accepting "Paycom:None"
+    secret_key = getattr(settings, 'PAYME_SECRET_KEY', None)
+    expected = f"{settings.PAYME_MERCHANT_LOGIN}:{secret_key}"
+    if not secret_key or scheme != "Basic" or not hmac.compare_digest(credentials.encode(), expected.encode()):
+        raise MerchantError(MerchantError.INSUFFICIENT_PRIVILEGE, "Insufficient privilege", "authorization")
+
+
+def param(params, name, kind):
+    """
+    A required parameter of the request, checked before it reaches a query:
+    a missing id must not match the payments that have no transaction.
+
+    Args:
+        params (dict): Parameters of the request.
+        name (str): Name of the parameter.
+        kind (type | tuple): Type(s) the value must have.
+    Raises:
+        MerchantError: When the parameter is missing, empty or of another type.
+    """
+    value = params.get(name)
+    # bool is an int, but never a valid id, time or amount
+    if not isinstance(value, kind) or isinstance(value, bool) or value == "":
+        raise MerchantError(MerchantError.INVALID_REQUEST, f"Missing or invalid parameter: {name}", name)
+    return value
+
+
+def transaction_state(payment):
+    return STATUS_STATES[payment.status]
+
+
+def transaction_data(payment):
+    """Times and reason recorded for a transaction"""
+    data = payment.provider_payment_data or {}
+    return {
+        "perform_time": data.get("perform_time", 0),
+        "cancel_time": data.get("cancel_time", 0),
+        "reason": data.get("reason"),
+    }
+
+
+def get_order(params, lock=False):
+    """Order referenced by the ``account`` parameter of the request"""
+    order_id = (params.get("account") or {}).get("order_id")
+    queryset = Order.objects.select_for_update() if lock else Order.objects.all()
+
+    try:
+        return queryset.only('id', 'status', 'total_amount', 'total_tiyins').get(pk=int(order_id))
+    except (Order.DoesNotExist, TypeError, ValueError):
+        raise MerchantError(MerchantError.ORDER_NOT_FOUND, "Order not found", "order_id")
+
+
+def validate_order(order, amount):
+    if order.status != Order.OrderStatus.PENDING:
+        raise MerchantError(MerchantError.ORDER_UNAVAILABLE, "Order is not awaiting payment", "order_id")
+    if amount != order.total_tiyins:
+        raise MerchantError(MerchantError.INVALID_AMOUNT, "Invalid amount", "amount")
+
+
+def get_transaction(transaction_id):
+    """Locks and returns the payment holding a Payme transaction"""
+    payment = (
+        Payment.objects
+        .select_for_update()
+        .select_related('order')
+        .filter(provider_transaction_id=transaction_id)
+        .first()
+    )
+    if payment is None:
+        raise MerchantError(MerchantError.TRANSACTION_NOT_FOUND, "Transaction not found", "id")
+    return payment
+
+
+def record(payment, status, **data):
+    """
+    Store a new status and transaction data on a locked payment; the order
+    follows (see ``Payment.ORDER_TRANSITIONS``)
+    """
+    payment.transition(status, provider_payment_data={**(payment.provider_payment_data or {}), **data})
+
+
+def cancel_expired(payment):
+    """Cancel a created transaction that Payme no longer allows to perform"""
+    if now_ms() - payment.provider_transaction_time <= TRANSACTION_TIMEOUT_MS:
+        return False
+    record(payment, Payment.PaymentStatus.CANCELED, cancel_time=now_ms(), reason=REASON_TIMEOUT)
+    return True
+
+
+def check_perform_transaction(params):
+    amount = param(params, "amount", (int, float))
+    order = get_order(params)
+    validate_order(order, amount)
+    return {"allow": True}
+
+
+def create_transaction(params):
+    transaction_id = param(params, "id", str)
+    transaction_time = param(params, "time", int)
+    amount = param(params, "amount", (int, float))
+
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().filter(provider_transaction_id=transaction_id).first()
+
+        if payment is not None:
+            # An expired transaction is canceled even though an error is returned
+            performable = transaction_state(payment) == STATE_CREATED and not cancel_expired(payment)
+        else:
+            performable = True
+            order = get_order(params, lock=True)
+            validate_order(order, amount)
+
+            transaction_fields = {
+                "amount": order.total_amount,
+                "provider_transaction_id": transaction_id,
+                "provider_transaction_time": transaction_time,
+            }
+            payment, created = Payment.objects.select_for_update().get_or_create_pending(order, **transaction_fields)
+
+            if not created:
+                if payment.provider_transaction_id and payment.provider_transaction_time:
+                    raise MerchantError(
+                        MerchantError.ORDER_UNAVAILABLE, "Order has another pending transaction", "order_id"
+                    )
+
+                for field, value in transaction_fields.items():
+                    setattr(payment, field, value)
+                payment.save(update_fields=[*transaction_fields, 'updated_at'])
+
+    if not performable:
+        raise MerchantError(MerchantError.CANNOT_PERFORM, "Transaction cannot be performed", "id")
+
+    return {
+        "create_time": payment.provider_transaction_time,
+        "transaction": payment.payment_id,
+        "state": transaction_state(payment),
+    }
+
+
+def perform_transaction(params):
+    transaction_id = param(params, "id", str)
+
+    with transaction.atomic():
+        payment = get_transaction(transaction_id)
+        state = transaction_state(payment)
+
+        # An expired transaction is canceled even though an error is returned
+        if state == STATE_CREATED and not cancel_expired(payment):
+            record(payment, Payment.PaymentStatus.PAID, perform_time=now_ms())
+
+    if transaction_state(payment) != STATE_PERFORMED:
+        raise MerchantError(MerchantError.CANNOT_PERFORM, "Transaction cannot be performed", "id")
+
+    return {
+        "transaction": payment.payment_id,
+        "perform_time": transaction_data(payment)["perform_time"],
+        "state": transaction_state(payment),
+    }
+
+
+def cancel_transaction(params):
+    transaction_id = param(params, "id", str)
+    reason = param(params, "reason", int)
+
+    with transaction.atomic():
+        payment = get_transaction(transaction_id)
+        state = transaction_state(payment)
+
+        if state == STATE_CREATED:
+            record(payment, Payment.PaymentStatus.CANCELED, cancel_time=now_ms(), reason=reason)
+        elif state == STATE_PERFORMED:
+            if payment.order.status in (Order.OrderStatus.SHIPPED, Order.OrderStatus.COMPLETED):
+                raise MerchantError(MerchantError.CANNOT_CANCEL, "Order has already been delivered", "id")
+
+            record(payment, Payment.PaymentStatus.REFUNDED, cancel_time=now_ms(), reason=reason)
+
+    return {
+        "transaction": payment.payment_id,
+        "cancel_time": transaction_data(payment)["cancel_time"],
+        "state": transaction_state(payment),
+    }
+
+
+def check_transaction(params):
+    payment = Payment.objects.filter(provider_transaction_id=param(params, "id", str)).first()
+    if payment is None:
+        raise MerchantError(MerchantError.TRANSACTION_NOT_FOUND, "Transaction not found", "id")
+
+    return {
+        "create_time": payment.provider_transaction_time,
+        "transaction": payment.payment_id,
+        "state": transaction_state(payment),
+        **transaction_data(payment),
+    }
+
+
+def get_statement(params):
+    """Transactions created in ``[from, to]``, read with one range scan on the transaction time index"""
+    payments = (
+        Payment.objects
+        .filter(
+            provider_transaction_id__isnull=False,
+            provider_transaction_time__gte=param(params, "from", int),
+            provider_transaction_time__lte=param(params, "to", int),
+        )
+        .order_by('provider_transaction_time')
+        .values_list(
+            'payment_id', 'order_id', 'amount', 'status', 'provider_transaction_id',
+            'provider_transaction_time', 'provider_payment_data', named=True
+        )
+    )
+
+    return {
+        "transactions": [
+            {
+                "id": payment.provider_transaction_id,
+                "time": payment.provider_transaction_time,
+                "amount": int(payment.amount * 100),
+                "account": {"order_id": str(payment.order_id)},
+                "create_time": payment.provider_transaction_time,
+                "transaction": payment.payment_id,
+                "state": STATUS_STATES[payment.status],
+                **transaction_data(payment),
+            }
+            for payment in payments
+        ]
+    }
+
+
+METHODS = {
+    "CheckPerformTransaction": check_perform_transaction,
+    "CreateTransaction": create_transaction,
+    "PerformTransaction": perform_transaction,
+    "CancelTransaction": cancel_transaction,
+    "CheckTransaction": check_transaction,
+    "GetStatement": get_statement,
+}
+
+
+def handle_request(http_method, authorization, body):
+    """
+    Dispatches one merchant API request.
+
+    Args:
+        http_method (str): HTTP method of the request.
+        authorization (str): Value of the 'Authorization' header.
+        body (bytes): Raw request body.
+    Returns:
+        dict: The JSON-RPC response.
+    """
+    request_id = None
+
+    try:
+        if http_method != "POST":
+            raise MerchantError(MerchantError.INVALID_HTTP_METHOD, "Only POST requests are allowed")
+
+        check_authorization(authorization)
+
+        try:
+            payload = json.loads(body)
+        except (TypeError, ValueError):
+            raise MerchantError(MerchantError.PARSE_ERROR, "Invalid JSON")
+
+        if not isinstance(payload, dict) or not isinstance(payload.get("params", {}), dict):
+            raise MerchantError(MerchantError.INVALID_REQUEST, "Invalid JSON-RPC request")
+
+        request_id = payload.get("id")
+        method = METHODS.get(payload.get("method"))
+        if method is None:
+            raise MerchantError(MerchantError.METHOD_NOT_FOUND, "Method not found", payload.get("method"))
+
+        return {"jsonrpc": "2.0", "id": request_id, "result": method(payload.get("params", {}))}
+
+    except MerchantError as e:
+        return {"jsonrpc": "2.0", "id": request_id, "error": e.as_dict()}
+    except Exception:
+        # Payme gets an RPC error rather than an HTTP 500, and retries later
+        logger.exception("Merchant API request failed")
+        error = MerchantError(MerchantError.SYSTEM_ERROR, "System error")
+        return {"jsonrpc": "2.0", "id": request_id, "error": error.as_dict()}
@@ -0,0 +1,32 @@
+import statistics
+
+
+def summarize_latencies(latencies):
+    """
+    Summarizes a list of latencies.
+
+    Args:
+        latencies (list): Latencies in seconds.
+    Returns:
+        dict: Mean, p50, p95, p99 and max latency in milliseconds.
+    """
+    if not latencies:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+
+    if len(latencies) > 1:
+        cut_points = statistics.quantiles(latencies, n=100, method='inclusive')
+    else:
+        cut_points = latencies * 99
+
+    return {
+        "mean": statistics.fmean(latencies) * 1000,
+        "p50": cut_points[49] * 1000,
+        "p95": cut_points[94] * 1000,
+        "p99": cut_points[98] * 1000,
+        "max": max(latencies) * 1000,
+    }
+
+
+def format_latencies(summary):
+    """Formats a latency summary as a single line"""
+    return " ".join(f"{name}={value:.1f}ms" for name, value in summary.items())
@@ -1,3 +1,68 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class OutboxJobQuerySet(models.QuerySet):
+
+    def active(self):
+        """Jobs that are still to run or running"""
+        return self.filter(state__in=[OutboxJob.State.PENDING, OutboxJob.State.RUNNING])
+
+    def due(self, now=None):
+        """Pending jobs whose time has come, and running jobs whose worker's claim expired"""
+        now = now or timezone.now()
+        return self.filter(
+            models.Q(state=OutboxJob.State.PENDING, run_at__lte=now)
+            | models.Q(state=OutboxJob.State.RUNNING, locked_until__lt=now)
+        )
+
+
+class OutboxJob(models.Model):
+    """
+    A Payme call recorded along with the payment change that needs it, and
+    made later by ``run_outbox_worker`` (see ``payments.outbox``).
+    """
+
+    class Operation(models.TextChoices):
+        CREATE_TRANSACTION = 'CREATE_TRANSACTION', 'Create transaction'
+        CHECK_TRANSACTION = 'CHECK_TRANSACTION', 'Check transaction'
+
+    class State(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        RUNNING = 'RUNNING', 'Running'
+        DONE = 'DONE', 'Done'
+        FAILED = 'FAILED', 'Failed'
+
+    payment = models.ForeignKey('app.Payment', on_delete=models.CASCADE, related_name='outbox_jobs')
+    operation = models.CharField(max_length=20, choices=Operation.choices)
+    state = models.CharField(max_length=10, choices=State.choices, default=State.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+
+    # Set when a worker claims the job; the claim lapses at locked_until
+    claim_token = models.CharField(max_length=32, blank=True, null=True)
+    locked_until = models.DateTimeField(blank=True, null=True)
+
+    result = models.JSONField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = OutboxJobQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['payment', 'operation'],
+                condition=models.Q(state__in=['PENDING', 'RUNNING']),
+                name='unique_active_outbox_job'
+            ),
+        ]
+        indexes = [
+            # Claiming due jobs, see OutboxJobQuerySet.due
+            models.Index(fields=['state', 'run_at'], name='outbox_state_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_operation_display()} of payment #{self.payment_id} ({self.state})"
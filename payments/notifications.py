@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+
+class Subscription:
+    """Receives the status changes of one payment on the subscriber's event loop"""
+
+    def __init__(self, hub, payment_id):
+        self.hub = hub
+        self.payment_id = payment_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    async def get(self, timeout):
+        """
+        Waits for the next status change.
+
+        Args:
+            timeout (float): Seconds to wait.
+        Returns:
+            str: The new status, or None when nothing changed in time.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PaymentStatusHub:
+    """
+    In-process publish/subscribe of payment status changes.
+
+    Publishers may run in any thread (sync views, management commands);
+    subscribers are asyncio tasks, such as the payment status stream.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, payment_id):
+        """Subscribe the running event loop to the status changes of a payment"""
+        subscription = Subscription(self, payment_id)
+        with self._lock:
+            self._subscriptions.setdefault(payment_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.payment_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.payment_id, None)
+
+    def publish(self, payment_id, status):
+        """Deliver a status change to every subscriber of the payment"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(payment_id, ()))
+
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, status)
+            except RuntimeError:
+                # The subscriber's event loop is closed
+                subscription.close()
+
+
+payment_status_hub = PaymentStatusHub()
@@ -0,0 +1,297 @@
+"""
+Transactional outbox of Payme calls.
+
+Views do not call Payme while the customer waits: they record the call to
+make as an ``OutboxJob``, in the same transaction as the payment change that
+needs it, and answer right away. ``run_outbox_worker`` claims due jobs in
+batches, runs every batch concurrently on one event loop and retries failed
+calls with exponential backoff, so request latency no longer depends on
+Payme's.
+
+Jobs are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the
+database supports it, so concurrent workers take different jobs. The claim
+itself is a conditional UPDATE that only matches jobs that are still due,
+which keeps two workers from running the same job on SQLite as well. A claim
+is a lease: the jobs of a worker that died are claimed again once it lapses.
+
+Status polls check a payment with Payme at most once every
+``PAYME_STATUS_CHECK_INTERVAL`` seconds (``aenqueue_check``), and the worker
+deletes the jobs done more than ``PAYME_OUTBOX_RETENTION`` seconds ago, so
+the table grows with the payments being made rather than with the polls.
+Failed jobs are kept for investigation.
+"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app.deadlines import deadline
+from app.models import Payment
+from .models import OutboxJob
+from .payme_client import AsyncPaymeClient, PaymeDeadlineExceeded, PaymeError
+
+logger = logging.getLogger(__name__)
+
+CHECK_THROTTLE_KEY = 'outbox-check:{}'
+
+
+class PermanentJobError(Exception):
+    """Raised by operations that retrying would not fix"""
+
+
+def enqueue(payment, operation, delay=0):
+    """
+    Schedules a Payme call for a payment; does nothing when the same call is
+    already waiting or running.
+
+    Call it in the transaction that changes the payment, so that the job
+    exists if and only if the change is committed.
+
+    Args:
+        payment: Payment model instance
+        operation (str): One of ``OutboxJob.Operation``.
+        delay (float): Seconds to wait before the call is made.
+    """
+    # A single INSERT, skipped by the database when it would break the
+    # unique_active_outbox_job constraint: race-free and no savepoint needed
+    OutboxJob.objects.bulk_create([
+        OutboxJob(payment=payment, operation=operation, run_at=timezone.now() + timedelta(seconds=delay))
+    ], ignore_conflicts=True)
+
+
+async def aenqueue(payment, operation, delay=0):
+    """Async version of ``enqueue``"""
+    await sync_to_async(enqueue)(payment, operation, delay)
+
+
+async def aenqueue_check(payment):
+    """
+    Schedules a CheckTransaction of the payment unless one was scheduled in
+    the last ``PAYME_STATUS_CHECK_INTERVAL`` seconds, however often its
+    status is polled.
+
+    Returns:
+        bool: Whether the call was scheduled.
+    """
+    key = CHECK_THROTTLE_KEY.format(payment.pk)
+    if not await cache.aadd(key, True, timeout=settings.PAYME_STATUS_CHECK_INTERVAL):
+        return False
+    await aenqueue(payment, OutboxJob.Operation.CHECK_TRANSACTION)
+    return True
+
+
+def retry_delay(attempts):
+    """Seconds before the next attempt: exponential backoff with jitter"""
+    delay = min(settings.PAYME_OUTBOX_RETRY_MAX_DELAY, settings.PAYME_OUTBOX_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def apply_provider_state(payment, result):
+    """Moves a pending payment, and its order once paid, to the status of its Payme transaction"""
+    status = Payment.status_for_provider_state(result.get('state'))
+    if status is not None:
+        # Concurrent updates (e.g. from the merchant API) win
+        payment.transition(status, expected=Payment.PaymentStatus.PENDING, provider_payment_data=result)
+
+
+def fail_payment(payment):
+    """Marks a payment that could not be started as failed, so that the order can be paid again"""
+    payment.transition(Payment.PaymentStatus.FAILED, expected=Payment.PaymentStatus.PENDING)
+
+
+async def create_transaction(client, payment):
+    """CheckPerformTransaction then CreateTransaction, saving the Payme transaction id"""
+    if payment.status != Payment.PaymentStatus.PENDING:
+        return None
+
+    check_result = await client.check_perform_transaction(payment)
+    if check_result.get('allow') is not True:
+        raise PermanentJobError("Payment not allowed by Payme")
+
+    result = await client.create_transaction(payment)
+    payment.provider_transaction_id = result.get('transaction')
+    payment.provider_payment_data = result
+    await payment.asave(update_fields=['provider_transaction_id', 'provider_payment_data', 'updated_at'])
+    return result
+
+
+async def check_transaction(client, payment):
+    """CheckTransaction, applying the final state of the transaction"""
+    if not payment.provider_transaction_id:
+        raise PermanentJobError("Payment has no Payme transaction")
+
+    result = await client.check_transaction(payment)
+    await sync_to_async(apply_provider_state)(payment, result)
+    return result
+
+
+OPERATIONS = {
+    OutboxJob.Operation.CREATE_TRANSACTION: create_transaction,
+    OutboxJob.Operation.CHECK_TRANSACTION: check_transaction,
+}
+
+
+class OutboxWorker:
+    """
+    Claims due jobs in batches and runs the jobs of a batch concurrently.
+
+    Usage::
+
+        worker = OutboxWorker()
+        await worker.run_pending()
+    """
+
+    def __init__(self, client=None, batch_size=None):
+        self.client = client
+        self.batch_size = batch_size or settings.PAYME_OUTBOX_BATCH_SIZE
+        self.purged_at = None
+
+    def purge(self):
+        """
+        Deletes the jobs done more than ``PAYME_OUTBOX_RETENTION`` seconds ago,
+        ``batch_size`` at a time so that no delete holds locks for long.
+
+        Returns:
+            int: Number of jobs deleted.
+        """
+        done = OutboxJob.objects.filter(
+            state=OutboxJob.State.DONE,
+            updated_at__lt=timezone.now() - timedelta(seconds=settings.PAYME_OUTBOX_RETENTION)
+        )
+        deleted = 0
+        while ids := list(done.values_list('pk', flat=True)[:self.batch_size]):
+            deleted += OutboxJob.objects.filter(pk__in=ids).delete()[0]
+        return deleted
+
+    def claim(self):
+        """
+        Claims up to ``batch_size`` due jobs for this worker.
+
+        Returns:
+            list: The claimed jobs, with their payments.
+        """
+        now = timezone.now()
+        token = uuid.uuid4().hex
+
+        with transaction.atomic():
+            due = OutboxJob.objects.due(now)
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            ids = list(due.order_by('run_at').values_list('pk', flat=True)[:self.batch_size])
+            if not ids:
+                return []
+
+            # Only jobs that are still due are claimed, whoever else saw them
+            OutboxJob.objects.filter(pk__in=ids).due(now).update(
+                state=OutboxJob.State.RUNNING,
+                claim_token=token,
+                locked_until=now + timedelta(seconds=settings.PAYME_OUTBOX_LEASE),
+                attempts=F('attempts') + 1,
+                updated_at=now
+            )
+
+        return list(OutboxJob.objects.filter(pk__in=ids, claim_token=token).select_related('payment'))
+
+    def complete(self, job, result):
+        """Records a successful call; returns the new state of the job"""
+        OutboxJob.objects.filter(pk=job.pk, claim_token=job.claim_token).update(
+            state=OutboxJob.State.DONE,
+            result=result,
+            claim_token=None,
+            locked_until=None,
+            updated_at=timezone.now()
+        )
+        return OutboxJob.State.DONE
+
+    def fail(self, job, error):
+        """Schedules a retry of a failed call, or gives up; returns the new state of the job"""
+        now = timezone.now()
+        permanent = (
+            isinstance(error, PermanentJobError)
+            # A call cut short by the lease is run again by the next attempt
+            or (isinstance(error, PaymeError) and not error.retryable and not isinstance(error, PaymeDeadlineExceeded))
+            or job.attempts >= settings.PAYME_OUTBOX_MAX_ATTEMPTS
+        )
+
+        if permanent:
+            logger.error("%s failed after %d attempts: %s", job, job.attempts, error)
+            changes = {'state': OutboxJob.State.FAILED}
+        else:
+            delay = retry_delay(job.attempts)
+            logger.warning("%s failed (attempt %d), retrying in %.1fs: %s", job, job.attempts, delay, error)
+            changes = {'state': OutboxJob.State.PENDING, 'run_at': now + timedelta(seconds=delay)}
+
+        with transaction.atomic():
+            updated = OutboxJob.objects.filter(pk=job.pk, claim_token=job.claim_token).update(
+                claim_token=None,
+                locked_until=None,
+                last_error=str(error),
+                updated_at=now,
+                **changes
+            )
+            if updated and permanent and job.operation == OutboxJob.Operation.CREATE_TRANSACTION:
+                fail_payment(job.payment)
+
+        return changes['state']
+
+    async def run_job(self, job):
+        try:
+            # A job must not outlive its claim
+            with deadline(settings.PAYME_OUTBOX_LEASE):
+                result = await OPERATIONS[job.operation](self.client, job.payment)
+        except Exception as e:
+            return await sync_to_async(self.fail)(job, e)
+        return await sync_to_async(self.complete)(job, result)
+
+    async def run_batch(self):
+        """
+        Claims and runs one batch of jobs.
+
+        Returns:
+            list: The new state of every job run.
+        """
+        if self.client is None:
+            self.client = AsyncPaymeClient.shared()
+
+        jobs = await sync_to_async(self.claim)()
+        return await asyncio.gather(*(self.run_job(job) for job in jobs))
+
+    async def run_pending(self):
+        """Runs batches until no job is due; returns the new state of every job run"""
+        states = []
+        while batch := await self.run_batch():
+            states += batch
+        return states
+
+    async def run(self, poll_interval=None, stop=None):
+        """
+        Runs due jobs until ``stop`` (an ``asyncio.Event``) is set, checking
+        for new ones every ``poll_interval`` seconds while idle.
+        """
+        poll_interval = settings.PAYME_OUTBOX_POLL_INTERVAL if poll_interval is None else poll_interval
+        stop = stop or asyncio.Event()
+
+        while not stop.is_set():
+            try:
+                if await self.run_batch():
+                    continue
+                # While idle
+                if self.purged_at is None or time.monotonic() - self.purged_at >= settings.PAYME_OUTBOX_PURGE_INTERVAL:
+                    self.purged_at = time.monotonic()
+                    await sync_to_async(self.purge)()
+            except Exception:
+                logger.exception("Running outbox jobs failed")
+
+            try:
+                await asyncio.wait_for(stop.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
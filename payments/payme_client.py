@@ -1,14 +1,256 @@
 import time
 import base64
+import asyncio
+import contextvars
+import threading
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from jsonrpcclient import request
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from app import deadlines
+
+
+class PaymeError(Exception):
+    """Base class of the errors raised by the Payme clients"""
+    # Whether making the same call again may succeed
+    retryable = False
+
+
+class PaymeTransportError(PaymeError):
+    """Payme could not be reached, or answered with an HTTP error"""
+    retryable = True
+
+
+class PaymeTimeout(PaymeTransportError):
+    """Payme did not answer before the deadline of the call"""
+
+
+class PaymeDeadlineExceeded(PaymeTimeout):
+    """
+    The time budget of the caller (see ``app.deadlines``) ran out: the call
+    was not made, or was given up. Says nothing of the health of Payme, so
+    it neither counts as a failure of the circuit nor is worth retrying.
+    """
+    retryable = False
+
+
+class PaymeCircuitOpen(PaymeError):
+    """The method is failing fast because its recent calls failed"""
+    retryable = True
+
+
+class PaymeRPCError(PaymeError):
+    """
+    JSON-RPC error answered by Payme.
+
+    Attributes:
+        code (int): Payme error code.
+        data: The ``data`` member of the error, e.g. the invalid account field.
+    """
+
+    def __init__(self, message, code=None, data=None):
+        super().__init__(message)
+        self.code = code
+        self.data = data
+
+
+class PaymeInternalError(PaymeRPCError):
+    retryable = True
+
+
+class PaymeAuthError(PaymeRPCError):
+    pass
+
+
+class PaymeMethodNotFound(PaymeRPCError):
+    pass
+
+
+class PaymeInvalidAmount(PaymeRPCError):
+    pass
+
+
+class PaymeInvalidAccount(PaymeRPCError):
+    pass
+
+
+class PaymeTransactionNotFound(PaymeRPCError):
+    pass
+
+
+class PaymeCannotCancel(PaymeRPCError):
+    pass
+
+
+class PaymeCannotPerform(PaymeRPCError):
+    pass
+
+
+RPC_ERRORS = {
+    -32400: PaymeInternalError,
+    -32504: PaymeAuthError,
+    -32601: PaymeMethodNotFound,
+    -31001: PaymeInvalidAmount,
+    -31003: PaymeTransactionNotFound,
+    -31007: PaymeCannotCancel,
+    -31008: PaymeCannotPerform,
+}
+
+
+def rpc_error_class(code):
+    """Exception class of a Payme error code"""
+    if isinstance(code, int) and -31099 <= code <= -31050:
+        return PaymeInvalidAccount
+    return RPC_ERRORS.get(code, PaymeRPCError)
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast after ``failure_threshold`` consecutive failures.
+
+    Once ``reset_timeout`` seconds have passed, a single trial call is let
+    through: its success closes the circuit, its failure opens it again.
+    Only failures a retry may fix count; Payme answering with a business
+    error (e.g. unknown transaction) means it is healthy, and calls the
+    caller gave up on (``PaymeDeadlineExceeded``) are not recorded.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.trial or time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def before_call(self):
+        """
+        Raises:
+            PaymeCircuitOpen: When the call must not be made.
+        """
+        with self._lock:
+            state = self.state
+            if state == 'open':
+                raise PaymeCircuitOpen(f"Circuit of {self.name} is open after {self.failures} failures")
+            if state == 'half-open':
+                self.trial = True
+
+    def record(self, error=None):
+        """Records the outcome of a call, ``error`` being the exception it raised"""
+        with self._lock:
+            self.trial = False
+            if isinstance(error, PaymeDeadlineExceeded):
+                return
+            if error is not None and getattr(error, 'retryable', True):
+                self.failures += 1
+                if self.failures >= self.failure_threshold:
+                    self.opened_at = time.monotonic()
+            else:
+                self.failures = 0
+                self.opened_at = None
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(method):
+    """The process-wide circuit breaker of an RPC method"""
+    breaker = _breakers.get(method)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(method, CircuitBreaker(
+                method, settings.PAYME_BREAKER_FAILURE_THRESHOLD, settings.PAYME_BREAKER_RESET_TIMEOUT
+            ))
+    return breaker
+
+
+def reset_breakers():
+    with _breakers_lock:
+        _breakers.clear()
+
+class MonitoredHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that counts the requests it sends and the sockets it opens,
+    so that connection reuse can be monitored.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._stats_lock = threading.Lock()
+        self.requests_sent = 0
+        self.connections_opened = 0
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+
+        # Swap in connection classes that report every new socket
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: type(pool_cls.__name__, (pool_cls,), {
+                'ConnectionCls': self._monitored_connection_cls(pool_cls.ConnectionCls)
+            })
+            for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def _monitored_connection_cls(self, connection_cls):
+        adapter = self
+
+        class MonitoredConnection(connection_cls):
+            def connect(self):
+                adapter._count('connections_opened')
+                super().connect()
+
+        return MonitoredConnection
+
+    def _count(self, attribute):
+        with self._stats_lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+    def send(self, *args, **kwargs):
+        self._count('requests_sent')
+        return super().send(*args, **kwargs)
+
+class BasePaymeClient:
+    """
+    Builds Payme RPC requests and parses their responses.
+
+    Subclasses provide the transport by implementing ``_send`` and
+    ``_hedged_send``. Every call goes through the circuit breaker of its
+    method and times out with the current deadline (see ``app.deadlines``);
+    read-only calls are hedged when ``PAYME_HEDGE_DELAY`` is set.
+    """
+    # Calls that can safely be made twice
+    IDEMPOTENT_METHODS = frozenset({"CheckPerformTransaction", "CheckTransaction", "GetStatement"})
 
-class PaymeClient:
     def __init__(self):
-        self.base_url = settings.PAYME_CHECKOUT_URL
+        self.hedge_delay = settings.PAYME_HEDGE_DELAY
+        self.base_url = settings.PAYME_API_URL
         self.auth_header = self._build_auth_header(settings.PAYME_MERCHANT_ID, settings.PAYME_SECRET_KEY)
 
+        # Headers to be included
+        self.headers = {
+            "Content-Type": "application/json; charset=UTF-8",
+            "Authorization": self.auth_header,
+        }
+
+        if not settings.PAYME_KEEP_ALIVE:
+            self.headers["Connection"] = "close"
+
     def _build_auth_header(self, username, password):
         """
         Encodes username and password in base64 for HTTP Basic Auth.
@@ -23,6 +265,190 @@ class PaymeClient:
         encoded = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
         return f"Basic {encoded}"
 
+    def _parse_response(self, response_data):
+        """
+        Extracts the result of an RPC call.
+
+        Args:
+            response_data (dict): The decoded JSON-RPC response.
+        Returns:
+            response (dict): The result of the RPC call.
+        """
+
+        # Check for error in the response
+        if "error" in response_data:
+            error_msg = "Unknown error"
+            if isinstance(response_data["error"], dict):
+                # Try to extract the error message based on Payme API format
+                if "message" in response_data["error"]:
+                    if isinstance(response_data["error"]["message"], dict) and "en" in response_data["error"][
+                        "message"]:
+                        error_msg = response_data["error"]["message"]["en"]
+                    else:
+                        error_msg = str(response_data["error"]["message"])
+                elif "data" in response_data["error"]:
+                    error_msg = str(response_data["error"]["data"])
+                else:
+                    error_msg = str(response_data["error"])
+            else:
+                error_msg = str(response_data["error"])
+
+            error = response_data["error"] if isinstance(response_data["error"], dict) else {}
+            raise rpc_error_class(error.get("code"))(f"API Error: {error_msg}", error.get("code"), error.get("data"))
+
+        # Ensure result exists in the response
+        if "result" not in response_data:
+            raise PaymeTransportError("Invalid API response: missing 'result'")
+
+        # Return the response
+        return response_data["result"]
+
+    def _check_deadline(self):
+        """
+        Returns the seconds left before the deadline (None without one).
+
+        Raises:
+            PaymeDeadlineExceeded: When the deadline has already passed.
+        """
+        try:
+            return deadlines.check()
+        except deadlines.DeadlineExceeded:
+            raise PaymeDeadlineExceeded("RPC request failed: deadline exceeded before calling Payme")
+
+    def _timeout_error(self, e):
+        """The error of a request that timed out, the deadline of the caller or the Payme timeouts"""
+        left = deadlines.remaining()
+        if left is not None and left <= 0:
+            return PaymeDeadlineExceeded(f"RPC request failed: deadline exceeded ({str(e) or 'timed out'})")
+        return PaymeTimeout(f"RPC request failed: {str(e) or 'timed out'}")
+
+    def _timeouts(self):
+        """
+        Connect and read timeouts of the next request, cut to the time left
+        before the deadline.
+
+        Raises:
+            PaymeDeadlineExceeded: When the deadline has already passed.
+        """
+        left = self._check_deadline()
+        if left is None:
+            return settings.PAYME_CONNECT_TIMEOUT, settings.PAYME_READ_TIMEOUT
+        return min(settings.PAYME_CONNECT_TIMEOUT, left), min(settings.PAYME_READ_TIMEOUT, left)
+
+    def _hedged(self, method):
+        return self.hedge_delay is not None and method in self.IDEMPOTENT_METHODS
+
+    def _check_perform_transaction_params(self, payment):
+        # Create account dict from order
+        account = {
+            "order_id": str(payment.order_id)
+        }
+
+        # Define method parameters
+        return {
+            "amount": payment.get_amount_in_tiyins(),
+            "account": account
+        }
+
+    def _create_transaction_params(self, payment):
+        # Get current time in milliseconds
+        current_time = int(time.time() * 1000)
+
+        # Create account dict
+        account = {
+            "order_id": str(payment.order_id)
+        }
+
+        # Define method parameters
+        return {
+            "id": payment.payment_id,
+            "time": current_time,
+            "amount": payment.get_amount_in_tiyins(),
+            "account": account
+        }
+
+    def _transaction_params(self, payment, **extra):
+        # Define method parameters
+        return {
+            "id": payment.provider_transaction_id,
+            **extra
+        }
+
+
+class PaymeClient(BasePaymeClient):
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        super().__init__()
+        self.executor = None
+        self.adapter = MonitoredHTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.PAYME_POOL_SIZE,
+            pool_block=True,
+            max_retries=0
+        )
+        self.session = self._build_session()
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns the process-wide client.
+
+        The client is thread-safe: all threads share one pooled session, so
+        connections (and TLS sessions) to Payme are reused across requests.
+        """
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    @classmethod
+    def reset_shared(cls):
+        """Close the process-wide client so the next call builds a new one"""
+        with cls._shared_lock:
+            if cls._shared is not None:
+                cls._shared.close()
+            cls._shared = None
+
+    def _build_session(self):
+        """
+        Builds a keep-alive session with a bounded connection pool.
+
+        Returns:
+            requests.Session: Session carrying the Payme headers.
+        """
+        session = requests.Session()
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def close(self):
+        """Close the pooled connections"""
+        self.session.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def connection_stats(self):
+        """
+        Reports how well connections to Payme are reused.
+
+        Returns:
+            dict: Number of requests sent, connections opened and requests
+            that reused an already open connection.
+        """
+        with self.adapter._stats_lock:
+            requests_sent = self.adapter.requests_sent
+            connections = self.adapter.connections_opened
+
+        return {
+            "requests": requests_sent,
+            "connections": connections,
+            "reused": requests_sent - connections,
+        }
+
     def call(self, method, params=None):
         """
         Helper to make RPC calls.
@@ -32,61 +458,80 @@ class PaymeClient:
             params (dict): The parameters to pass to the method.
         Returns:
             response (dict): The response from the RPC call.
+        Raises:
+            PaymeError: The typed reason of the failure.
         """
+        # Before the breaker: a spent budget is no trial call nor failure
+        self._check_deadline()
+        breaker = get_breaker(method)
+        breaker.before_call()
 
+        error = None
+        try:
+            if self._hedged(method):
+                return self._hedged_send(method, params)
+            return self._send(method, params)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            breaker.record(error)
+
+    def _send(self, method, params):
         # Generate RPC payload
         rpc_data = request(method, params or {})
 
-        # Headers to be included
-        headers = {
-            "Content-Type": "application/json; charset=UTF-8",
-            "Authorization": self.auth_header,
-        }
-
         try:
 
-            # Send the request to the API endpoint
-            response = requests.post(
+            # Send the request to the API endpoint over a pooled connection
+            response = self.session.post(
                 self.base_url,
-                headers=headers,
-                json=rpc_data
+                json=rpc_data,
+                timeout=self._timeouts()
             )
 
             # Check HTTP status code first
             response.raise_for_status()
 
             # Parse JSON response
-            response_data = response.json()
-
-            # Check for error in the response
-            if "error" in response_data:
-                error_msg = "Unknown error"
-                if isinstance(response_data["error"], dict):
-                    # Try to extract the error message based on Payme API format
-                    if "message" in response_data["error"]:
-                        if isinstance(response_data["error"]["message"], dict) and "en" in response_data["error"][
-                            "message"]:
-                            error_msg = response_data["error"]["message"]["en"]
-                        else:
-                            error_msg = str(response_data["error"]["message"])
-                    elif "data" in response_data["error"]:
-                        error_msg = str(response_data["error"]["data"])
-                    else:
-                        error_msg = str(response_data["error"])
-                else:
-                    error_msg = str(response_data["error"])
-
-                raise Exception(f"API Error: {error_msg}")
-
-            # Ensure result exists in the response
-            if "result" not in response_data:
-                raise Exception("Invalid API response: missing 'result'")
-
-            # Return the response
-            return response_data["result"]
+            return self._parse_response(response.json())
 
+        except requests.exceptions.Timeout as e:
+            raise self._timeout_error(e) from e
         except requests.exceptions.RequestException as e:
-            raise Exception(f"RPC request failed: {str(e)}")
+            raise PaymeTransportError(f"RPC request failed: {str(e)}") from e
+
+    def _hedged_send(self, method, params):
+        """
+        Sends the call a second time if Payme has not answered it within
+        ``PAYME_HEDGE_DELAY`` seconds, or as soon as the first copy fails in
+        a way a retry may fix. The first answer wins.
+        """
+        if self.executor is None:
+            with self._shared_lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(settings.PAYME_POOL_SIZE, thread_name_prefix='payme-hedge')
+
+        def submit():
+            # Copies of the call keep the deadline of the caller
+            return self.executor.submit(contextvars.copy_context().run, self._send, method, params)
+
+        pending, error, hedged = {submit()}, None, False
+        while pending:
+            done, pending = wait(pending, timeout=None if hedged else self.hedge_delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except PaymeError as e:
+                    if not e.retryable:
+                        raise
+                    error = e
+
+            if not hedged:
+                hedged = True
+                pending.add(submit())
+
+        raise error
 
     def check_perform_transaction(self, payment):
         """
@@ -97,19 +542,8 @@ class PaymeClient:
         Returns:
             response (dict): The response from the RPC call.
         """
-        # Create account dict from order
-        account = {
-            "order_id": str(payment.order.id)
-        }
-
-        # Define method parameters
-        params = {
-            "amount": payment.get_amount_in_tiyins(),
-            "account": account
-        }
-
         # Call CheckPerformTransaction method
-        return self.call("CheckPerformTransaction", params)
+        return self.call("CheckPerformTransaction", self._check_perform_transaction_params(payment))
 
     def create_transaction(self, payment):
         """
@@ -120,25 +554,11 @@ class PaymeClient:
         Returns:
             response (dict): The response from the RPC call.
         """
-        # Get current time in milliseconds
-        current_time = int(time.time() * 1000)
-
-        # Create account dict
-        account = {
-            "order_id":str(payment.order.id)
-        }
-
-        # Define method parameters
-        params = {
-            "id":payment.payment_id,
-            "time":current_time,
-            "amount":payment.get_amount_in_tiyins(),
-            "account":account
-        }
+        params = self._create_transaction_params(payment)
 
         # Save transaction time
-        payment.provider_transaction_time = current_time
-        payment.save()
+        payment.provider_transaction_time = params["time"]
+        payment.save(update_fields=['provider_transaction_time', 'updated_at'])
 
         # Call CreateTransaction method
         return self.call("CreateTransaction", params)
@@ -152,14 +572,8 @@ class PaymeClient:
         Returns:
             response (dict): The response from the RPC call.
         """
-
-        # Define method parameters
-        params = {
-            "id":payment.provider_transaction_id
-        }
-
         # Call PerformTransaction method
-        return self.call("PerformTransaction", params)
+        return self.call("PerformTransaction", self._transaction_params(payment))
 
     def cancel_transaction(self, payment, reason):
         """
@@ -171,15 +585,8 @@ class PaymeClient:
         Returns:
             response (dict): The response from the RPC call.
         """
-
-        # Define method parameters
-        params = {
-            "id": payment.provider_transaction_id,
-            "reason": reason
-        }
-
         # Call CancelTransaction method
-        return self.call("CancelTransaction", params)
+        return self.call("CancelTransaction", self._transaction_params(payment, reason=reason))
 
     def check_transaction(self, payment):
         """
@@ -190,11 +597,205 @@ class PaymeClient:
         Returns:
             response (dict): The response from the RPC call.
         """
+        # Call CheckTransaction method
+        return self.call("CheckTransaction", self._transaction_params(payment))
 
-        # Define method parameters
-        params = {
-            "id": payment.provider_transaction_id
-        }
 
-        # Call CheckTransaction method
-        return self.call("CheckTransaction", params)
\ No newline at end of file
+class AsyncPaymeClient(BasePaymeClient):
+    """
+    asyncio-native Payme client with the same methods as ``PaymeClient``.
+
+    Calls do not hold a worker thread while waiting for Payme, so a single
+    ASGI process can keep thousands of payment calls in flight.
+    """
+    _shared = weakref.WeakKeyDictionary()
+
+    def __init__(self):
+        super().__init__()
+        self.http = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=httpx.Timeout(settings.PAYME_READ_TIMEOUT, connect=settings.PAYME_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.PAYME_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.PAYME_POOL_SIZE if settings.PAYME_KEEP_ALIVE else 0
+            )
+        )
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns the client of the running event loop.
+
+        Connections are bound to the loop they were opened on, so every loop
+        gets its own pooled client; under ASGI that is one per process.
+        """
+        loop = asyncio.get_running_loop()
+        client = cls._shared.get(loop)
+        if client is None:
+            client = cls._shared[loop] = cls()
+        return client
+
+    @classmethod
+    def reset_shared(cls):
+        """Forget the per-loop clients so the next call builds new ones"""
+        cls._shared = weakref.WeakKeyDictionary()
+
+    async def aclose(self):
+        """Close the pooled connections"""
+        await self.http.aclose()
+
+    async def call(self, method, params=None):
+        """
+        Helper to make RPC calls.
+
+        Args:
+            method (str): The method to call.
+            params (dict): The parameters to pass to the method.
+        Returns:
+            response (dict): The response from the RPC call.
+        Raises:
+            PaymeError: The typed reason of the failure.
+        """
+        # Before the breaker: a spent budget is no trial call nor failure
+        self._check_deadline()
+        breaker = get_breaker(method)
+        breaker.before_call()
+
+        error = None
+        try:
+            if self._hedged(method):
+                return await self._hedged_send(method, params)
+            return await self._send(method, params)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            breaker.record(error)
+
+    async def _send(self, method, params):
+        # Generate RPC payload
+        rpc_data = request(method, params or {})
+        connect_timeout, read_timeout = self._timeouts()
+
+        try:
+
+            # Send the request to the API endpoint over a pooled connection,
+            # giving up when the deadline passes
+            async with asyncio.timeout(deadlines.remaining()):
+                response = await self.http.post(
+                    self.base_url,
+                    json=rpc_data,
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+                )
+
+            # Check HTTP status code first
+            response.raise_for_status()
+
+            # Parse JSON response
+            return self._parse_response(response.json())
+
+        except (httpx.TimeoutException, TimeoutError) as e:
+            raise self._timeout_error(e) from e
+        except (httpx.HTTPError, ValueError) as e:
+            raise PaymeTransportError(f"RPC request failed: {str(e)}") from e
+
+    async def _hedged_send(self, method, params):
+        """
+        Sends the call a second time if Payme has not answered it within
+        ``PAYME_HEDGE_DELAY`` seconds, or as soon as the first copy fails in
+        a way a retry may fix. The first answer wins, the other copy is
+        cancelled.
+        """
+        pending, error, hedged = {asyncio.ensure_future(self._send(method, params))}, None, False
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=None if hedged else self.hedge_delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    try:
+                        return task.result()
+                    except PaymeError as e:
+                        if not e.retryable:
+                            raise
+                        error = e
+
+                if not hedged:
+                    hedged = True
+                    pending.add(asyncio.ensure_future(self._send(method, params)))
+
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def check_perform_transaction(self, payment):
+        """
+        Checks if transaction can be performed.
+
+        Args:
+            payment: Payment model instance
+        Returns:
+            response (dict): The response from the RPC call.
+        """
+        return await self.call("CheckPerformTransaction", self._check_perform_transaction_params(payment))
+
+    async def create_transaction(self, payment):
+        """
+        Creates a transaction in Payme system.
+
+        Args:
+            payment: Payment model instance
+        Returns:
+            response (dict): The response from the RPC call.
+        """
+        params = self._create_transaction_params(payment)
+
+        # Save transaction time
+        payment.provider_transaction_time = params["time"]
+        await payment.asave(update_fields=['provider_transaction_time', 'updated_at'])
+
+        return await self.call("CreateTransaction", params)
+
+    async def perform_transaction(self, payment):
+        """
+        Performs a transaction.
+
+        Args:
+            payment: Payment model instance
+        Returns:
+            response (dict): The response from the RPC call.
+        """
+        return await self.call("PerformTransaction", self._transaction_params(payment))
+
+    async def cancel_transaction(self, payment, reason):
+        """
+        Cancels a transaction.
+
+        Args:
+            payment: Payment model instance
+            reason (int): The reason code for cancellation
+        Returns:
+            response (dict): The response from the RPC call.
+        """
+        return await self.call("CancelTransaction", self._transaction_params(payment, reason=reason))
+
+    async def check_transaction(self, payment):
+        """
+        Checks the status of a transaction.
+
+        Args:
+            payment: Payment model instance
+        Returns:
+            response (dict): The response from the RPC call.
+        """
+        return await self.call("CheckTransaction", self._transaction_params(payment))
+
+
+@receiver(setting_changed)
+def reset_shared_client(setting, **kwargs):
+    """Rebuild the shared clients and breakers when Payme settings change (e.g. in tests)"""
+    if setting.startswith('PAYME_'):
+        PaymeClient.reset_shared()
+        AsyncPaymeClient.reset_shared()
+        reset_breakers()
@@ -0,0 +1,25 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from app.models import Payment, status_transitioned
+from payments.notifications import payment_status_hub
+
+
+@receiver(post_save, sender=Payment)
+def publish_payment_status(sender, instance, created, **kwargs):
+    """Notify the status stream subscribers once a status change is committed"""
+    if not created and instance.status_changed():
+        payment_id, status = instance.payment_id, instance.status
+        transaction.on_commit(lambda: payment_status_hub.publish(payment_id, status))
+
+    instance._loaded_status = instance.status
+
+
+@receiver(status_transitioned, sender=Payment)
+def publish_payment_transition(sender, instance, **kwargs):
+    """Same as ``publish_payment_status`` for changes made by ``Payment.transition``"""
+    payment_id, status = instance.payment_id, instance.status
+    transaction.on_commit(lambda: payment_status_hub.publish(payment_id, status))
+
+    instance._loaded_status = instance.status
@@ -0,0 +1,806 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from app import deadlines
+from app.checks import check_payme_secret_key
+from app.deadlines import deadline
+from app.middleware import DeadlineMiddleware
+from app.models import Order, OrderProduct, Product, Payment
+from app.testing import QueryBudgetMixin
+from payments import merchant
+from payments.fake_payme import FakePayme, FakePaymeServer
+from payments.metrics import format_latencies, summarize_latencies
+from payments.models import OutboxJob
+from payments.notifications import payment_status_hub
+from payments.outbox import OutboxWorker, aenqueue_check, enqueue
+from payments.payme_client import (
+    AsyncPaymeClient, PaymeCircuitOpen, PaymeClient, PaymeDeadlineExceeded, PaymeInternalError, PaymeTimeout,
+    PaymeTransactionNotFound, PaymeTransportError, get_breaker
+)
+
+
+class FakePaymeMixin:
+    """Points the Payme clients at the bundled fake Payme server"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.payme = FakePaymeServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.payme.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        # Fresh transactions and status check throttles for every test
+        self.payme.fake = self.fake_payme = FakePayme()
+        cache.clear()
+        settings = override_settings(
+            PAYME_API_URL=self.payme.url,
+            PAYME_CHECKOUT_URL='https://checkout.test',
+            PAYME_MERCHANT_ID='merchant',
+            PAYME_SECRET_KEY='secret'
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        super().setUp()
+
+
+class CheckoutQueryTests(QueryBudgetMixin, FakePaymeMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        cls.products = [
+            Product.objects.create(name=f'Product {i}', price=Decimal('1.50'), currency=Product.Currency.UZS)
+            for i in range(10)
+        ]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def create_order(self, lines):
+        order = Order.objects.create(user=self.user)
+        for product in self.products[:lines]:
+            OrderProduct.objects.create(order=order, product=product, quantity=2)
+        order.refresh_from_db()
+        return order
+
+    def checkout_queries(self, order):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('checkout', args=[order.id]))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_checkout_query_count_does_not_depend_on_lines(self):
+        small, large = self.create_order(1), self.create_order(10)
+        # Create the pending payments first so both runs take the same path
+        self.checkout_queries(small)
+        self.checkout_queries(large)
+        self.assertEqual(self.checkout_queries(small), self.checkout_queries(large))
+
+    def test_checkout_renders_lines_and_total(self):
+        order = self.create_order(3)
+        response = self.client.get(reverse('checkout', args=[order.id]))
+        self.assertContains(response, 'Product 2')
+        self.assertContains(response, '9.00 UZS')
+        self.assertEqual(order.payments.filter(status=Payment.PaymentStatus.PENDING).count(), 1)
+
+    def test_payment_status_loads_order_with_payment(self):
+        order = self.create_order(2)
+        payment = Payment.create_for_order(order)
+        payment.provider_transaction_id = 'tx-1'
+        payment.save()
+        self.fake_payme.add_transaction('tx-1')
+        self.fake_payme.check_state = 2
+        # session, user (once per sync and async auth cache), payment + order,
+        # CheckTransaction job insert
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('payment_status', args=[payment.payment_id]))
+        self.assertEqual(response.json()['status'], Payment.PaymentStatus.PENDING)
+        self.assertEqual(self.fake_payme.calls, {})
+
+        call_command('run_outbox_worker', once=True, stdout=StringIO())
+        response = self.client.get(reverse('payment_status', args=[payment.payment_id]))
+        self.assertEqual(response.json()['status'], Payment.PaymentStatus.PAID)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.OrderStatus.PAID)
+
+    def test_init_payme_payment_reuses_pending_payment(self):
+        order = self.create_order(2)
+        payment = Payment.create_for_order(order)
+        response = self.client.get(reverse('init_payme', args=[order.id]))
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertTrue(data['redirect_url'].startswith('https://checkout.test/'))
+        self.assertEqual((data['payment_id'], data['transaction_id']), (payment.payment_id, None))
+        # The response does not wait for Payme
+        self.assertEqual(self.fake_payme.calls, {})
+
+        self.client.get(reverse('init_payme', args=[order.id]))
+        self.assertEqual(OutboxJob.objects.get().operation, OutboxJob.Operation.CREATE_TRANSACTION)
+
+        call_command('run_outbox_worker', once=True, stdout=StringIO())
+        payment.refresh_from_db()
+        self.assertIn(payment.provider_transaction_id, self.fake_payme.transactions)
+        self.assertEqual(order.payments.count(), 1)
+        self.assertEqual(self.fake_payme.calls, {'CheckPerformTransaction': 1, 'CreateTransaction': 1})
+
+    def test_payment_status_rejects_other_users(self):
+        payment = Payment.create_for_order(self.create_order(1))
+        self.client.force_login(User.objects.create_user('other'))
+        response = self.client.get(reverse('payment_status', args=[payment.payment_id]))
+        self.assertEqual(response.status_code, 400)
+
+
+class PaymeClientTransportTests(FakePaymeMixin, TestCase):
+
+    def test_shared_client_is_a_singleton(self):
+        self.assertIs(PaymeClient.shared(), PaymeClient.shared())
+
+    def test_sequential_calls_reuse_one_connection(self):
+        client = PaymeClient.shared()
+        for __ in range(5):
+            self.assertEqual(client.call('CheckPerformTransaction'), {'allow': True})
+        self.assertEqual(client.connection_stats(), {'requests': 5, 'connections': 1, 'reused': 4})
+
+    def test_concurrent_calls_stay_within_pool(self):
+        with override_settings(PAYME_POOL_SIZE=3):
+            client = PaymeClient.shared()
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(executor.map(lambda __: client.call('CheckPerformTransaction'), range(40)))
+            stats = client.connection_stats()
+        self.assertEqual(stats['requests'], 40)
+        self.assertLessEqual(stats['connections'], 3)
+
+    def test_keep_alive_can_be_disabled(self):
+        with override_settings(PAYME_KEEP_ALIVE=False):
+            client = PaymeClient.shared()
+            for __ in range(3):
+                client.call('CheckPerformTransaction')
+            self.assertEqual(client.connection_stats()['connections'], 3)
+
+
+class AsyncPaymeClientTests(FakePaymeMixin, TestCase):
+
+    async def test_concurrent_calls_share_one_client(self):
+        client = AsyncPaymeClient.shared()
+        self.assertIs(client, AsyncPaymeClient.shared())
+        results = await asyncio.gather(*(client.call('CheckPerformTransaction') for __ in range(20)))
+        self.assertEqual(results, [{'allow': True}] * 20)
+        await client.aclose()
+
+    async def test_transport_errors_are_reported(self):
+        with override_settings(PAYME_API_URL='http://127.0.0.1:9/'):
+            client = AsyncPaymeClient.shared()
+            with self.assertRaisesMessage(Exception, 'RPC request failed'):
+                await client.call('CheckTransaction')
+            await client.aclose()
+
+
+class OutboxTests(FakePaymeMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+        cls.product = Product.objects.create(name='Product', price=Decimal('12.50'), currency=Product.Currency.UZS)
+
+    def create_payment(self):
+        order = Order.objects.create(user=self.user)
+        OrderProduct.objects.create(order=order, product=self.product, quantity=2)
+        order.refresh_from_db()
+        return Payment.create_for_order(order)
+
+    def run_worker(self, batch_size=None):
+        return async_to_sync(OutboxWorker(batch_size=batch_size).run_pending)()
+
+    def test_enqueue_skips_calls_already_waiting(self):
+        payment = self.create_payment()
+        for __ in range(3):
+            enqueue(payment, OutboxJob.Operation.CREATE_TRANSACTION)
+        enqueue(payment, OutboxJob.Operation.CHECK_TRANSACTION, delay=60)
+        self.assertEqual(OutboxJob.objects.count(), 2)
+
+        self.assertEqual(self.run_worker(), [OutboxJob.State.DONE])
+        # Once done, the same call can be enqueued again
+        enqueue(payment, OutboxJob.Operation.CREATE_TRANSACTION)
+        self.assertEqual(OutboxJob.objects.active().count(), 2)
+
+    def test_status_polls_check_at_most_every_interval(self):
+        payment = self.create_payment()
+        payment.provider_transaction_id = 'tx-1'
+        payment.save(update_fields=['provider_transaction_id'])
+        self.fake_payme.add_transaction('tx-1')
+
+        self.assertTrue(async_to_sync(aenqueue_check)(payment))
+        self.assertEqual(self.run_worker(), [OutboxJob.State.DONE])
+        # Polled again right after the check
+        self.assertFalse(async_to_sync(aenqueue_check)(payment))
+        self.assertEqual(self.run_worker(), [])
+
+        with override_settings(PAYME_STATUS_CHECK_INTERVAL=0.05):
+            cache.clear()
+            self.assertTrue(async_to_sync(aenqueue_check)(payment))
+            time.sleep(0.1)
+            self.assertTrue(async_to_sync(aenqueue_check)(payment))
+        self.assertEqual(OutboxJob.objects.count(), 2)
+
+    def test_done_jobs_are_purged_after_the_retention(self):
+        payment = self.create_payment()
+        enqueue(payment, OutboxJob.Operation.CREATE_TRANSACTION)
+        self.run_worker()
+        enqueue(payment, OutboxJob.Operation.CHECK_TRANSACTION, delay=60)
+        failed = OutboxJob.objects.create(payment=payment, operation=OutboxJob.Operation.CHECK_TRANSACTION,
+                                          state=OutboxJob.State.FAILED)
+        OutboxJob.objects.update(updated_at=timezone.now() - timedelta(days=30))
+
+        self.assertEqual(OutboxWorker(batch_size=1).purge(), 1)
+        self.assertEqual(
+            set(OutboxJob.objects.values_list('state', flat=True)), {OutboxJob.State.PENDING, failed.state}
+        )
+
+    @override_settings(PAYME_OUTBOX_LEASE=0.1)
+    def test_calls_cut_short_by_the_lease_are_retried(self):
+        payment = self.create_payment()
+        enqueue(payment, OutboxJob.Operation.CREATE_TRANSACTION)
+        self.fake_payme.delays = [1]
+
+        with self.assertLogs('payments.outbox', 'WARNING'):
+            self.assertEqual(self.run_worker(), [OutboxJob.State.PENDING])
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.PaymentStatus.PENDING)
+
+    def test_create_transaction_saves_only_its_fields(self):
+        payment = self.create_payment()
+        # Changed by the merchant API while the call was under way
+        Payment.objects.filter(pk=payment.pk).update(amount=Decimal('1.00'))
+
+        async def create_transaction():
+            client = AsyncPaymeClient.shared()
+            await client.create_transaction(payment)
+            await client.aclose()
+
+        PaymeClient.shared().create_transaction(payment)
+        async_to_sync(create_transaction)()
+        payment.refresh_from_db()
+        self.assertEqual(payment.amount, Decimal('1.00'))
+        self.assertIsNotNone(payment.provider_transaction_time)
+
+    def test_failed_calls_are_retried_with_backoff(self):
+        payment = self.create_payment()
+        enqueue(payment, OutboxJob.Operation.CREATE_TRANSACTION)
+        self.fake_payme.http_error_rate = 1
+
+        with self.assertLogs('payments.outbox', 'WARNING'):
+            self.assertEqual(self.run_worker(), [OutboxJob.State.PENDING])
+        job = OutboxJob.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('502', job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+        # Not due yet
+        self.assertEqual(self.run_worker(), [])
+
+        self.fake_payme.http_error_rate = 0
+        OutboxJob.objects.update(run_at=timezone.now())
+        self.assertEqual(self.run_worker(), [OutboxJob.State.DONE])
+        job.refresh_from_db()
+        payment.refresh_from_db()
+        self.assertEqual((job.attempts, job.claim_token), (2, None))
+        self.assertEqual(job.result['transaction'], payment.provider_transaction_id)
+
+    @override_settings(PAYME_OUTBOX_MAX_ATTEMPTS=1)
+    def test_gives_up_and_fails_the_payment(self):
+        payment = self.create_payment()
+        enqueue(payment, OutboxJob.Operation.CREATE_TRANSACTION)
+        self.fake_payme.error_rate = 1
+
+        with self.assertLogs('payments.outbox', 'ERROR'):
+            self.assertEqual(self.run_worker(), [OutboxJob.State.FAILED])
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.PaymentStatus.FAILED)
+
+    def test_check_transaction_applies_the_final_state(self):
+        payment = self.create_payment()
+        payment.provider_transaction_id = 'tx-1'
+        payment.save()
+        self.fake_payme.add_transaction('tx-1')
+        self.fake_payme.check_state = -1
+        enqueue(payment, OutboxJob.Operation.CHECK_TRANSACTION)
+
+        self.run_worker()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.PaymentStatus.CANCELED)
+        self.assertEqual(payment.order.status, Order.OrderStatus.PENDING)
+
+    def test_claims_do_not_overlap_and_lapse(self):
+        for __ in range(5):
+            enqueue(self.create_payment(), OutboxJob.Operation.CREATE_TRANSACTION)
+
+        first, second = OutboxWorker(batch_size=3).claim(), OutboxWorker(batch_size=3).claim()
+        self.assertEqual((len(first), len(second)), (3, 2))
+        self.assertFalse({job.pk for job in first} & {job.pk for job in second})
+        self.assertEqual(OutboxWorker().claim(), [])
+
+        # The jobs of a worker that died are claimed again once its lease lapses
+        OutboxJob.objects.filter(pk__in=[job.pk for job in first]).update(locked_until=timezone.now())
+        reclaimed = OutboxWorker().claim()
+        self.assertEqual({job.pk for job in reclaimed}, {job.pk for job in first})
+        # The late worker's result is ignored
+        OutboxWorker().complete(first[0], {'late': True})
+        self.assertEqual(OutboxJob.objects.get(pk=first[0].pk).state, OutboxJob.State.RUNNING)
+
+    def test_run_outbox_worker_command(self):
+        for __ in range(3):
+            enqueue(self.create_payment(), OutboxJob.Operation.CREATE_TRANSACTION)
+        out = StringIO()
+        call_command('run_outbox_worker', once=True, batch_size=2, stdout=out)
+        self.assertIn('Ran 3 outbox jobs: DONE=3', out.getvalue())
+        self.assertEqual(self.fake_payme.calls, {'CheckPerformTransaction': 3, 'CreateTransaction': 3})
+
+
+class PaymeFailureHandlingTests(FakePaymeMixin, TestCase):
+
+    def test_errors_are_typed(self):
+        client = PaymeClient.shared()
+        with self.assertRaises(PaymeTransactionNotFound) as caught:
+            client.call('CheckTransaction', {'id': 'missing'})
+        self.assertEqual(caught.exception.code, -31003)
+        self.assertFalse(caught.exception.retryable)
+
+        self.fake_payme.error_rate = 1
+        with self.assertRaisesMessage(PaymeInternalError, 'API Error: Injected error'):
+            client.call('CheckPerformTransaction')
+
+        self.fake_payme.error_rate, self.fake_payme.http_error_rate = 0, 1
+        with self.assertRaisesMessage(PaymeTransportError, 'RPC request failed'):
+            client.call('CheckPerformTransaction')
+
+    def test_calls_time_out_with_the_deadline(self):
+        self.fake_payme.delays = [1]
+        started = time.perf_counter()
+        with deadline(0.1), self.assertRaises(PaymeTimeout):
+            PaymeClient.shared().call('CheckPerformTransaction')
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+        # No time left, no call
+        with deadline(0), self.assertRaises(PaymeTimeout):
+            PaymeClient.shared().call('CreateTransaction', {})
+        self.assertNotIn('CreateTransaction', self.fake_payme.calls)
+
+    async def test_async_calls_time_out_with_the_deadline(self):
+        self.fake_payme.delays = [1]
+        client = AsyncPaymeClient.shared()
+        started = time.perf_counter()
+        with deadline(0.1), self.assertRaises(PaymeTimeout):
+            await client.call('CheckPerformTransaction')
+        self.assertLess(time.perf_counter() - started, 0.5)
+        await client.aclose()
+
+    @override_settings(PAYME_BREAKER_FAILURE_THRESHOLD=2)
+    def test_spent_deadlines_leave_the_circuit_closed(self):
+        client = PaymeClient.shared()
+        self.fake_payme.delays = [1, 1]
+        for seconds in (0, 0, 0.1, 0.1):
+            with deadline(seconds), self.assertRaises(PaymeDeadlineExceeded) as caught:
+                client.call('CheckPerformTransaction')
+            self.assertFalse(caught.exception.retryable)
+        self.assertEqual(get_breaker('CheckPerformTransaction').state, 'closed')
+        self.assertEqual(get_breaker('CheckPerformTransaction').failures, 0)
+
+    @override_settings(PAYME_BREAKER_FAILURE_THRESHOLD=2)
+    async def test_async_spent_deadlines_leave_the_circuit_closed(self):
+        client = AsyncPaymeClient.shared()
+        self.fake_payme.delays = [1, 1]
+        for seconds in (0, 0.1, 0.1):
+            with deadline(seconds), self.assertRaises(PaymeDeadlineExceeded):
+                await client.call('CheckPerformTransaction')
+        self.assertEqual(get_breaker('CheckPerformTransaction').state, 'closed')
+        await client.aclose()
+
+    def test_requests_carry_a_deadline(self):
+        request = RequestFactory().get('/')
+        with override_settings(REQUEST_DEADLINE=5):
+            left = DeadlineMiddleware(lambda request: deadlines.remaining())(request)
+        self.assertTrue(4 < left <= 5)
+        self.assertIsNone(deadlines.remaining())
+
+    @override_settings(PAYME_BREAKER_FAILURE_THRESHOLD=2, PAYME_BREAKER_RESET_TIMEOUT=0.2)
+    def test_circuit_breaker_fails_fast_per_method(self):
+        client = PaymeClient.shared()
+        self.fake_payme.http_error_rate = 1
+        for __ in range(2):
+            with self.assertRaises(PaymeTransportError):
+                client.call('CheckTransaction', {'id': 'tx-1'})
+        self.assertEqual(get_breaker('CheckTransaction').state, 'open')
+        self.fake_payme.http_error_rate = 0
+        with self.assertRaises(PaymeCircuitOpen):
+            client.call('CheckTransaction', {'id': 'tx-1'})
+        self.assertNotIn('CheckTransaction', self.fake_payme.calls)
+
+        # Other methods are not affected
+        self.assertEqual(client.call('CheckPerformTransaction'), {'allow': True})
+
+        # After the reset timeout a trial call closes the circuit again
+        time.sleep(0.2)
+        self.fake_payme.add_transaction('tx-1')
+        self.assertEqual(client.call('CheckTransaction', {'id': 'tx-1'})['state'], 1)
+        self.assertEqual(get_breaker('CheckTransaction').state, 'closed')
+
+    @override_settings(PAYME_BREAKER_FAILURE_THRESHOLD=2)
+    def test_business_errors_do_not_open_the_circuit(self):
+        client = PaymeClient.shared()
+        for __ in range(3):
+            with self.assertRaises(PaymeTransactionNotFound):
+                client.call('CheckTransaction', {'id': 'missing'})
+        self.assertEqual(get_breaker('CheckTransaction').state, 'closed')
+
+    @override_settings(PAYME_HEDGE_DELAY=0.05)
+    def test_idempotent_calls_are_hedged(self):
+        self.fake_payme.add_transaction('tx-1')
+        self.fake_payme.delays = [1]
+        started = time.perf_counter()
+        self.assertEqual(PaymeClient.shared().call('CheckTransaction', {'id': 'tx-1'})['transaction'], 'tx-1')
+        # Answered by the second copy, the first one stalls for a second
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+        # Calls that change state are never sent twice
+        self.fake_payme.delays = [0.2]
+        PaymeClient.shared().call('CreateTransaction', {'time': 1})
+        self.assertEqual(self.fake_payme.calls['CreateTransaction'], 1)
+
+    @override_settings(PAYME_HEDGE_DELAY=0.05)
+    async def test_async_idempotent_calls_are_hedged(self):
+        self.fake_payme.delays = [1]
+        client = AsyncPaymeClient.shared()
+        started = time.perf_counter()
+        self.assertEqual(await client.call('CheckPerformTransaction'), {'allow': True})
+        self.assertLess(time.perf_counter() - started, 0.5)
+        await client.aclose()
+
+
+class ReconcilePaymentsCommandTests(FakePaymeMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('buyer')
+        states = {'paid': 2, 'canceled': -1, 'refunded': -2, 'pending': 1}
+        for index, prefix in enumerate(['paid', 'paid', 'canceled', 'refunded', 'pending']):
+            order = Order.objects.create(user=user)
+            payment = Payment.create_for_order(order)
+            payment.provider_transaction_id = f'{prefix}-{index}'
+            payment.save()
+            self.fake_payme.add_transaction(payment.provider_transaction_id, state=states[prefix])
+        Payment.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+    def reconcile(self, *args):
+        stdout = StringIO()
+        call_command('reconcile_payments', '--chunk-size=2', '--concurrency=4', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def statuses(self):
+        return {
+            payment.provider_transaction_id: (payment.status, payment.order.status)
+            for payment in Payment.objects.select_related('order')
+        }
+
+    def test_applies_final_states(self):
+        output = self.reconcile()
+        self.assertIn('Checked 5 payments', output)
+        self.assertIn('p95=', output)
+        self.assertEqual(self.statuses(), {
+            'paid-0': ('PAID', 'PAID'),
+            'paid-1': ('PAID', 'PAID'),
+            'canceled-2': ('CANCELED', 'PENDING'),
+            'refunded-3': ('REFUNDED', 'PENDING'),
+            'pending-4': ('PENDING', 'PENDING'),
+        })
+        self.assertEqual(Payment.objects.get(provider_transaction_id='paid-0').provider_payment_data['state'], 2)
+
+    def test_dry_run_writes_nothing(self):
+        before = self.statuses()
+        output = self.reconcile('--dry-run')
+        self.assertIn('[dry run]', output)
+        self.assertIn('PAID=2', output)
+        self.assertEqual(self.statuses(), before)
+
+    def test_recent_payments_are_skipped(self):
+        Payment.objects.update(created_at=timezone.now())
+        self.assertIn('Checked 0 payments', self.reconcile())
+
+
+@override_settings(PAYME_MERCHANT_LOGIN='Paycom', PAYME_SECRET_KEY='secret')
+class MerchantAPITests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+        cls.product = Product.objects.create(name='Apple', price=Decimal('12.50'), currency=Product.Currency.UZS)
+
+    def setUp(self):
+        self.order = Order.objects.create(user=self.user)
+        OrderProduct.objects.create(order=self.order, product=self.product, quantity=2)
+        self.order.refresh_from_db()
+        self.account = {'order_id': str(self.order.id)}
+
+    def rpc(self, method, params, password='secret'):
+        credentials = base64.b64encode(f'Paycom:{password}'.encode()).decode()
+        response = self.client.post(
+            reverse('payme_merchant'),
+            data=json.dumps({'id': 7, 'method': method, 'params': params}),
+            content_type='application/json',
+            headers={'authorization': f'Basic {credentials}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def create(self, transaction_id='tx-1', **params):
+        params = {'id': transaction_id, 'time': merchant.now_ms(), 'amount': 2500, 'account': self.account, **params}
+        return self.rpc('CreateTransaction', params)
+
+    def test_rejects_invalid_credentials(self):
+        response = self.rpc('CheckPerformTransaction', {'amount': 2500, 'account': self.account}, password='wrong')
+        self.assertEqual(response['error']['code'], merchant.MerchantError.INSUFFICIENT_PRIVILEGE)
+
+    def test_rejects_every_callback_without_a_secret_key(self):
+        for secret_key in (None, ''):
+            with self.subTest(secret_key=secret_key), override_settings(PAYME_SECRET_KEY=secret_key):
+                response = self.rpc('PerformTransaction', {'id': 'tx-1'}, password=secret_key)
+                self.assertEqual(response['error']['code'], merchant.MerchantError.INSUFFICIENT_PRIVILEGE)
+                self.assertEqual(check_payme_secret_key(None)[0].id, 'app.E002')
+        self.assertEqual(check_payme_secret_key(None), [])
+
+    def test_check_perform_transaction(self):
+        self.assertEqual(self.rpc('CheckPerformTransaction', {'amount': 2500, 'account': self.account})['result'], {'allow': True})
+        wrong_amount = self.rpc('CheckPerformTransaction', {'amount': 100, 'account': self.account})
+        self.assertEqual(wrong_amount['error']['code'], merchant.MerchantError.INVALID_AMOUNT)
+        unknown = self.rpc('CheckPerformTransaction', {'amount': 2500, 'account': {'order_id': '0'}})
+        self.assertEqual(unknown['error']['code'], merchant.MerchantError.ORDER_NOT_FOUND)
+
+    def test_unknown_method(self):
+        self.assertEqual(self.rpc('Refund', {})['error']['code'], merchant.MerchantError.METHOD_NOT_FOUND)
+
+    def test_full_transaction_lifecycle(self):
+        created = self.create()['result']
+        self.assertEqual(created['state'], merchant.STATE_CREATED)
+        # CreateTransaction is idempotent for the same transaction
+        self.assertEqual(self.create()['result'], created)
+        other = self.create('tx-2')
+        self.assertEqual(other['error']['code'], merchant.MerchantError.ORDER_UNAVAILABLE)
+
+        performed = self.rpc('PerformTransaction', {'id': 'tx-1'})['result']
+        self.assertEqual(performed['state'], merchant.STATE_PERFORMED)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.PAID)
+
+        checked = self.rpc('CheckTransaction', {'id': 'tx-1'})['result']
+        self.assertEqual(checked['perform_time'], performed['perform_time'])
+
+        canceled = self.rpc('CancelTransaction', {'id': 'tx-1', 'reason': 5})['result']
+        self.assertEqual(canceled['state'], merchant.STATE_CANCELED_AFTER_PERFORM)
+        self.assertEqual(self.rpc('CheckTransaction', {'id': 'tx-1'})['result']['reason'], 5)
+        self.assertEqual(Payment.objects.get().status, Payment.PaymentStatus.REFUNDED)
+
+    def test_expired_transaction_is_canceled(self):
+        self.create(time=merchant.now_ms() - merchant.TRANSACTION_TIMEOUT_MS - 1000)
+        response = self.rpc('PerformTransaction', {'id': 'tx-1'})
+        self.assertEqual(response['error']['code'], merchant.MerchantError.CANNOT_PERFORM)
+        result = self.rpc('CheckTransaction', {'id': 'tx-1'})['result']
+        self.assertEqual((result['state'], result['reason']), (merchant.STATE_CANCELED, merchant.REASON_TIMEOUT))
+
+    def test_missing_or_invalid_params_are_rejected_before_any_query(self):
+        # A checkout payment without a Payme transaction yet
+        payment = Payment.create_for_order(self.order)
+        invalid = [
+            ('CancelTransaction', {'reason': 3}),
+            ('CancelTransaction', {'id': 'tx-1'}),
+            ('CheckTransaction', {}),
+            ('PerformTransaction', {'id': None}),
+            ('CreateTransaction', {'id': 'tx-1', 'amount': 2500, 'account': self.account}),
+            ('CreateTransaction', {'id': 'tx-1', 'time': '1', 'amount': 2500, 'account': self.account}),
+            ('CheckPerformTransaction', {'amount': True, 'account': self.account}),
+            ('GetStatement', {'from': 0}),
+            ('GetStatement', {}),
+        ]
+        for method, params in invalid:
+            with self.subTest(method=method, params=params), self.assertNumQueries(0):
+                response = self.rpc(method, params)
+                self.assertEqual(response['error']['code'], merchant.MerchantError.INVALID_REQUEST)
+
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.provider_transaction_time), (Payment.PaymentStatus.PENDING, None))
+
+    def test_unexpected_errors_are_reported_as_rpc_errors(self):
+        def broken(params):
+            raise RuntimeError("boom")
+
+        with mock.patch.dict(merchant.METHODS, {'CheckTransaction': broken}), self.assertLogs('payments.merchant'):
+            response = self.rpc('CheckTransaction', {'id': 'tx-1'})
+        self.assertEqual(response['error']['code'], merchant.MerchantError.SYSTEM_ERROR)
+
+    def test_get_statement(self):
+        start = merchant.now_ms()
+        self.create()
+        statement = self.rpc('GetStatement', {'from': start, 'to': start + 60000})['result']['transactions']
+        self.assertEqual([(item['id'], item['amount'], item['account']) for item in statement], [('tx-1', 2500, self.account)])
+        self.assertEqual(self.rpc('GetStatement', {'from': 0, 'to': start - 1})['result'], {'transactions': []})
+
+    def test_methods_run_a_bounded_number_of_queries(self):
+        # Writing methods also count the SAVEPOINT / RELEASE of their transaction
+        budgets = [
+            ('CheckPerformTransaction', {'amount': 2500, 'account': self.account}, 1),
+            ('CreateTransaction', {'id': 'tx-1', 'time': merchant.now_ms(), 'amount': 2500, 'account': self.account}, 6),
+            ('CheckTransaction', {'id': 'tx-1'}, 1),
+            ('PerformTransaction', {'id': 'tx-1'}, 5),
+            ('CancelTransaction', {'id': 'tx-1', 'reason': 5}, 5),
+            ('GetStatement', {'from': 0, 'to': merchant.now_ms()}, 1),
+        ]
+        for method, params, budget in budgets:
+            with self.subTest(method=method), self.assertNumQueries(budget):
+                self.assertIn('result', self.rpc(method, params))
+
+    def test_latency_benchmark(self):
+        latencies = {}
+        for index in range(30):
+            order = Order.objects.create(user=self.user)
+            OrderProduct.objects.create(order=order, product=self.product, quantity=1)
+            account = {'order_id': str(order.id)}
+            calls = [
+                ('CheckPerformTransaction', {'amount': 1250, 'account': account}),
+                ('CreateTransaction', {'id': f'bench-{index}', 'time': merchant.now_ms(), 'amount': 1250, 'account': account}),
+                ('PerformTransaction', {'id': f'bench-{index}'}),
+                ('CheckTransaction', {'id': f'bench-{index}'}),
+                ('GetStatement', {'from': 0, 'to': merchant.now_ms()}),
+            ]
+            for method, params in calls:
+                started = time.perf_counter()
+                self.assertIn('result', self.rpc(method, params))
+                latencies.setdefault(method, []).append(time.perf_counter() - started)
+
+        for method, values in latencies.items():
+            summary = summarize_latencies(values)
+            # Payme gives merchants a few seconds; stay far below it
+            self.assertLess(summary['p95'], 500, f'{method}: {format_latencies(summary)}')
+            self.assertLess(summary['p99'], 1000, f'{method}: {format_latencies(summary)}')
+
+
+class PendingPaymentTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.order = Order.objects.create(user=self.user)
+
+    def test_get_or_create_pending_reuses_payment(self):
+        payment, created = Payment.objects.get_or_create_pending(self.order)
+        self.assertTrue(created)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(Payment.objects.get_or_create_pending(self.order), (payment, False))
+        # INSERT ... ON CONFLICT DO NOTHING then a fetch, without savepoint
+        statements = [query['sql'].split()[0] for query in context.captured_queries]
+        self.assertEqual([sql for sql in statements if sql not in ('BEGIN', 'COMMIT')], ['INSERT', 'SELECT'])
+
+    def test_only_one_pending_payment_per_order(self):
+        Payment.create_for_order(self.order)
+        with self.assertRaises(IntegrityError):
+            Payment.create_for_order(self.order)
+
+    def test_parallel_checkouts_create_one_payment(self):
+        workers = 8
+        barrier = threading.Barrier(workers)
+
+        def checkout():
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        return Payment.objects.get_or_create_pending(self.order)[0].pk
+                    except OperationalError:
+                        # The shared-cache in-memory SQLite test database reports
+                        # "table is locked" instead of waiting for the writer
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            payment_ids = set(executor.map(lambda __: checkout(), range(workers)))
+
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 1)
+        self.assertEqual(payment_ids, {Payment.objects.get().pk})
+
+
+@override_settings(PAYMENT_STREAM_TIMEOUT=2, PAYMENT_STREAM_POLL_INTERVAL=1)
+class PaymentStatusStreamTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.payment = Payment.create_for_order(Order.objects.create(user=self.user))
+        self.url = reverse('payment_status_stream', args=[self.payment.payment_id])
+
+    async def read_stream(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def test_hub_delivers_changes_from_other_threads(self):
+        with payment_status_hub.subscribe('payment') as subscription:
+            threading.Thread(target=payment_status_hub.publish, args=('payment', 'PAID')).start()
+            self.assertEqual(await subscription.get(timeout=1), 'PAID')
+            self.assertIsNone(await subscription.get(timeout=0.01))
+
+    async def test_pushes_status_change(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        async def pay():
+            await asyncio.sleep(0.1)
+            payment = await Payment.objects.aget(pk=self.payment.pk)
+            payment.status = Payment.PaymentStatus.PAID
+            await payment.asave()
+
+        started = time.perf_counter()
+        body, __ = await asyncio.gather(self.read_stream(response), pay())
+        self.assertIn('event: status', body)
+        self.assertIn('"status": "PAID"', body)
+        # Delivered by the hub, not by the periodic re-read
+        self.assertLess(time.perf_counter() - started, 0.9)
+
+    async def test_returns_immediately_when_status_already_changed(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url, {'status': Payment.PaymentStatus.PAID})
+        self.assertIn('"status": "PENDING"', await self.read_stream(response))
+
+    async def test_times_out_without_changes(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertIn('event: timeout', await self.read_stream(response))
+
+
+@override_settings(PAYME_MERCHANT_ID='merchant', PAYME_SECRET_KEY='secret', PAYME_CHECKOUT_URL='https://checkout.test')
+class LoadtestCheckoutCommandTests(TransactionTestCase):
+
+    def loadtest(self, *args):
+        stdout = StringIO()
+        call_command('loadtest_checkout', '--flows=6', '--concurrency=3', '--lines=2', '--latency=0', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_runs_the_full_payment_path(self):
+        output = self.loadtest('--keep-data')
+        self.assertIn('Ran 6 checkout flows', output)
+        self.assertIn('0 failed', output)
+        self.assertIn('Final statuses: PAID=6', output)
+        self.assertIn('CreateTransaction=6', output)
+        self.assertIn('payment_status: mean=', output)
+        self.assertEqual(Payment.objects.filter(status=Payment.PaymentStatus.PAID).count(), 6)
+        self.assertEqual(Order.objects.filter(status=Order.OrderStatus.PAID).count(), 6)
+
+    def test_reports_failed_steps_and_cleans_up(self):
+        # Existing data, including a user named like the old shared load test user
+        user = User.objects.create_user('loadtest')
+        product = Product.objects.create(name='Apple', price=Decimal('1.00'), currency=Product.Currency.UZS)
+        order = Order.objects.create(user=user)
+        OrderProduct.objects.create(order=order, product=product, quantity=1)
+
+        with self.assertLogs('payments.outbox', 'WARNING'):
+            output = self.loadtest('--error-rate=1', '--status-timeout=0.2')
+        self.assertIn('6 failed (payment_status=6)', output)
+        self.assertEqual(list(Order.objects.all()), [order])
+        self.assertEqual(list(Product.objects.all()), [product])
+        self.assertEqual(list(User.objects.all()), [user])
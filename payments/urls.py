@@ -5,4 +5,6 @@ urlpatterns = [
     path('checkout/<int:order_id>/', views.checkout, name='checkout'),
     path('init-payme/<int:order_id>/', views.init_payme_payment, name='init_payme'),
     path('status/<str:payment_id>/', views.payment_status, name='payment_status'),
+    path('status/<str:payment_id>/stream', views.payment_status_stream, name='payment_status_stream'),
+    path('merchant/', views.merchant_api, name='payme_merchant'),
 ]
\ No newline at end of file
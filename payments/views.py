@@ -1,15 +1,21 @@
+import asyncio
 import base64
-import random
+import json
 
-from django.shortcuts import render, get_object_or_404
-from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.shortcuts import render, get_object_or_404, aget_object_or_404
+from django.contrib.auth.decorators import login_not_required, login_required
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse, StreamingHttpResponse
 from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
 
 import logging
 
 from app.models import Order, Payment
-from .payme_client import PaymeClient
+from . import merchant, outbox
+from .models import OutboxJob
+from .notifications import payment_status_hub
 
 logger = logging.getLogger(__name__)
 
@@ -18,13 +24,13 @@ def checkout(request, order_id):
     """
     Display checkout page for an order
     """
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(Order.objects.for_checkout(), id=order_id, user=request.user)
 
-    # Check if payment already exists
-    payment = Payment.objects.filter(order=order, status=Payment.PaymentStatus.PENDING).first()
+    # Reuse the prefetched pending payment, or create it race-free
+    payment = order.get_pending_payment()
 
     if not payment:
-        payment = Payment.create_for_order(order)
+        payment, __ = Payment.objects.get_or_create_pending(order)
 
     context = {
         'order':order,
@@ -35,123 +41,147 @@ def checkout(request, order_id):
     return render(request, 'payments/checkout.html', context)
 
 
+@transaction.atomic
+def start_payme_transaction(order):
+    """
+    Returns the pending payment of an order, with its Payme transaction
+    enqueued in the same transaction when it has none yet.
+    """
+    # Reuse the prefetched pending payment, or create it race-free
+    payment = order.get_pending_payment()
+
+    if not payment:
+        payment, __ = Payment.objects.get_or_create_pending(order)
+
+    if not payment.provider_transaction_id:
+        outbox.enqueue(payment, OutboxJob.Operation.CREATE_TRANSACTION)
+
+    return payment
+
+
 @login_required
-def init_payme_payment(request, order_id):
+async def init_payme_payment(request, order_id):
     """
     Initialize a payment with Payme
+
+    The Payme transaction is created by the outbox worker, the response does
+    not wait for it; follow the payment with ``payment_status``.
     """
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    user = await request.auser()
+    order = await aget_object_or_404(Order.objects.with_pending_payment(), id=order_id, user=user)
 
-    # Check if payment already exists
-    payment = Payment.objects.filter(order=order, status=Payment.PaymentStatus.PENDING).first()
+    payment = await sync_to_async(start_payme_transaction)(order)
 
-    if not payment:
-        payment = Payment.create_for_order(order)
-
-    # Get redirect URL for payment
-    try:
-        client = PaymeClient()
-
-        # Check if transaction can be performed:
-        # check_result = client.check_perform_transaction(payment)
-        check_result = {
-            "allow" : True
-        }
-
-        if check_result.get('allow') is not True:
-            return JsonResponse({
-                'success': False,
-                'error': 'Payment not allowed by Payme'
-            })
-
-
-        # Create transaction
-        # transaction_result = client.create_transaction(payment)
-        transaction_result = {
-            "create_time": payment.created_at.isoformat(),
-            "transaction": f"{random.randint(1000, 9999)}",
-            "state": 1
-        }
-
-        # Save transaction ID
-        payment.provider_transaction_id = transaction_result.get('transaction')
-        payment.provider_payment_data = transaction_result
-        payment.save()
-
-        # Generate ULR form to redirect to Payme Payment page
-        merchant_id = f"m={settings.PAYME_MERCHANT_ID};"
-        order_id = f"ac.order_id={order.id};"
-        amount = f"a={payment.get_amount_in_tiyins()};"
-        lang = f"l={"en"};"
-        cancel_address = f"c={settings.BASE_URL}/cancel-payment/{payment.id}"
-        url_form = merchant_id+order_id+amount+lang+cancel_address
-
-        # Encode 'url_form' in base64
-        url_encoded = base64.b64encode(url_form.encode('utf-8')).decode('utf-8')
-        print(url_encoded)
-
-        # Return success with transaction data
-        return JsonResponse({
-            'success': True,
-            'transaction_id': payment.provider_transaction_id,
-            'redirect_url': f"{settings.PAYME_CHECKOUT_URL}/{url_encoded}"
-        })
-
-    except Exception as e:
-        logger.error(f"Payme payment initialization error: {str(e)}")
-        return JsonResponse({
-            'success':False,
-            'error':str(e)
-        }, status=400)
+    # Generate ULR form to redirect to Payme Payment page
+    merchant_id = f"m={settings.PAYME_MERCHANT_ID};"
+    order_id = f"ac.order_id={order.id};"
+    amount = f"a={payment.get_amount_in_tiyins()};"
+    lang = "l=en;"
+    cancel_address = f"c={settings.BASE_URL}/cancel-payment/{payment.id}"
+    url_form = merchant_id+order_id+amount+lang+cancel_address
+
+    # Encode 'url_form' in base64
+    url_encoded = base64.b64encode(url_form.encode('utf-8')).decode('utf-8')
+    logger.debug(f"Payme checkout form: {url_encoded}")
+
+    return JsonResponse({
+        'success': True,
+        'payment_id': payment.payment_id,
+        'transaction_id': payment.provider_transaction_id,
+        'redirect_url': f"{settings.PAYME_CHECKOUT_URL}/{url_encoded}"
+    })
 
 
 @login_required
-def payment_status(request, payment_id):
+async def payment_status(request, payment_id):
     """
     Check payment status
+
+    Returns the status known now and, while the payment is pending, enqueues
+    a CheckTransaction call; ``payment_status_stream`` pushes the outcome.
     """
-    payment = get_object_or_404(Payment, payment_id=payment_id)
+    user = await request.auser()
+    payment = await aget_object_or_404(Payment.objects.with_order(), payment_id=payment_id)
 
     # Verify user owns the order
-    if payment.order.user != request.user:
+    if payment.order.user_id != user.id:
         return HttpResponseBadRequest("Unauthorized")
 
-    try:
-        client = PaymeClient()
-        # status = client.check_transaction(payment)
-        status = {
-            "create_time" : payment.created_at.isoformat(),
-            "perform_time" : payment.created_at.isoformat(),
-            "cancel_time" : 0,
-            "transaction" : payment.provider_transaction_id,
-            "state" : 2,
-            "reason" : None
-        }
-
-
-        # Update payment status based on Payme response
-        if status.get('state') == 2:
-            payment.status = Payment.PaymentStatus.PAID
-            payment.order.status = Order.OrderStatus.PAID
-            payment.order.save()
-        elif status.get('state') == -1:
-            payment.status = Payment.PaymentStatus.CANCELED
-        elif status.get('state') == -2:
-            payment.status = Payment.PaymentStatus.REFUNDED
-        elif status.get('state') == 1:
-            pass
-
-        payment.save()
-
-        return JsonResponse({
-            'success':True,
-            'status':payment.status,
-            'payment_data':status
-        })
-
-    except Exception as e:
-        logger.error(f"Payment status check error: {str(e)}")
-        return JsonResponse({
-            'success':False,
-            'error':str(e)
-        }, status=400)
\ No newline at end of file
+    # Ask Payme in the background, at most every PAYME_STATUS_CHECK_INTERVAL
+    # seconds; the outbox worker applies the new status
+    if payment.status == Payment.PaymentStatus.PENDING and payment.provider_transaction_id:
+        await outbox.aenqueue_check(payment)
+
+    return JsonResponse({
+        'success':True,
+        'status':payment.status,
+        'payment_data':payment.provider_payment_data
+    })
+
+
+@login_required
+async def payment_status_stream(request, payment_id):
+    """
+    Push the payment status as Server-Sent Events
+
+    The connection is held open until the status differs from ``?status=``
+    (the last status the client saw, PENDING by default); the new status is
+    sent once and the stream ends. Clients reconnect after a ``timeout`` event.
+    """
+    user = await request.auser()
+    payment = await aget_object_or_404(Payment.objects.with_order(), payment_id=payment_id)
+
+    # Verify user owns the order
+    if payment.order.user_id != user.id:
+        return HttpResponseBadRequest("Unauthorized")
+
+    known_status = request.GET.get('status', Payment.PaymentStatus.PENDING)
+
+    response = StreamingHttpResponse(
+        stream_payment_status(payment, known_status),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def stream_payment_status(payment, known_status):
+    """
+    Yields a single SSE event: the new status of the payment, or a timeout.
+
+    Changes made in this process arrive through the notification hub; the
+    status is also re-read every PAYMENT_STREAM_POLL_INTERVAL seconds to
+    catch changes made by other processes.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.PAYMENT_STREAM_TIMEOUT
+
+    with payment_status_hub.subscribe(payment.payment_id) as subscription:
+        # Subscribe before re-reading so that no change is missed in between
+        status = await Payment.objects.filter(pk=payment.pk).values_list('status', flat=True).afirst()
+
+        while status == known_status:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+
+            status = await subscription.get(min(remaining, settings.PAYMENT_STREAM_POLL_INTERVAL))
+            if status is None:
+                status = await Payment.objects.filter(pk=payment.pk).values_list('status', flat=True).afirst()
+
+    data = json.dumps({'payment_id': payment.payment_id, 'status': status})
+    yield f"event: status\ndata: {data}\n\n"
+
+
+@csrf_exempt
+@login_not_required
+def merchant_api(request):
+    """
+    Payme merchant API callbacks (authenticated with Basic auth)
+    """
+    response = merchant.handle_request(request.method, request.headers.get('Authorization'), request.body)
+
+    # Payme expects errors inside a successful HTTP response
+    return JsonResponse(response)
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reports import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Update the hourly and daily sales rollups served by /api/v1/reports/, rebuilding the "
+        "days with orders, order lines or payments changed since the last run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Rebuild the rollups of every day, e.g. after rows were deleted.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            days = rollups.update(rebuild=options['rebuild'])
+        except rollups.RollupsLocked as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt the rollups of {len(days)} days in {elapsed:.2f}s"
+            + (f" ({days[0]:%Y-%m-%d} to {days[-1]:%Y-%m-%d})" if days else "")
+        ))
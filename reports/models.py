@@ -0,0 +1,81 @@
+from django.db import models
+
+
+class Granularity(models.TextChoices):
+    HOUR = 'HOUR', 'Hour'
+    DAY = 'DAY', 'Day'
+
+
+class Rollup(models.Model):
+    """
+    Aggregates of the orders or payments created in an hour or a day
+    (``bucket`` is its start), maintained by ``update_rollups`` (see
+    ``reports.rollups``).
+    """
+    granularity = models.CharField(max_length=4, choices=Granularity.choices)
+    bucket = models.DateTimeField()
+
+    class Meta:
+        abstract = True
+
+
+class OrderRollup(Rollup):
+    """Orders per status"""
+    status = models.CharField(max_length=10)
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(decimal_places=2, max_digits=16, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'bucket', 'status'], name='unique_order_rollup'),
+        ]
+
+
+class ProductSalesRollup(Rollup):
+    """Sales of a product, per status of the orders"""
+    product = models.ForeignKey('app.Product', on_delete=models.CASCADE, related_name='+')
+    order_status = models.CharField(max_length=10)
+    order_count = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(decimal_places=2, max_digits=16, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'bucket', 'product', 'order_status'],
+                name='unique_product_sales_rollup'
+            ),
+        ]
+        indexes = [
+            # Pages of the reports endpoint, see api.v1.pagination
+            models.Index(fields=['granularity', 'bucket', 'id'], name='product_sales_rollup_page_idx'),
+        ]
+
+
+class PaymentRollup(Rollup):
+    """Payments per status, from which success rates are computed"""
+    status = models.CharField(max_length=10)
+    payment_count = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(decimal_places=2, max_digits=16, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'bucket', 'status'], name='unique_payment_rollup'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """
+    ``updated_at`` up to which the changes of the source tables are in the
+    rollups, None before the first update.
+
+    The row also holds the lease of the update under way: ``lock_token``
+    until ``locked_until``, renewed after every day rebuilt.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField(null=True)
+    lock_token = models.CharField(max_length=32, blank=True, null=True)
+    locked_until = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
@@ -0,0 +1,246 @@
+"""
+Hourly and daily rollups of orders, product sales and payments.
+
+Rows are bucketed by the creation time of their order or payment, so a
+change to a row only ever affects the day it was created in. ``update``
+finds the days with rows changed since the watermark (their ``updated_at``,
+see the ``*_updated_at_idx`` indexes) and rebuilds each of them: the hourly
+buckets from the rows of that day, the daily bucket from its hours. As a
+rebuild is idempotent, the scan starts ``ROLLUP_WATERMARK_OVERLAP`` seconds
+before the watermark to catch rows committed late by long transactions.
+
+Revenue is taken from the stored order totals and line prices
+(``OrderProduct.price``), which are frozen once an order leaves PENDING:
+rebuilding a past day after a change of catalog prices gives the same
+figures.
+
+Deleted rows leave nothing to find: their day is corrected the next time it
+is rebuilt, or by ``update_rollups --rebuild``.
+
+Every day is rebuilt and committed in a transaction of its own, so no
+transaction spans the history, ``--rebuild`` included. Overlapping runs of
+``update_rollups`` are kept apart by a lease on the watermark row, taken
+with a conditional UPDATE (like the claims of ``payments.outbox``) and
+renewed after every day: a second run fails with ``RollupsLocked`` rather
+than rebuilding the same days concurrently, and the lease of a run that died
+lapses after ``ROLLUP_LEASE`` seconds. The watermark only moves on once
+every day was rebuilt; a failed run is picked up again by the next one.
+"""
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from app.models import TOTAL_AMOUNT_FIELD, Order, OrderProduct, Payment
+from .models import Granularity, OrderRollup, PaymentRollup, ProductSalesRollup, RollupWatermark
+
+WATERMARK = 'rollups'
+
+# Grouping and summed fields of every rollup
+KEYS = {
+    OrderRollup: ('status',),
+    ProductSalesRollup: ('product_id', 'order_status'),
+    PaymentRollup: ('status',),
+}
+TOTALS = {
+    OrderRollup: ('order_count', 'revenue'),
+    ProductSalesRollup: ('order_count', 'quantity', 'revenue'),
+    PaymentRollup: ('payment_count', 'amount'),
+}
+
+# Payments that went through, refunded ones included
+SUCCEEDED_STATUSES = {Payment.PaymentStatus.PAID, Payment.PaymentStatus.REFUNDED}
+
+
+class RollupsLocked(Exception):
+    """Raised when another update holds the lease of the watermark"""
+
+
+def acquire_lease(name):
+    """
+    Takes the lease of a watermark, creating its row when missing.
+
+    Returns:
+        RollupWatermark: The watermark, its ``lock_token`` identifying the lease.
+    Raises:
+        RollupsLocked: When another update holds the lease.
+    """
+    RollupWatermark.objects.bulk_create([RollupWatermark(name=name)], ignore_conflicts=True)
+    now = timezone.now()
+    token = uuid.uuid4().hex
+
+    claimed = RollupWatermark.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now), name=name
+    ).update(lock_token=token, locked_until=now + timedelta(seconds=settings.ROLLUP_LEASE))
+    if not claimed:
+        raise RollupsLocked(f"Another update of the {name} rollups is under way")
+    return RollupWatermark.objects.get(name=name)
+
+
+def renew_lease(watermark):
+    """
+    Extends the lease of the watermark.
+
+    Raises:
+        RollupsLocked: When the lease lapsed and another update took it.
+    """
+    locked_until = timezone.now() + timedelta(seconds=settings.ROLLUP_LEASE)
+    if not RollupWatermark.objects.filter(pk=watermark.pk, lock_token=watermark.lock_token).update(
+        locked_until=locked_until
+    ):
+        raise RollupsLocked(f"The lease of the {watermark.name} rollups lapsed")
+
+
+def release_lease(watermark, **changes):
+    """Gives the lease of the watermark up, applying ``changes`` to its row"""
+    RollupWatermark.objects.filter(pk=watermark.pk, lock_token=watermark.lock_token).update(
+        lock_token=None, locked_until=None, **changes
+    )
+
+
+def changed_days(since):
+    """Start of every day with orders, order lines or payments changed after ``since``"""
+    sources = [
+        Order.objects.filter(updated_at__gt=since).values_list(TruncDay('created_at')),
+        OrderProduct.objects.filter(updated_at__gt=since).values_list(TruncDay('order__created_at')),
+        Payment.objects.filter(updated_at__gt=since).values_list(TruncDay('created_at')),
+    ]
+    days = set()
+    for queryset in sources:
+        days.update(day for day, in queryset.order_by().distinct())
+    return sorted(days)
+
+
+def all_days():
+    """Start of every day with orders or payments"""
+    days = set()
+    for model in (Order, Payment):
+        days.update(day for day, in model.objects.values_list(TruncDay('created_at')).order_by().distinct())
+    return sorted(days)
+
+
+def hourly_rows(day):
+    """``.values()`` rows of the hourly buckets of a day, by rollup model"""
+    end = day + timedelta(days=1)
+    return {
+        OrderRollup: (
+            Order.objects
+            .filter(created_at__gte=day, created_at__lt=end)
+            .values('status', bucket=TruncHour('created_at'))
+            .annotate(order_count=Count('id'), revenue=Sum('total_amount'))
+        ),
+        ProductSalesRollup: (
+            OrderProduct.objects
+            .filter(order__created_at__gte=day, order__created_at__lt=end)
+            .values('product_id', bucket=TruncHour('order__created_at'), order_status=F('order__status'))
+            # Before quantity is shadowed by its sum
+            .annotate(revenue=Sum(F('price') * F('quantity'), output_field=TOTAL_AMOUNT_FIELD))
+            .annotate(order_count=Count('order_id', distinct=True), quantity=Sum('quantity'))
+        ),
+        PaymentRollup: (
+            Payment.objects
+            .filter(created_at__gte=day, created_at__lt=end)
+            .values('status', bucket=TruncHour('created_at'))
+            .annotate(payment_count=Count('id'), amount=Sum('amount'))
+        ),
+    }
+
+
+def rebuild_day(day):
+    """
+    Replaces the hourly and daily rollups of a day with ones computed from
+    the source tables.
+
+    Returns:
+        int: Number of hourly rollup rows written.
+    """
+    end = day + timedelta(days=1)
+    written = 0
+
+    with transaction.atomic():
+        for model, rows in hourly_rows(day).items():
+            rows = list(rows.order_by())
+
+            daily = {}
+            for row in rows:
+                totals = daily.setdefault(tuple(row[name] for name in KEYS[model]), dict.fromkeys(TOTALS[model], 0))
+                for name in TOTALS[model]:
+                    totals[name] += row[name]
+
+            model.objects.filter(bucket__gte=day, bucket__lt=end).delete()
+            model.objects.bulk_create(
+                [model(granularity=Granularity.HOUR, **row) for row in rows]
+                + [
+                    model(granularity=Granularity.DAY, bucket=day, **dict(zip(KEYS[model], key)), **totals)
+                    for key, totals in daily.items()
+                ],
+                batch_size=1000
+            )
+            written += len(rows)
+
+    return written
+
+
+def update(rebuild=False):
+    """
+    Brings the rollups up to date with the changes made since the last
+    update, or rebuilds all of them.
+
+    Returns:
+        list: Start of every day rebuilt.
+    Raises:
+        RollupsLocked: When another update is under way.
+    """
+    watermark = acquire_lease(WATERMARK)
+    # Changes made from now on are left to the next update
+    now = timezone.now()
+
+    try:
+        if rebuild or watermark.value is None:
+            days = all_days()
+        else:
+            days = changed_days(watermark.value - timedelta(seconds=settings.ROLLUP_WATERMARK_OVERLAP))
+
+        for day in days:
+            # Commits the day
+            rebuild_day(day)
+            renew_lease(watermark)
+    except BaseException:
+        release_lease(watermark)
+        raise
+
+    release_lease(watermark, value=now)
+    return days
+
+
+def payment_summaries(rollups):
+    """
+    Totals of ``PaymentRollup`` rows per bucket, in the order of the rows.
+    The success rate is the share of the payments no longer pending that
+    succeeded, None while all are pending.
+    """
+    summaries = {}
+    for rollup in rollups:
+        summary = summaries.setdefault(rollup.bucket, {
+            'bucket': rollup.bucket,
+            'payment_count': 0,
+            'pending_count': 0,
+            'succeeded_count': 0,
+            'succeeded_amount': Decimal('0'),
+        })
+        summary['payment_count'] += rollup.payment_count
+        if rollup.status == Payment.PaymentStatus.PENDING:
+            summary['pending_count'] += rollup.payment_count
+        elif rollup.status in SUCCEEDED_STATUSES:
+            summary['succeeded_count'] += rollup.payment_count
+            summary['succeeded_amount'] += rollup.amount
+
+    for summary in summaries.values():
+        finished = summary['payment_count'] - summary['pending_count']
+        summary['success_rate'] = summary['succeeded_count'] / finished if finished else None
+    return list(summaries.values())
@@ -0,0 +1,192 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from api.authentication import clear_caches as clear_auth_caches
+from app.models import Order, OrderProduct, Product, Payment
+from app.testing import QueryBudgetMixin, force_jwt_login
+from reports import rollups
+from reports.models import Granularity, OrderRollup, PaymentRollup, ProductSalesRollup, RollupWatermark
+
+
+class RollupTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer')
+        cls.staff = User.objects.create_user('finance', is_staff=True)
+        cls.apple = Product.objects.create(name='Apple', price=Decimal('2.00'), currency=Product.Currency.UZS)
+        cls.pear = Product.objects.create(name='Pear', price=Decimal('3.00'), currency=Product.Currency.UZS)
+        cls.day = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=3)
+
+    def setUp(self):
+        super().setUp()
+        clear_auth_caches()
+
+    def add_order(self, created_at, lines, payment_status=None):
+        order = Order.objects.create(user=self.user)
+        for product, quantity in lines:
+            OrderProduct.objects.create(order=order, product=product, quantity=quantity)
+        order.refresh_from_db()
+        payment = Payment.create_for_order(order)
+        if payment_status:
+            payment.transition(payment_status)
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        Payment.objects.filter(pk=payment.pk).update(created_at=created_at)
+        return order, payment
+
+    def add_orders(self):
+        ten = self.day + timedelta(hours=10)
+        self.add_order(ten + timedelta(minutes=15), [(self.apple, 2), (self.pear, 1)], Payment.PaymentStatus.PAID)
+        self.add_order(ten + timedelta(minutes=45), [(self.apple, 1)], Payment.PaymentStatus.FAILED)
+        self.add_order(self.day + timedelta(hours=14), [(self.pear, 2)])
+        return self.add_order(self.day + timedelta(days=1, hours=9), [(self.apple, 5)], Payment.PaymentStatus.PAID)
+
+    def rollup(self, model, granularity, bucket, **keys):
+        return model.objects.get(granularity=granularity, bucket=bucket, **keys)
+
+    def test_rebuild_builds_hourly_and_daily_buckets(self):
+        self.add_orders()
+        self.assertEqual(rollups.update(), [self.day, self.day + timedelta(days=1)])
+
+        ten = self.day + timedelta(hours=10)
+        paid = self.rollup(OrderRollup, Granularity.HOUR, ten, status='PAID')
+        self.assertEqual((paid.order_count, paid.revenue), (1, Decimal('7.00')))
+        self.assertEqual(self.rollup(OrderRollup, Granularity.DAY, self.day, status='PENDING').order_count, 2)
+
+        apples = self.rollup(ProductSalesRollup, Granularity.HOUR, ten, product=self.apple, order_status='PENDING')
+        self.assertEqual((apples.order_count, apples.quantity, apples.revenue), (1, 1, Decimal('2.00')))
+        pears = self.rollup(ProductSalesRollup, Granularity.DAY, self.day, product=self.pear, order_status='PENDING')
+        self.assertEqual((pears.order_count, pears.quantity, pears.revenue), (1, 2, Decimal('6.00')))
+
+        payments = PaymentRollup.objects.filter(granularity=Granularity.DAY, bucket=self.day)
+        self.assertEqual(
+            {(rollup.status, rollup.payment_count) for rollup in payments},
+            {('PAID', 1), ('FAILED', 1), ('PENDING', 1)}
+        )
+        self.assertEqual(OrderRollup.objects.filter(granularity=Granularity.HOUR).count(), 4)
+
+    @override_settings(ROLLUP_WATERMARK_OVERLAP=0)
+    def test_update_rebuilds_only_changed_days(self):
+        __, payment = self.add_orders()
+        rollups.update()
+        self.assertEqual(rollups.update(), [])
+
+        pending = Payment.objects.get(status='PENDING')
+        pending.transition(Payment.PaymentStatus.CANCELED)
+        self.assertEqual(rollups.update(), [self.day])
+        self.assertEqual(self.rollup(PaymentRollup, Granularity.DAY, self.day, status='CANCELED').payment_count, 1)
+        self.assertFalse(PaymentRollup.objects.filter(bucket__gte=self.day, status='PENDING').exists())
+
+        payment.transition(Payment.PaymentStatus.REFUNDED)
+        self.assertEqual(rollups.update(), [self.day + timedelta(days=1)])
+        self.assertEqual(
+            self.rollup(OrderRollup, Granularity.DAY, self.day + timedelta(days=1), status='CANCELED').revenue,
+            Decimal('10.00')
+        )
+
+    def test_price_changes_keep_the_revenue_of_paid_orders(self):
+        self.add_orders()
+        rollups.update()
+        paid = self.rollup(ProductSalesRollup, Granularity.DAY, self.day, product=self.pear, order_status='PAID')
+
+        self.pear.price = Decimal('30.00')
+        self.pear.save()
+        rollups.update(rebuild=True)
+        self.assertEqual(
+            self.rollup(ProductSalesRollup, Granularity.DAY, self.day, product=self.pear, order_status='PAID').revenue,
+            paid.revenue
+        )
+        # Pending orders follow the catalog
+        self.assertEqual(
+            self.rollup(ProductSalesRollup, Granularity.DAY, self.day, product=self.pear, order_status='PENDING').revenue,
+            Decimal('60.00')
+        )
+
+    def test_overlapping_updates_are_refused(self):
+        self.add_orders()
+        watermark = rollups.acquire_lease(rollups.WATERMARK)
+        with self.assertRaises(rollups.RollupsLocked):
+            rollups.update()
+        with self.assertRaisesMessage(CommandError, 'under way'):
+            call_command('update_rollups', stdout=StringIO())
+
+        rollups.release_lease(watermark)
+        self.assertEqual(len(rollups.update()), 2)
+        self.assertIsNone(RollupWatermark.objects.get().lock_token)
+
+    def test_failed_updates_keep_the_watermark(self):
+        self.add_orders()
+        rebuilt, original = [], rollups.rebuild_day
+
+        def rebuild_day(day):
+            if rebuilt:
+                raise OperationalError("Connection lost")
+            rebuilt.append(original(day))
+
+        with mock.patch.object(rollups, 'rebuild_day', side_effect=rebuild_day), self.assertRaises(OperationalError):
+            rollups.update()
+        # The first day is committed, the watermark and the lease are not kept
+        self.assertTrue(OrderRollup.objects.filter(bucket=self.day).exists())
+        watermark = RollupWatermark.objects.get()
+        self.assertEqual((watermark.value, watermark.lock_token), (None, None))
+        self.assertEqual(rollups.update(), [self.day, self.day + timedelta(days=1)])
+
+    def test_reports_endpoint(self):
+        self.add_orders()
+        call_command('update_rollups', stdout=StringIO())
+        force_jwt_login(self.client, self.staff)
+
+        response = self.client.get(reverse('reports'))
+        self.assertQueryBudget(response)
+        data = response.json()
+        self.assertEqual(data['granularity'], 'day')
+        self.assertEqual(
+            [(row['status'], row['order_count']) for row in data['orders']],
+            [('PAID', 1), ('PENDING', 2), ('PAID', 1)]
+        )
+        self.assertEqual(data['payments'][0], {
+            'bucket': data['orders'][0]['bucket'],
+            'payment_count': 3,
+            'pending_count': 1,
+            'succeeded_count': 1,
+            'succeeded_amount': '7.00',
+            'success_rate': 0.5,
+        })
+        self.assertEqual(data['payments'][1]['success_rate'], 1.0)
+
+        since = self.day + timedelta(hours=10)
+        hours = self.client.get(reverse('reports'), {
+            'granularity': 'hour', 'since': since.isoformat(), 'until': (since + timedelta(hours=1)).isoformat()
+        }).json()
+        self.assertEqual([row['order_count'] for row in hours['orders']], [1, 1])
+        self.assertEqual(len(hours['products']), 3)
+        self.assertIsNone(hours['next'])
+
+        # Product sales are paginated, within a bucket too
+        page = self.client.get(reverse('reports'), {
+            'granularity': 'hour', 'since': since.isoformat(), 'until': (since + timedelta(hours=1)).isoformat(),
+            'page_size': 1,
+        }).json()
+        products = page['products']
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            self.assertEqual(page['orders'], hours['orders'])
+            products += page['products']
+        self.assertEqual(products, hours['products'])
+        self.assertEqual(len({row['bucket'] for row in products}), 1)
+        self.assertEqual(self.client.get(reverse('reports'), {'cursor': 'nope'}).status_code, 404)
+
+        too_long = {'granularity': 'hour', 'since': (since - timedelta(days=60)).isoformat()}
+        self.assertEqual(self.client.get(reverse('reports'), too_long).status_code, 400)
+
+        force_jwt_login(self.client, self.user)
+        self.assertEqual(self.client.get(reverse('reports')).status_code, 403)